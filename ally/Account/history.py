@@ -20,12 +20,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from .. import schema
 from ..Api import AccountEndpoint, RequestType
 
 
 class History(AccountEndpoint):
     _type = RequestType.Info
     _resource = "accounts/{0}/history.json"
+    _schema = schema.HISTORY
 
     @staticmethod
     def _process(entry):
@@ -100,21 +102,15 @@ class History(AccountEndpoint):
         data = None
         return params, data
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        # Create dataframe from our dataset
-        df = pd.DataFrame(raw).apply(
-            # And also cast relevent fields to numeric values
-            pd.to_numeric,
-            errors="ignore",
-        )
-        df["date"] = pd.to_datetime(df["date"])
-        return df
+        # Columns come typed already, dates included
+        return pd.DataFrame(cls.Columns(raw))
 
 
-def history(self, dataframe: bool = True, block: bool = True):
+def history(self, dataframe: bool = True, block: bool = True, columnar: bool = False):
     """Gets the transaction history for the account.
 
     Calls the 'accounts/./history.json' endpoint to get list of all trade
@@ -125,6 +121,7 @@ def history(self, dataframe: bool = True, block: bool = True):
     Args:
             dataframe: Specify an output format
             block: Specify whether to block thread if request exceeds rate limit
+            columnar: Return a dictionary of typed numpy arrays, one per field, instead
 
     Returns:
             Default: Pandas dataframe
@@ -138,6 +135,9 @@ def history(self, dataframe: bool = True, block: bool = True):
         auth=self.auth, account_nbr=self.account_nbr, block=block
     ).request()
 
+    if columnar:
+        return None if result is None else History.Columns(result)
+
     if dataframe:
         try:
             result = History.DataFrame(result)
@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from .. import schema
 from ..Api import AccountEndpoint, RequestType
 from ..utils import option_format
 
@@ -27,6 +28,7 @@ from ..utils import option_format
 class Holdings(AccountEndpoint):
     _type = RequestType.Info
     _resource = "accounts/{0}/holdings.json"
+    _schema = schema.HOLDING
 
     @staticmethod
     def _flatten_holding(holding):
@@ -62,14 +64,14 @@ class Holdings(AccountEndpoint):
 
         return list(map(Holdings._flatten_holding, holdings))
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        return pd.DataFrame(raw)
+        return pd.DataFrame(cls.Columns(raw))
 
 
-def holdings(self, dataframe: bool = True, block: bool = True):
+def holdings(self, dataframe: bool = True, block: bool = True, columnar: bool = False):
     """Gets all current account holdings.
 
     Calls the 'accounts/./history.json' endpoint to get list of all current account
@@ -79,6 +81,7 @@ def holdings(self, dataframe: bool = True, block: bool = True):
     Args:
             dataframe: Specify an output format
             block: Specify whether to block thread if request exceeds rate limit
+            columnar: Return a dictionary of typed numpy arrays, one per field, instead
 
     Returns:
             A pandas dataframe by default,
@@ -88,6 +91,9 @@ def holdings(self, dataframe: bool = True, block: bool = True):
         auth=self.auth, account_nbr=self.account_nbr, block=block
     ).request()
 
+    if columnar:
+        return None if result is None else Holdings.Columns(result)
+
     if dataframe:
         try:
             result = Holdings.DataFrame(result)
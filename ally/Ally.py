@@ -40,14 +40,31 @@ class Ally:
     from .Account import get_accounts, balances, history, holdings
     from .Info import clock, status
     from .News import lookupNews, searchNews
-    from .Option import expirations, optionSearchQuery, search, strikes
+    from .Option import expirations, option_chain, optionSearchQuery, search, strikes
     from .Order import orders, submit
-    from .Quote import quote, stream, timesales, toplists
+    from .Quote import (
+        cache_quotes,
+        coalesce_quotes,
+        iter_timesales,
+        quote,
+        store_timesales,
+        stream,
+        stream_bars,
+        subscribe,
+        timesales,
+        timesales_many,
+        toplists,
+    )
 
     auth = None
     account_nbr = None
+    quote_coalescer = None
+    quote_cache = None
+    timesales_store = None
+    stream_hub = None
+    stream_metrics = None
 
-    def __init__(self, keys = ApiKeys(), timeout: float = 1.0):
+    def __init__(self, keys: ApiKeys = None, timeout: float = 1.0):
         """Manages all facets of your Ally Invest account.
 
         Manage your account
@@ -73,7 +90,8 @@ class Ally:
 
                 #. A dictionary: { ALLY_OAUTH_SECRET: ...}
                 #. A string: (filename to json file containing api keys)
-                #. None (default): Grab the api keys from environment variables
+                #. None (default): Grab the api keys from environment variables,
+                   when Ally() is called
 
                 For any of the mediums above, be sure to provide all of the keys:
 
@@ -91,6 +109,10 @@ class Ally:
         .. _Quotes: quotes.html
         .. _Account: account.html
         """
+        # Read the environment now, not at import
+        if keys is None:
+            keys = ApiKeys()
+
         # Store keys
         self.keys: ApiKeys = keys
 
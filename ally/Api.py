@@ -35,13 +35,15 @@
 
 import datetime
 import json
+import socket
+import time
 
-from requests import Request, Session
+from requests import Request
 from requests.exceptions import HTTPError, Timeout
 
-from . import RateLimit
+from . import RateLimit, Transport
 from .classes import RequestType
-from .utils import JSONStreamParser, pretty_print_POST
+from .utils import JSONStreamDecoder, StreamMetrics, columnar, pretty_print_POST
 
 # Global timeout variable
 _timeout = 1.0
@@ -71,6 +73,9 @@ class Endpoint:
     # results
     _results = None
 
+    # Field name -> Field, see ally.schema
+    _schema = None
+
     req = None
 
     @classmethod
@@ -92,6 +97,11 @@ class Endpoint:
         """Return get params together with post body data"""
         return None, None
 
+    @classmethod
+    def Columns(cls, raw):
+        """Typed numpy arrays, one per field, built from extracted records"""
+        return columnar(raw, cls._schema)
+
     def request(self=None, block: bool = True):
         """Gets data from API server.
 
@@ -104,23 +114,36 @@ class Endpoint:
                 ally.exceptions.RateLimitException: if 429 or we expect 429 encountered
         """
 
-        # Let ratelimit handle raise or block
-        RateLimit.check(self._type, block=block)
+        # Let ratelimit handle raise or block, and hold our place
+        RateLimit.reserve(self._type, block=block)
 
         # use current session instance to send prepared request
-        x = self.s.send(self.req)
+        try:
+            x = self.s.send(self.req)
+        except:
+            # Never answered, so give the token back
+            RateLimit.cancel(self._type)
+            raise
+
+        return self.handle(x)
+
+    def handle(self, x):
+        """Process the server's response to our request.
 
+        Informs the rate limiter, raises on HTTP errors,
+        and extracts the result from the response.
+        """
         # Did Ally just complain?
         if x.status_code == 429:
             RateLimit.force_update(self._type)
         else:
 
-            # All errors, including as noted
-            x.raise_for_status()
-
             # Give the rate manager the information we learned
             RateLimit.normal_update(dict(x.headers), self._type)
 
+            # All errors, including as noted
+            x.raise_for_status()
+
             self.response = x.json().get("response")
             return self.extract(x)
 
@@ -133,11 +156,11 @@ class Endpoint:
         # Get post and get data
         send_params, send_data = self.req_body(**kwargs)
 
-        # Get the session
+        # Get the session, shared with every other endpoint
         if auth is not None:
             self.s = auth.sess
         else:
-            self.s = Session()
+            self.s = Transport.session()
 
         req_auth = None if auth is None else auth.auth
 
@@ -176,26 +199,73 @@ class StreamEndpoint(AuthenticatedEndpoint):
 
     _host = "https://devapi-stream.invest.ally.com/v1/"
 
-    def request(self=None):
-        """Execute an entire loop, and aggregate results"""
+    # Set by close(), from any thread
+    closed = False
+    _response = None
+
+    # StreamMetrics, created by request() unless shared beforehand
+    metrics = None
+
+    def request(self=None, timeout: float = None, on_connect=None):
+        """Execute an entire loop, and aggregate results
+
+        timeout: seconds to wait for any data before giving up, default forever
+        on_connect: called once the server accepted the stream
+        """
+        if self.metrics is None:
+            self.metrics = StreamMetrics()
+        metrics = self.metrics
 
         # use current session instance to send prepared request
-        x = self.s.send(self.req, stream=True)
+        x = self.s.send(self.req, stream=True, timeout=timeout)
+        self._response = x
+
+        # Closed while connecting
+        if self.closed:
+            x.close()
+            return
 
         x.raise_for_status()
+        metrics.count("connects")
+
+        if on_connect is not None:
+            on_connect()
+
+        decoder = JSONStreamDecoder()
+        clock = time.perf_counter
 
-        p = JSONStreamParser()
+        try:
+            # chunk_size=None hands over data as soon as it arrives,
+            #  in whatever size the server sent it
+            for chunk in x.iter_content(chunk_size=None):
+                start = clock()
+                rows = decoder.feed(chunk)
+                metrics.chunk(len(chunk), rows, clock() - start)
 
-        for chunk in x.iter_content(chunk_size=1):
-            it = p.stream(chunk.decode("utf-8"))
-            while True:
-                try:
-                    row = next(it)
-                except StopIteration:
-                    pass
-                else:
+                for row in rows:
                     if "quote" in row or "trade" in row:
                         yield row
-                finally:
-                    del it
-                    break
+        except Exception:
+            # close() pulls the connection out from under us
+            if not self.closed:
+                raise
+        finally:
+            x.close()
+
+    def close(self):
+        """End a running request(), from any thread"""
+        self.closed = True
+
+        x = self._response
+        if x is None:
+            return
+
+        # Closing alone waits for the next chunk to arrive,
+        #  shutting the socket down wakes the reader right away
+        sock = getattr(getattr(x.raw, "_connection", None), "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        x.close()
@@ -0,0 +1,443 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The ally.AsyncAlly module/file.
+
+Controls the AsyncAlly() account class, the asyncio flavor of ally.Ally().
+
+Requests are built and signed by the very same endpoint classes the blocking
+client uses, then sent over a single aiohttp session. The library must be
+installed separately (pip install aiohttp).
+"""
+
+import asyncio
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from . import RateLimit
+from .Account.accounts import Accounts
+from .Account.balances import Balances
+from .Account.history import History
+from .Account.holdings import Holdings
+from .Auth import Auth
+from .Info import Clock, Status
+from .News.Lookup import LookupNews
+from .News.Search import SearchNews
+from .Option.expirations import Expirations
+from .Option.search import Search
+from .Option.strikes import Strikes
+from .Order.Outstanding import OutstandingOrders
+from .Order.Submit import Submission
+from .Quote.quote import Quote, chunks, merge, split
+from .Quote.stream import Stream
+from .Quote.timesales import Timesales
+from .Quote.toplists import TopLists
+from .classes import ApiKeys
+from .exception import RateLimitException
+from .utils import JSONStreamDecoder
+
+# Headers that aiohttp must manage itself
+_hop_headers = ("Connection", "Content-Length")
+
+
+def _response(status, reason, url, headers, body):
+    """Wrap an aiohttp result in a requests.Response,
+    so that Endpoint.handle() and Endpoint.extract() work unchanged
+    """
+    x = Response()
+    x.status_code = status
+    x.reason = reason
+    x.url = url
+    x.headers = CaseInsensitiveDict(headers)
+    x.encoding = "utf-8"
+    x._content = body
+    return x
+
+
+def _frame(endpoint, result, dataframe, columnar=False):
+    """Optionally convert to columns or dataframe, leaving result alone on failure"""
+    if columnar:
+        # None when rate limited, like the other return types
+        return None if result is None else endpoint.Columns(result)
+    if dataframe:
+        try:
+            result = endpoint.DataFrame(result)
+        except:
+            pass
+    return result
+
+
+class AsyncAlly:
+    """The ally.AsyncAlly.AsyncAlly class.
+
+    Same calls as ally.Ally, but each one is a coroutine.
+    """
+
+    from .Option import optionSearchQuery
+
+    auth = None
+    account_nbr = None
+
+    def __init__(self, keys: ApiKeys = None, timeout: float = 10.0, limit: int = 100):
+        """Manages your Ally Invest account from an asyncio event loop.
+
+        Every endpoint of ally.Ally is available, with the same arguments and
+        return values, but must be awaited. Many calls can be in flight at once,
+        all sharing one pool of connections.
+
+        Arguments:
+            keys: ApiKeys, or None to read the keys from environment variables
+            timeout (float): number of seconds to wait before failing unresponsive api call
+            limit (int): maximum number of simultaneous connections
+
+        Example:
+
+        .. code-block:: python
+
+            async with ally.AsyncAlly() as a:
+                quotes, clock = await asyncio.gather(
+                    a.quote(['spy', 'gld']),
+                    a.clock(),
+                )
+
+                async for q in a.stream('tsla'):
+                    print(q)
+
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("AsyncAlly requires aiohttp (pip install aiohttp)")
+
+        self._aiohttp = aiohttp
+
+        if keys is None:
+            keys = ApiKeys()
+
+        self.keys: ApiKeys = keys
+        self.auth = Auth(keys)
+        self.account_nbr = keys["ALLY_ACCOUNT_NBR"]
+
+        self.timeout = timeout
+        self.limit = limit
+
+        # Created lazily, must belong to a running loop
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = self._aiohttp.ClientSession(
+                connector=self._aiohttp.TCPConnector(limit=self.limit)
+            )
+        return self._session
+
+    async def close(self):
+        """Close all open connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    ########### PLUMBING
+
+    @staticmethod
+    async def _reserve(req_type, block: bool):
+        """Like RateLimit.reserve, but yields to the loop instead of sleeping"""
+        while True:
+            delay = RateLimit.try_reserve(req_type)
+            if delay == 0.0:
+                return
+            if not block:
+                raise RateLimitException("Too many attempts.")
+
+            # Tokens can also be given back early, so check in now and then
+            await asyncio.sleep(min(delay, 1.0))
+
+    def _send(self, endpoint, timeout):
+        """Send an endpoint's prepared (and signed) request over our session"""
+        from yarl import URL
+
+        req = endpoint.req
+
+        # OAuth1 can leave some headers as bytes
+        headers = {}
+        for k, v in req.headers.items():
+            k = k.decode() if isinstance(k, bytes) else k
+            if k not in _hop_headers:
+                headers[k] = v.decode() if isinstance(v, bytes) else v
+
+        return self.session.request(
+            req.method,
+            # Already quoted and signed, so leave it be
+            URL(req.url, encoded=True),
+            headers=headers,
+            data=req.body,
+            timeout=self._aiohttp.ClientTimeout(total=timeout),
+        )
+
+    async def _request(self, endpoint, block: bool = True):
+        """Asynchronous twin of Endpoint.request()"""
+        await self._reserve(endpoint._type, block)
+
+        try:
+            async with self._send(endpoint, self.timeout) as r:
+                body = await r.read()
+                x = _response(r.status, r.reason, str(r.url), r.headers, body)
+        except:
+            # Never answered, so give the token back
+            RateLimit.cancel(endpoint._type)
+            raise
+
+        return endpoint.handle(x)
+
+    ########### ACCOUNT
+
+    async def get_accounts(self, dataframe: bool = True, block: bool = True):
+        """Coroutine version of ally.Ally.get_accounts"""
+        result = await self._request(Accounts(auth=self.auth), block)
+        return _frame(Accounts, result, dataframe)
+
+    async def balances(self, dataframe: bool = True, block: bool = True):
+        """Coroutine version of ally.Ally.balances"""
+        ep = Balances(auth=self.auth, account_nbr=self.account_nbr)
+        return _frame(Balances, await self._request(ep, block), dataframe)
+
+    async def history(
+        self, dataframe: bool = True, block: bool = True, columnar: bool = False
+    ):
+        """Coroutine version of ally.Ally.history"""
+        ep = History(auth=self.auth, account_nbr=self.account_nbr)
+        return _frame(History, await self._request(ep, block), dataframe, columnar)
+
+    async def holdings(
+        self, dataframe: bool = True, block: bool = True, columnar: bool = False
+    ):
+        """Coroutine version of ally.Ally.holdings"""
+        ep = Holdings(auth=self.auth, account_nbr=self.account_nbr)
+        return _frame(Holdings, await self._request(ep, block), dataframe, columnar)
+
+    ########### INFO
+
+    async def clock(self, block: bool = True):
+        """Coroutine version of ally.Ally.clock"""
+        return await self._request(Clock(), block)
+
+    async def status(self, block: bool = True):
+        """Coroutine version of ally.Ally.status"""
+        return await self._request(Status(), block)
+
+    ########### NEWS
+
+    async def lookupNews(self, articleId, dataframe=True, block: bool = True):
+        """Coroutine version of ally.Ally.lookupNews"""
+        ep = LookupNews(
+            auth=self.auth, account_nbr=self.account_nbr, articleId=articleId
+        )
+        result = await self._request(ep, block)
+        return LookupNews.DataFrame(result) if dataframe else result
+
+    async def searchNews(
+        self,
+        symbols,
+        limit=None,
+        startdate: str = "",
+        enddate: str = "",
+        dataframe=True,
+        block: bool = True,
+    ):
+        """Coroutine version of ally.Ally.searchNews"""
+        ep = SearchNews(
+            auth=self.auth,
+            account_nbr=self.account_nbr,
+            symbols=symbols,
+            limit=limit,
+            startdate=startdate,
+            enddate=enddate,
+        )
+        result = await self._request(ep, block)
+        return SearchNews.DataFrame(result) if dataframe else result
+
+    ########### OPTIONS
+
+    async def expirations(self, symbol, useDatetime=True, block: bool = True):
+        """Coroutine version of ally.Ally.expirations"""
+        ep = Expirations(auth=self.auth, account_nbr=self.account_nbr, symbol=symbol)
+        ep.useDatetime = useDatetime
+        return await self._request(ep, block)
+
+    async def search(
+        self,
+        symbol,
+        query: list = [],
+        fields=[],
+        dataframe=True,
+        block: bool = True,
+        columnar: bool = False,
+    ):
+        """Coroutine version of ally.Ally.search"""
+        ep = Search(
+            auth=self.auth,
+            account_nbr=self.account_nbr,
+            symbol=symbol,
+            fields=fields,
+            query=query,
+        )
+        result = await self._request(ep, block)
+        if columnar:
+            return None if result is None else Search.Columns(result)
+        return Search.DataFrame(result) if dataframe else result
+
+    async def strikes(self, symbol, block: bool = True):
+        """Coroutine version of ally.Ally.strikes"""
+        ep = Strikes(auth=self.auth, account_nbr=self.account_nbr, symbol=symbol)
+        return await self._request(ep, block)
+
+    ########### ORDERS
+
+    async def orders(self, block: bool = True):
+        """Coroutine version of ally.Ally.orders"""
+        ep = OutstandingOrders(auth=self.auth, account_nbr=self.account_nbr)
+        return await self._request(ep, block)
+
+    async def submit(self, order, preview: bool = True, type_=None, block: bool = True):
+        """Coroutine version of ally.Ally.submit"""
+        if type_ is not None:
+            order.otype = type_
+
+        # Add the account number to this order
+        order.set_account(self.account_nbr)
+
+        ep = Submission(
+            auth=self.auth,
+            account_nbr=self.account_nbr,
+            preview=preview,
+            order=order,
+        )
+        return await self._request(ep, block)
+
+    ########### QUOTES
+
+    async def quote(
+        self,
+        symbols: list = [],
+        fields: list = [],
+        dataframe=True,
+        block: bool = True,
+        columnar: bool = False,
+    ):
+        """Coroutine version of ally.Ally.quote
+
+        Large symbol lists are split into chunks, all requested at once.
+        Chunks that fail or are rate limited raise PartialResultException,
+        carrying the quotes of the others, as ally.Ally.quote does.
+        """
+        pieces = chunks(split(symbols))
+        eps = [
+            Quote(
+                auth=self.auth,
+                account_nbr=self.account_nbr,
+                symbols=piece,
+                fields=fields,
+            )
+            for piece in pieces
+        ]
+        results = await asyncio.gather(
+            *(self._request(ep, block) for ep in eps), return_exceptions=True
+        )
+
+        # Nothing asked for is no quotes, not a rate limit
+        result = merge(pieces, results) if pieces else []
+        if columnar:
+            return None if result is None else Quote.Columns(result)
+        return Quote.DataFrame(result) if dataframe else result
+
+    async def timesales(
+        self,
+        symbols: str,
+        startdate: str,
+        enddate: str,
+        interval: str = "5min",
+        dataframe=True,
+        block: bool = True,
+        columnar: bool = False,
+    ):
+        """Coroutine version of ally.Ally.timesales"""
+        ep = Timesales(
+            auth=self.auth,
+            account_nbr=self.account_nbr,
+            symbols=symbols,
+            interval=interval,
+            startdate=startdate,
+            enddate=enddate,
+        )
+        result = await self._request(ep, block)
+        if columnar:
+            return None if result is None else Timesales.Columns(result)
+        return Timesales.DataFrame(result) if dataframe else result
+
+    async def toplists(
+        self,
+        whichList: str,
+        exchange: str = "Q",
+        dataframe: bool = True,
+        block: bool = True,
+        columnar: bool = False,
+    ):
+        """Coroutine version of ally.Ally.toplists"""
+        ep = TopLists(
+            auth=self.auth,
+            account_nbr=self.account_nbr,
+            exchange=exchange,
+            whichList=whichList,
+        )
+        result = await self._request(ep, block)
+        if columnar:
+            return None if result is None else TopLists.Columns(result)
+        return TopLists.DataFrame(result) if dataframe else result
+
+    async def stream(self, symbols: list = []):
+        """Asynchronous generator version of ally.Ally.stream
+
+        .. code-block:: python
+
+            async for quote in a.stream('tsla'):
+                print(quote)
+
+        """
+        ep = Stream(auth=self.auth, account_nbr=self.account_nbr, symbols=symbols)
+        decoder = JSONStreamDecoder()
+
+        # Long-lived, so no overall timeout
+        async with self._send(ep, None) as r:
+            r.raise_for_status()
+
+            async for chunk in r.content.iter_any():
+                for row in decoder.feed(chunk):
+                    if "quote" in row or "trade" in row:
+                        yield row
@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from .chain import option_chain
 from .classes import *
 from .expirations import expirations
 from .search import optionSearchQuery, search
@@ -0,0 +1,388 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Whole option chains, in as few market/options/search calls as possible.
+
+option_chain() turns the expirations wanted into xdate ranges, one per
+contiguous run of the symbol's listed expirations, and the moneyness into
+a strike range, so that every query asks for exactly what is wanted. The
+queries run concurrently, and their quotes land in one OptionChain of
+dense (expiry, strike, call/put) arrays.
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from ..exception import PartialResultException, RateLimitException
+from ..utils.columnar import TEXT
+from .search import Search
+
+# search() requests in flight at once
+FETCH_WORKERS = 4
+
+# Position of each side on the last axis of an OptionChain's arrays
+CALL = 0
+PUT = 1
+
+# Fields a chain can't be laid out without
+KEYS = ["xdate", "strikeprice", "put_call"]
+
+
+def _days(dates):
+    """Dates, as strings ('2020-08-14' or '20200814'), datetimes or
+    datetime64s, to a sorted datetime64[D] array without repeats"""
+    import numpy as np
+
+    days = []
+    for d in dates:
+        if isinstance(d, str) and len(d) == 8 and d.isdigit():
+            d = d[:4] + "-" + d[4:6] + "-" + d[6:]
+        elif hasattr(d, "date") and callable(d.date):
+            d = d.date()
+        days.append(np.datetime64(d, "D"))
+    return np.unique(np.array(days, dtype="M8[D]"))
+
+
+def plan(wanted, listed=None):
+    """Group expirations into as few xdate ranges as possible.
+
+    Args:
+            wanted: expirations to fetch, as for _days()
+
+            listed: every expiration the symbol has. Wanted expirations
+            with none listed between them share a range. Without it, each
+            expiration is its own
+
+    Returns:
+            Sorted list of (first, last) datetime64[D] pairs
+    """
+    import numpy as np
+
+    wanted = _days(wanted)
+    if not len(wanted):
+        return []
+
+    if listed is None:
+        return [(d, d) for d in wanted]
+
+    # Positions among the listed, or among the listed and the unlisted wanted
+    listed = np.union1d(_days(listed), wanted)
+    at = np.searchsorted(listed, wanted)
+
+    # A new run wherever a listed expiration was skipped
+    starts = np.flatnonzero(np.diff(at) != 1) + 1
+    return [(run[0], run[-1]) for run in np.split(wanted, starts)]
+
+
+def _query(run=None, strikes=None):
+    """search() query for a (first, last) run of expirations and a strike range"""
+    query = []
+    if run is not None:
+        first, last = (str(d).replace("-", "") for d in run)
+        if first == last:
+            query.append("xdate-eq:" + first)
+        else:
+            query += ["xdate-gte:" + first, "xdate-lte:" + last]
+
+    if strikes is not None:
+        # Rounded outwards to the cent, never narrower than asked
+        lo, hi = (round(x * 100, 6) for x in strikes)
+        query += [
+            "strikeprice-gte:{0:.2f}".format(math.floor(lo) / 100),
+            "strikeprice-lte:{0:.2f}".format(math.ceil(hi) / 100),
+        ]
+    return query
+
+
+class OptionChain:
+    """Quotes of a chain, as dense arrays of shape (expiry, strike, 2).
+
+    The last axis holds the call (CALL, 0) and the put (PUT, 1) of an
+    expiry and strike side by side. Contracts that don't exist are the
+    field's fill: NaN for floats, -1 for counts, NaT for dates and None
+    for text. present tells them apart.
+
+    Attributes:
+            symbol: the underlying
+
+            expirations: datetime64[D] array, the first axis
+
+            strikes: float array, the second axis, every strike of any expiry
+
+            fields: dictionary of field name to array
+
+            present: boolean array, True where a contract was quoted
+
+    Example:
+
+    .. code-block:: python
+
+            chain = a.option_chain('spy', expirations=2, moneyness=0.05)
+            bid = chain['bid']
+            bid[0, :, CALL], bid[0, :, PUT]   # nearest expiry, every strike
+            chain.get('2020-08-14', 330, 'put')['ask']
+            chain.DataFrame()
+    """
+
+    def __init__(self, symbol, expirations, strikes, fields, present):
+        self.symbol = symbol
+        self.expirations = expirations
+        self.strikes = strikes
+        self.fields = fields
+        self.present = present
+
+    @classmethod
+    def from_columns(cls, symbol, cols):
+        """Lay out typed columns of option quotes, see Search.Columns"""
+        import numpy as np
+
+        n = len(next(iter(cols.values()), ()))
+        xdate = cols.get("xdate", np.full(n, "NaT", dtype="M8[D]"))
+        strike = cols.get("strikeprice", np.full(n, np.nan))
+        side = cols.get("put_call", np.full(n, None, dtype=object))
+
+        # Quotes that can't be placed are dropped
+        is_call, is_put = side == "call", side == "put"
+        keep = ~np.isnat(xdate) & ~np.isnan(strike) & (is_call | is_put)
+
+        expirations = np.unique(xdate[keep])
+        strikes = np.unique(strike[keep])
+        at = (
+            np.searchsorted(expirations, xdate[keep]),
+            np.searchsorted(strikes, strike[keep]),
+            np.where(is_put[keep], PUT, CALL),
+        )
+        shape = (len(expirations), len(strikes), 2)
+
+        present = np.zeros(shape, dtype=bool)
+        present[at] = True
+
+        fields = {}
+        for name, values in cols.items():
+            field = Search._schema.get(name, TEXT)
+            out = np.full(shape, field.fill, dtype=values.dtype)
+            out[at] = values[keep]
+            fields[name] = out
+
+        return cls(symbol, expirations, strikes, fields, present)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def __len__(self):
+        """Contracts in the chain"""
+        return int(self.present.sum())
+
+    def get(self, expiry, strike, put_call):
+        """One contract's quote as a dictionary, None if it isn't in the chain
+
+        put_call: 'call' or 'put', or CALL or PUT
+        """
+        import numpy as np
+
+        day = _days([expiry])[0]
+        e = np.searchsorted(self.expirations, day)
+        k = np.searchsorted(self.strikes, strike)
+        side = {"call": CALL, "put": PUT}.get(put_call, put_call)
+
+        if (
+            e == len(self.expirations)
+            or k == len(self.strikes)
+            or self.expirations[e] != day
+            or self.strikes[k] != strike
+            or not self.present[e, k, side]
+        ):
+            return None
+        return {name: values[e, k, side] for name, values in self.fields.items()}
+
+    def DataFrame(self):
+        """One row per expiry and strike, with columns (field, 'call'/'put')"""
+        import numpy as np
+        import pandas as pd
+
+        e, k = len(self.expirations), len(self.strikes)
+        index = pd.MultiIndex.from_arrays(
+            [np.repeat(self.expirations, k), np.tile(self.strikes, e)],
+            names=["expiry", "strike"],
+        )
+        columns = pd.MultiIndex.from_product(
+            [list(self.fields), ["call", "put"]], names=["field", "side"]
+        )
+
+        # Rows where neither side was quoted are left out
+        listed = self.present.reshape(e * k, 2).any(axis=1)
+        data = {
+            (name, side): values[:, :, i].reshape(e * k)[listed]
+            for name, values in self.fields.items()
+            for i, side in enumerate(("call", "put"))
+        }
+        return pd.DataFrame(data, index=index[listed], columns=columns)
+
+
+def option_chain(
+    self,
+    symbol: str,
+    expirations=None,
+    moneyness=None,
+    spot: float = None,
+    fields=[],
+    block: bool = True,
+    workers: int = FETCH_WORKERS,
+):
+    """Gets a whole option chain at once, laid out by expiry, strike and side.
+
+    Plans the fewest 'market/options/search.json' queries that cover the
+    chain, runs them concurrently, and puts their quotes into one
+    OptionChain of dense arrays, calls and puts side by side.
+
+    Args:
+            symbol: the underlying
+
+            expirations:
+                    None for every expiration, in a single query.
+                    A number n for the nearest n, in one query, after one
+                    expirations() call.
+                    A list of dates ('2020-08-14', '20200814' or datetimes):
+                    expirations() is called for three or more, so that those
+                    with none listed in between share a query
+
+            moneyness:
+                    None for every strike. A fraction m for strikes within
+                    m of the spot price either way, or a pair (lo, hi) for
+                    strikes from lo * spot to hi * spot
+
+            spot: price of the underlying moneyness is relative to. Fetched
+            with quote() if not given
+
+            fields: (Optional) option fields to fetch, as for search(). The
+            expiry, strike and side are always added
+
+            block: Specify whether to block thread if request exceeds rate limit
+
+            workers: requests in flight at once
+
+    Returns:
+            An OptionChain
+
+    Raises:
+            RateLimitException: If block=False, rate limit problems will be raised
+
+            PartialResultException: If some queries failed or were rate
+            limited. The chain made of the others is in its .results, and
+            .errors maps the (first, last) expirations of each failed
+            query to its exception
+
+    Example:
+
+    .. code-block:: python
+
+            # The next three expirations, strikes within 10% of the last price
+            chain = a.option_chain('spy', expirations=3, moneyness=0.1)
+            chain['imp_volatility'][:, :, CALL]
+
+    """
+    symbol = symbol.upper()
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        fields = list(dict.fromkeys(KEYS + list(fields)))
+
+    if isinstance(expirations, str):
+        expirations = expirations.split(",")
+
+    if isinstance(moneyness, (int, float)):
+        moneyness = (1 - moneyness, 1 + moneyness)
+
+    listing = isinstance(expirations, int) or (
+        expirations is not None and len(expirations) >= 3
+    )
+
+    with ThreadPoolExecutor(workers) as pool:
+        # The listing and the spot price come out of different budgets
+        listed = quote = None
+        if listing:
+            listed = pool.submit(
+                self.expirations, symbol, useDatetime=False, block=block
+            )
+        if moneyness is not None and spot is None:
+            quote = pool.submit(
+                self.quote, symbol, fields=["last"], block=block, columnar=True
+            )
+
+        # Either comes back None when rate limited
+        if listed is not None:
+            listed = listed.result()
+            if listed is None:
+                raise RateLimitException("Rate limited, no expirations listed")
+        if quote is not None:
+            cols = quote.result()
+            if cols is None:
+                raise RateLimitException("Rate limited, no spot price")
+            spot = float(cols["last"][0])
+
+        if expirations is None:
+            ranges = [None]
+        elif isinstance(expirations, int):
+            ranges = plan(listed[:expirations], listed)
+        else:
+            ranges = plan(expirations, listed)
+
+        strikes = None
+        if moneyness is not None:
+            strikes = (spot * moneyness[0], spot * moneyness[1])
+
+        def fetch(run):
+            return Search(
+                auth=self.auth,
+                account_nbr=self.account_nbr,
+                symbol=symbol,
+                fields=fields,
+                query=_query(run, strikes),
+            ).request(block=block)
+
+        futures = [(run, pool.submit(fetch, run)) for run in ranges]
+
+        raw, errors = [], {}
+        for run, f in futures:
+            try:
+                result = f.result()
+            except Exception as e:
+                errors[run] = e
+                continue
+
+            if result is None:
+                errors[run] = RateLimitException("Rate limited, range not fetched")
+                continue
+
+            # A lone quote comes back as a dictionary
+            raw += [result] if isinstance(result, dict) else result
+
+    chain = OptionChain.from_columns(symbol, Search.Columns(raw))
+
+    if errors:
+        raise PartialResultException(
+            "{0} of {1} queries failed".format(len(errors), len(ranges)),
+            chain,
+            errors,
+        )
+
+    return chain
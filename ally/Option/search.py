@@ -22,6 +22,7 @@
 
 from typing import List
 
+from .. import schema
 from ..Api import AuthenticatedEndpoint, RequestType
 
 
@@ -70,6 +71,7 @@ class Search(AuthenticatedEndpoint):
     _type = RequestType.Info
     _resource = "market/options/search.json"
     _method = "POST"
+    _schema = schema.QUOTE
     _symbol: str = ""
     _queries: List = []
 
@@ -110,28 +112,26 @@ class Search(AuthenticatedEndpoint):
 
         return k
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        # Create dataframe from our dataset
-        df = (
-            pd.DataFrame(raw)
-            .replace({"na": None})
-            .apply(
-                # And also cast relevent fields to numeric values
-                pd.to_numeric,
-                errors="ignore",
-            )
+        # Columns come typed already
+        return (
+            pd.DataFrame(cls.Columns(raw))
             .set_index("symbol")
-            .drop(columns="basis")
+            .drop(columns="basis", errors="ignore")
         )
 
-        return df
-
 
 def search(
-    self, symbol, query: List = [], fields=[], dataframe=True, block: bool = True
+    self,
+    symbol,
+    query: List = [],
+    fields=[],
+    dataframe=True,
+    block: bool = True,
+    columnar: bool = False,
 ):
     """Searches for all option quotes on a symbol that satisfy some set of criteria
 
@@ -176,6 +176,7 @@ def search(
         fields: (Optional) List of attributes requested for each option contract found. If not specified, will return all applicable fields
         dataframe: (Optional) Return quotes in pandas dataframe
         block (bool): Specify whether to block thread if request exceeds rate limit
+        columnar (bool): (Optional) Return a dictionary of typed numpy arrays, one per field. Overrides dataframe
 
     Returns:
         Default: Pandas dataframe
@@ -221,6 +222,9 @@ def search(
         block=block,
     ).request()
 
+    if columnar:
+        return None if result is None else Search.Columns(result)
+
     if dataframe:
         try:
             result = Search.DataFrame(result)
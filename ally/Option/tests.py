@@ -0,0 +1,239 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import unittest
+from unittest import mock
+
+from ..exception import PartialResultException, RateLimitException
+from .chain import CALL, PUT, OptionChain, option_chain, plan
+
+LISTED = ["2020-08-14", "2020-08-21", "2020-08-28", "2020-09-18", "2020-12-18"]
+
+
+def contract(xdate, strike, put_call, bid):
+    return {
+        "symbol": "SPY{0}{1}{2:08d}".format(
+            xdate[2:], put_call[0].upper(), int(strike * 1000)
+        ),
+        "xdate": xdate,
+        "strikeprice": "{0:.2f}".format(strike),
+        "put_call": put_call,
+        "bid": str(bid),
+        "openinterest": "10",
+    }
+
+
+def chain_for(query):
+    """What search.json would answer a query with, for a small SPY chain"""
+    out = []
+    for xdate in ("20200814", "20200821", "20200918", "20201218"):
+        for strike in (320, 325, 330, 335):
+            for side in ("call", "put"):
+                # No 335 put on the 14th
+                if (xdate, strike, side) == ("20200814", 335, "put"):
+                    continue
+                row = contract(xdate, strike, side, strike / 100)
+                if all(_matches(row, q) for q in query):
+                    out.append(row)
+    return out
+
+
+def _matches(row, q):
+    name, rest = q.split("-")
+    op, value = rest.split(":")
+    a, b = (
+        (float(row[name]), float(value))
+        if name == "strikeprice"
+        else (row[name], value)
+    )
+    return {"eq": a == b, "gte": a >= b, "lte": a <= b}[op]
+
+
+class FakeAlly:
+    auth = None
+    account_nbr = None
+
+    def __init__(self, limited=()):
+        self.calls = []
+        # Calls answering None, as a rate limited request does
+        self.limited = limited
+
+    def expirations(self, symbol, useDatetime=True, block=True):
+        self.calls.append("expirations")
+        return None if "expirations" in self.limited else LISTED
+
+    def quote(self, symbols, fields=[], block=True, columnar=False):
+        import numpy as np
+
+        self.calls.append("quote")
+        return None if "quote" in self.limited else {"last": np.array([327.5])}
+
+
+class TestOptionChain(unittest.TestCase):
+    def setUp(self):
+        self.queries = []
+        lock = threading.Lock()
+
+        def search(auth, account_nbr, symbol, fields, query):
+            with lock:
+                self.queries.append(query)
+            fail = self.fail_on is not None and self.fail_on in query
+            limited = self.limit_on is not None and self.limit_on in query
+            result = mock.Mock()
+            result.request.side_effect = (
+                ValueError("down")
+                if fail
+                else lambda block: None if limited else chain_for(query)
+            )
+            return result
+
+        self.fail_on = None
+        self.limit_on = None
+        patcher = mock.patch("ally.Option.chain.Search.__new__")
+        patcher.start().side_effect = lambda cls, **kw: search(**kw)
+        self.addCleanup(patcher.stop)
+
+    def test_plan(self):
+        self.assertEqual(
+            [
+                (str(a), str(b))
+                for a, b in plan(
+                    ["20200814", "2020-08-21", "2020-09-18", "2020-12-18"], LISTED
+                )
+            ],
+            [("2020-08-14", "2020-08-21"), ("2020-09-18", "2020-12-18")],
+        )
+
+        # Unlisted dates have nothing to skip, unknown listing splits them all
+        self.assertEqual(
+            len(plan(["2020-08-14", "2020-08-17", "2020-08-21"], LISTED)), 1
+        )
+        self.assertEqual(len(plan(["2020-08-14", "2020-08-21"])), 2)
+        self.assertEqual(plan([], LISTED), [])
+
+    def test_layout(self):
+        a = FakeAlly()
+        chain = option_chain(a, "spy")
+
+        # The whole chain in one query
+        self.assertEqual(self.queries, [[]])
+        self.assertEqual(a.calls, [])
+
+        self.assertEqual(
+            [str(d) for d in chain.expirations],
+            ["2020-08-14", "2020-08-21", "2020-09-18", "2020-12-18"],
+        )
+        self.assertEqual(list(chain.strikes), [320, 325, 330, 335])
+        self.assertEqual(chain["bid"].shape, (4, 4, 2))
+        self.assertEqual(len(chain), 31)
+
+        self.assertEqual(list(chain["bid"][0, :, CALL]), [3.2, 3.25, 3.3, 3.35])
+        self.assertEqual(list(chain["put_call"][1, 2]), ["call", "put"])
+        self.assertFalse(chain.present[0, 3, PUT])
+        self.assertTrue(chain.present[0, 3, CALL])
+        self.assertNotEqual(chain["bid"][0, 3, PUT], chain["bid"][0, 3, PUT])
+        self.assertEqual(chain["openinterest"][0, 3, PUT], -1)
+
+        self.assertEqual(chain.get("2020-09-18", 330, "put")["bid"], 3.3)
+        self.assertIsNone(chain.get("2020-08-14", 335, "put"))
+        self.assertIsNone(chain.get("2020-08-14", 336, "call"))
+        self.assertIsNone(chain.get("2021-01-15", 330, PUT))
+
+        df = chain.DataFrame()
+        self.assertEqual(len(df), 16)
+        self.assertEqual(df.loc[("2020-08-21", 325.0), ("bid", "put")], 3.25)
+
+    def test_nearest_moneyness(self):
+        a = FakeAlly()
+        chain = option_chain(a, "spy", expirations=2, moneyness=0.01)
+
+        # One listing, one spot quote, one search
+        self.assertEqual(sorted(a.calls), ["expirations", "quote"])
+        self.assertEqual(
+            self.queries,
+            [
+                [
+                    "xdate-gte:20200814",
+                    "xdate-lte:20200821",
+                    "strikeprice-gte:324.22",
+                    "strikeprice-lte:330.78",
+                ]
+            ],
+        )
+        self.assertEqual(list(chain.strikes), [325, 330])
+        self.assertEqual(len(chain.expirations), 2)
+
+    def test_dates(self):
+        a = FakeAlly()
+        chain = option_chain(
+            a, "spy", ["2020-08-14", "2020-08-21", "2020-12-18"], (0.99, 1.0), spot=330
+        )
+
+        # Runs of the listing, and no quote with a spot given
+        self.assertEqual(a.calls, ["expirations"])
+        self.assertEqual(len(self.queries), 2)
+        self.assertIn(
+            ["xdate-eq:20201218", "strikeprice-gte:326.70", "strikeprice-lte:330.00"],
+            self.queries,
+        )
+        self.assertEqual(len(chain.expirations), 3)
+
+    def test_partial(self):
+        self.fail_on = "xdate-eq:20201218"
+        with self.assertRaises(PartialResultException) as e:
+            option_chain(FakeAlly(), "spy", ["2020-08-14", "2020-12-18"])
+
+        self.assertEqual(
+            [str(d) for d in e.exception.results.expirations], ["2020-08-14"]
+        )
+        [(run, error)] = e.exception.errors.items()
+        self.assertEqual(str(run[0]), "2020-12-18")
+        self.assertIsInstance(error, ValueError)
+
+    def test_rate_limited_range(self):
+        self.limit_on = "xdate-eq:20201218"
+        with self.assertRaises(PartialResultException) as e:
+            option_chain(FakeAlly(), "spy", ["2020-08-14", "2020-12-18"])
+
+        self.assertEqual(
+            [str(d) for d in e.exception.results.expirations], ["2020-08-14"]
+        )
+        [(run, error)] = e.exception.errors.items()
+        self.assertEqual(str(run[0]), "2020-12-18")
+        self.assertIsInstance(error, RateLimitException)
+
+    def test_rate_limited_lookups(self):
+        for limited in ("expirations", "quote"):
+            with self.subTest(limited=limited):
+                with self.assertRaises(RateLimitException):
+                    option_chain(
+                        FakeAlly(limited=(limited,)),
+                        "spy",
+                        expirations=2,
+                        moneyness=0.01,
+                    )
+                self.assertEqual(self.queries, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,7 +20,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from .quote import quote
-from .stream import stream
-from .timesales import timesales
+from .coalesce import coalesce_quotes
+from .hub import subscribe
+from .quote import cache_quotes, quote
+from .store import store_timesales
+from .stream import stream, stream_bars
+from .timesales import iter_timesales, timesales, timesales_many
 from .toplists import toplists
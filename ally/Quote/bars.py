@@ -0,0 +1,469 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Rolls timesales bars up into longer ones, and stream() trades into bars.
+
+Works on the typed columns of timesales(..., columnar=True), or anything
+shaped like them: 'datetime' (UTC), 'opn', 'hi', 'lo', 'last' and 'incr_vl',
+the volume of each bar. Rows must be in time order. A long table from
+timesales_many() is fine too, as long as each symbol's rows are together.
+
+Buckets are laid out in exchange time, so hourly bars run 9:30-10:30 rather
+than 9:00-10:00, and bars outside the trading session are left out.
+
+BarBuilder makes the same bars live, out of the trades of a stream().
+"""
+
+import datetime
+from array import array
+
+from .ticks import QuoteTick, TradeTick
+
+# Exchange timezone and regular session, as local "HH:MM"
+EASTERN = "America/New_York"
+SESSION = ("09:30", "16:00")
+
+_units = {"min": 60, "h": 3600, "d": 86400}
+
+# Output columns, in order
+NAMES = ("datetime", "opn", "hi", "lo", "last", "incr_vl", "vwap", "count")
+
+
+def _seconds(hhmm: str) -> int:
+    """Seconds after midnight of 'HH:MM'"""
+    h, m = hhmm.split(":")
+    return int(h) * 3600 + int(m) * 60
+
+
+def _width(rule: str) -> int:
+    """Seconds in a rule like '30min', '1h' or '1d'"""
+    for unit, seconds in _units.items():
+        if rule.endswith(unit) and rule[: -len(unit)].isdigit():
+            return int(rule[: -len(unit)] or 1) * seconds
+    raise ValueError("Unknown rule {0!r}, try '30min' or '1h'".format(rule))
+
+
+def _offsets(seconds, tz: str):
+    """UTC offset, in seconds, of each UTC epoch second in tz.
+
+    Only computed once per distinct day; intraday bars span a handful
+    of them, and DST never changes during a session.
+    """
+    import numpy as np
+    import pytz
+
+    tz = pytz.timezone(tz)
+    days, inverse = np.unique(seconds // 86400, return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.datetime.fromtimestamp(int(d) * 86400 + 43200, tz)
+            .utcoffset()
+            .total_seconds()
+            for d in days
+        ],
+        dtype=np.int64,
+    )
+    return offsets[inverse]
+
+
+def buckets(datetimes, rule="30min", session=SESSION, tz: str = EASTERN):
+    """Bucket each bar falls into.
+
+    Args:
+            datetimes: numpy datetime64 array, UTC
+
+            rule: bucket width like '30min' or '1h', 'session' for one bar per
+            session, or a list of local 'HH:MM' times each starting a bucket
+
+            session: (open, close) as local 'HH:MM', or None for the whole day
+
+            tz: timezone the session and buckets are laid out in
+
+    Returns:
+            (start, keep): start of each bar's bucket as UTC epoch seconds,
+            and a mask of the bars inside the session
+    """
+    import numpy as np
+
+    utc = datetimes.astype("M8[s]").astype(np.int64)
+    offset = _offsets(utc, tz)
+    local = utc + offset
+    day, tod = np.divmod(local, 86400)
+
+    if session is None:
+        first, close = 0, 86400
+    else:
+        first, close = _seconds(session[0]), _seconds(session[1])
+    keep = (tod >= first) & (tod < close)
+
+    if isinstance(rule, str) and rule == "session":
+        start = np.full_like(tod, first)
+    elif isinstance(rule, str):
+        width = _width(rule)
+        start = first + (tod - first) // width * width
+    else:
+        cuts = np.sort([_seconds(t) for t in rule])
+        i = np.searchsorted(cuts, tod, side="right") - 1
+        keep &= i >= 0
+        start = cuts[np.maximum(i, 0)]
+
+    return day * 86400 + start - offset, keep
+
+
+def _aggregate(cols, rule, session, tz):
+    """resample(), also returning each bucket's price * volume sum"""
+    import numpy as np
+
+    start, keep = buckets(cols["datetime"], rule, session, tz)
+    if not keep.all():
+        cols = {k: v[keep] for k, v in cols.items()}
+        start = start[keep]
+
+    symbol = cols.get("symbol")
+    if not len(start):
+        result = {k: np.empty(0, "f8") for k in NAMES}
+        result["datetime"] = np.empty(0, "M8[s]")
+        result["incr_vl"] = np.empty(0, "i8")
+        result["count"] = np.empty(0, "i8")
+        if symbol is not None:
+            result = {"symbol": symbol[:0], **result}
+        return result, np.empty(0, "f8")
+
+    # One pass to find where buckets change, then one reduceat per column
+    change = start[1:] != start[:-1]
+    if symbol is not None:
+        change |= symbol[1:] != symbol[:-1]
+    first = np.concatenate(([0], np.flatnonzero(change) + 1))
+    last = np.concatenate((first[1:], [len(start)])) - 1
+
+    hi, lo, close = (cols[k].astype("f8", copy=False) for k in ("hi", "lo", "last"))
+    volume = cols["incr_vl"].astype("i8", copy=False)
+
+    # Weighted by each bar's own vwap when it has one, its typical price if not
+    price = cols["vwap"] if "vwap" in cols else (hi + lo + close) / 3
+    pv = np.add.reduceat(np.nan_to_num(price * volume), first)
+    total = np.add.reduceat(volume, first)
+
+    result = {
+        "datetime": start[first].astype("M8[s]"),
+        "opn": cols["opn"].astype("f8", copy=False)[first],
+        "hi": np.fmax.reduceat(hi, first),
+        "lo": np.fmin.reduceat(lo, first),
+        "last": close[last],
+        "incr_vl": total,
+        "vwap": pv / np.where(total, total, np.nan),
+        "count": np.add.reduceat(
+            cols["count"] if "count" in cols else np.ones(len(start), "i8"), first
+        ),
+    }
+    if symbol is not None:
+        result = {"symbol": symbol[first], **result}
+    return result, pv
+
+
+def resample(cols, rule="30min", session=SESSION, tz: str = EASTERN):
+    """Rolls bars up into longer ones: OHLCV, VWAP and bar count.
+
+    Args:
+            cols: typed timesales columns, see the module docstring
+
+            rule: '30min', '1h', ..., 'session' for one bar per session, or a
+            list of local 'HH:MM' times each starting a bucket
+
+            session: (open, close) as local 'HH:MM', or None to keep every bar
+
+            tz: timezone the session and buckets are in
+
+    Returns:
+            dictionary of numpy arrays: 'datetime' (bucket start, UTC), 'opn',
+            'hi', 'lo', 'last', 'incr_vl', 'vwap' and 'count', plus 'symbol'
+            if the input had it. Output can be resampled again.
+
+    Example:
+
+    .. code-block:: python
+
+            from ally.Quote.bars import resample
+
+            bars = a.timesales('spy', '2020-08-17', '2020-08-21', columnar=True)
+            hourly = resample(bars, '1h')
+            halves = resample(bars, ['09:30', '12:00'])
+    """
+    return _aggregate(cols, rule, session, tz)[0]
+
+
+class BarAggregator:
+    """Resamples bars as they come in, one symbol at a time.
+
+    Each append() returns the buckets it completed. The latest bucket stays
+    open, since later bars may still fall into it, until a newer one starts
+    or flush() is called.
+
+    Example:
+
+    .. code-block:: python
+
+            agg = BarAggregator('1h')
+            for day in days:
+                    closed = agg.append(a.timesales('spy', day, day, columnar=True))
+    """
+
+    def __init__(self, rule="30min", session=SESSION, tz: str = EASTERN):
+        self.rule = rule
+        self.session = session
+        self.tz = tz
+
+        # The open bucket, as one-row columns, and its price * volume
+        self._open = None
+        self._pv = None
+
+    @property
+    def current(self):
+        """The bucket still open, or None"""
+        return self._open
+
+    def append(self, cols):
+        """Adds bars, returns the buckets they closed as resample() would"""
+        import numpy as np
+
+        result, pv = _aggregate(cols, self.rule, self.session, self.tz)
+        if not len(pv):
+            return result
+
+        if self._open is not None:
+            if self._open["datetime"][0] == result["datetime"][0]:
+                # Carry on the open bucket
+                o = self._open
+                result["opn"][0] = o["opn"][0]
+                result["hi"][0] = np.fmax(result["hi"][0], o["hi"][0])
+                result["lo"][0] = np.fmin(result["lo"][0], o["lo"][0])
+                result["count"][0] += o["count"][0]
+                result["incr_vl"][0] += o["incr_vl"][0]
+                pv[0] += self._pv[0]
+                total = result["incr_vl"][0]
+                result["vwap"][0] = pv[0] / total if total else np.nan
+            else:
+                result = {
+                    k: np.concatenate((self._open[k], v)) for k, v in result.items()
+                }
+                pv = np.concatenate((self._pv, pv))
+
+        self._open = {k: v[-1:].copy() for k, v in result.items()}
+        self._pv = pv[-1:].copy()
+        return {k: v[:-1] for k, v in result.items()}
+
+    def flush(self):
+        """Closes and returns the open bucket, if any"""
+        result, self._open, self._pv = self._open, None, None
+        return result
+
+
+class BarBuilder:
+    """Builds bars out of stream() trades as they arrive.
+
+    Keeps one open bar per symbol, in flat arrays indexed by symbol, so a
+    trade only updates a few numbers in place. As soon as time reaches a
+    new bucket, every bar of the buckets before it is closed at once.
+    Time is told by the timestamps of trades and quotes alike, and in
+    run() by the clock too, so a quiet symbol's bar still closes on time.
+
+    Trades older than the current bucket are too late for their bar, and
+    only counted in .late. Bars of symbols without trades in a bucket are
+    skipped, not filled in.
+
+    Buckets start at `anchor`, New York time, and every `rule` after it.
+    Use a rule that divides an hour, or a whole number of hours; larger
+    buckets follow the UTC offset at the time the builder was made.
+
+    Example:
+
+    .. code-block:: python
+
+            builder = BarBuilder(['spy', 'gld'], '1min')
+            for bars in builder.run(a.stream(['spy', 'gld'])):
+                    print(bars['symbol'], bars['vwap'])
+    """
+
+    def __init__(self, symbols, rule="1min", anchor: str = SESSION[0], tz=EASTERN):
+        import time
+
+        import numpy as np
+
+        self.symbols = [s.upper() for s in symbols]
+        self._index = {s: i for i, s in enumerate(self.symbols)}
+        n = len(self.symbols)
+
+        self._width = _width(rule)
+        offset = int(_offsets(np.array([int(time.time())]), tz)[0])
+        self._origin = (_seconds(anchor) - offset) % self._width
+
+        # Open bar of each symbol, updated in place
+        self._start = array("q", [0]) * n
+        self._opn = array("d", [0.0]) * n
+        self._hi = array("d", [0.0]) * n
+        self._lo = array("d", [0.0]) * n
+        self._last = array("d", [0.0]) * n
+        self._vol = array("q", [0]) * n
+        self._pv = array("d", [0.0]) * n
+        self._count = array("q", [0]) * n
+
+        # Start of the newest bucket seen
+        self._now = 0
+
+        # Closed bars not handed out yet, as lists of columns
+        self._closed = []
+
+        self.late = 0
+        self.bad = 0
+
+    def update(self, symbol: str, price: float, size: int, timestamp: int):
+        """Adds one trade. timestamp is in epoch seconds"""
+        i = self._index.get(symbol)
+        if i is None:
+            return
+
+        start = timestamp - (timestamp - self._origin) % self._width
+        if start != self._now:
+            if start < self._now:
+                self.late += 1
+                return
+            self.advance(start)
+            self._now = start
+
+        count = self._count
+        if count[i]:
+            hi, lo = self._hi, self._lo
+            if price > hi[i]:
+                hi[i] = price
+            elif price < lo[i]:
+                lo[i] = price
+            self._vol[i] += size
+            self._pv[i] += price * size
+            count[i] += 1
+        else:
+            self._start[i] = start
+            self._opn[i] = self._hi[i] = self._lo[i] = price
+            self._vol[i] = size
+            self._pv[i] = price * size
+            count[i] = 1
+        self._last[i] = price
+
+    def clock(self, timestamp):
+        """Moves time on to timestamp (epoch seconds), closing any bars
+        of the buckets before it. Trades before it will be late"""
+        start = timestamp - (timestamp - self._origin) % self._width
+        if start > self._now:
+            self.advance(start)
+            self._now = start
+
+    def feed(self, message):
+        """Adds the trade of a stream() message or tick, if it has one.
+        Quotes only move time on"""
+        if type(message) is TradeTick:
+            self.update(message.symbol, message.last, message.vl, message.timestamp)
+            return
+        if type(message) is QuoteTick:
+            if message.timestamp:
+                self.clock(message.timestamp)
+            return
+
+        tick = message.get("trade")
+        if tick is None:
+            tick = message.get("quote")
+            if tick is not None:
+                try:
+                    self.clock(int(tick["timestamp"]))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            return
+
+        try:
+            self.update(
+                tick["symbol"],
+                float(tick["last"]),
+                int(tick["vl"]),
+                int(tick["timestamp"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            self.bad += 1
+
+    def advance(self, now):
+        """Closes the bars of every bucket that ended by now (epoch seconds)"""
+        import numpy as np
+
+        boundary = now - (now - self._origin) % self._width
+        count = np.frombuffer(self._count, "i8")
+        start = np.frombuffer(self._start, "i8")
+        i = np.flatnonzero((count > 0) & (start < boundary))
+        if not len(i):
+            return
+
+        volume = np.frombuffer(self._vol, "i8")[i]
+        self._closed.append(
+            {
+                "symbol": np.array(self.symbols, dtype=object)[i],
+                "datetime": start[i].astype("M8[s]"),
+                "opn": np.frombuffer(self._opn, "f8")[i],
+                "hi": np.frombuffer(self._hi, "f8")[i],
+                "lo": np.frombuffer(self._lo, "f8")[i],
+                "last": np.frombuffer(self._last, "f8")[i],
+                "incr_vl": volume,
+                "vwap": np.frombuffer(self._pv, "f8")[i]
+                / np.where(volume, volume, np.nan),
+                "count": count[i],
+            }
+        )
+        count[i] = 0
+
+    def drain(self):
+        """Closed bars since the last drain(), as columns like resample()'s"""
+        import numpy as np
+
+        closed, self._closed = self._closed, []
+        if len(closed) == 1:
+            return closed[0]
+        if not closed:
+            return {
+                "symbol": np.empty(0, object),
+                "datetime": np.empty(0, "M8[s]"),
+                **{k: np.empty(0, "f8") for k in ("opn", "hi", "lo", "last")},
+                "incr_vl": np.empty(0, "i8"),
+                "vwap": np.empty(0, "f8"),
+                "count": np.empty(0, "i8"),
+            }
+        return {k: np.concatenate([c[k] for c in closed]) for k in closed[0]}
+
+    def run(self, messages, delay: float = None):
+        """Feeds stream() messages through, yielding bars as buckets close
+
+        delay: if given, also close buckets once the clock is this many
+        seconds past their end, whatever the timestamps of the messages.
+        Leave it None for recorded messages, see TickTape.replay()
+        """
+        import time
+
+        for message in messages:
+            self.feed(message)
+            if delay is not None:
+                self.clock(int(time.time() - delay))
+            if self._closed:
+                yield self.drain()
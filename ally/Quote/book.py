@@ -0,0 +1,281 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""The latest quote and trade of every symbol, kept up to date by a stream.
+
+A TopOfBook holds one row per symbol in preallocated numpy columns, which
+stream() messages overwrite in place. Reading a symbol is a lookup, and a
+snapshot of the whole table is a handful of array copies.
+
+One thread writes, any number read, without locks: every row has a
+sequence number, odd while the row is being written. A reader that sees
+it change, or odd, reads that row again.
+"""
+
+import threading
+import time
+from array import array
+
+# Rows allocated up front, doubling when they run out
+CAPACITY = 256
+
+# (name, array typecode) of each column, besides the sequence numbers
+COLUMNS = [
+    ("bid", "d"),
+    ("ask", "d"),
+    ("bidsz", "q"),
+    ("asksz", "q"),
+    ("last", "d"),
+    ("size", "q"),  # of the last trade
+    ("volume", "q"),  # of the day so far
+    ("timestamp", "q"),  # exchange time of the last update, epoch seconds
+    ("stale", "b"),  # a gap since, not resynced yet
+]
+
+_dtypes = {"d": "f8", "q": "i8", "b": "?"}
+
+
+# (stream() field, column, parse) per message kind
+_fields = {
+    "quote": (
+        ("bid", "bid", float),
+        ("ask", "ask", float),
+        ("bidsz", "bidsz", int),
+        ("asksz", "asksz", int),
+        ("timestamp", "timestamp", int),
+    ),
+    "trade": (
+        ("last", "last", float),
+        ("vl", "size", int),
+        ("cvol", "volume", int),
+        ("timestamp", "timestamp", int),
+    ),
+    "resync": (
+        ("bid", "bid", float),
+        ("ask", "ask", float),
+        ("bidsz", "bidsz", int),
+        ("asksz", "asksz", int),
+        ("last", "last", float),
+        ("vl", "volume", int),
+        ("timestamp", "timestamp", int),
+    ),
+}
+
+
+class _Columns:
+    """One allocation of the table, replaced whole when it grows.
+
+    Rows are written through flat arrays, cheap to set one item of, and
+    read in bulk through numpy views of the same memory.
+    """
+
+    __slots__ = ("seq", "data", "views")
+
+    def __init__(self, capacity, old=None):
+        import numpy as np
+
+        self.seq = array("q", [0]) * capacity
+        self.data = {
+            name: array(t, [float("nan") if t == "d" else 0]) * capacity
+            for name, t in COLUMNS
+        }
+        if old is not None:
+            n = len(old.seq)
+            self.seq[:n] = old.seq
+            for name, col in self.data.items():
+                col[:n] = old.data[name]
+
+        self.views = {
+            name: np.frombuffer(col, _dtypes[t])
+            for (name, t), col in zip(COLUMNS, self.data.values())
+        }
+        self.views["seq"] = np.frombuffer(self.seq, "i8")
+
+
+class TopOfBook:
+    """Latest bid, ask and last trade of each symbol.
+
+    Example:
+
+    .. code-block:: python
+
+            book = TopOfBook()
+            book.follow(a.stream(universe))
+
+            book['SPY']['bid']
+            snap = book.snapshot()
+            spread = snap['ask'] - snap['bid']
+    """
+
+    def __init__(self, symbols=(), capacity: int = CAPACITY):
+        self.symbols = []
+        self._ids = {}
+        self._cols = _Columns(max(capacity, len(symbols), 1))
+        for s in symbols:
+            self.id(s.upper())
+
+        # Updates applied so far, for readers polling for change
+        self.version = 0
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol.upper() in self._ids
+
+    def id(self, symbol: str) -> int:
+        """Row of a symbol, added if new. Writer thread only"""
+        i = self._ids.get(symbol)
+        if i is None:
+            i = len(self.symbols)
+            if i == len(self._cols.seq):
+                # Readers holding the old columns still read them safely
+                self._cols = _Columns(2 * i, self._cols)
+            self.symbols.append(symbol)
+            self._ids[symbol] = i
+        return i
+
+    def update(self, kind: str, tick):
+        """Applies one stream() tick of kind 'quote', 'trade' or 'resync'.
+
+        tick is the inner dictionary of a message, or a QuoteTick/TradeTick
+        """
+        fields = _fields.get(kind)
+        if isinstance(tick, dict):
+            get = tick.get
+        else:
+            get = lambda f: getattr(tick, f, None)
+
+        symbol = get("symbol")
+        if fields is None or symbol is None:
+            return
+
+        i = self.id(symbol.upper())
+        cols = self._cols
+        seq, data = cols.seq, cols.data
+
+        seq[i] += 1
+        try:
+            for f, name, parse in fields:
+                v = get(f)
+
+                # Missing, or NaN from a blank typed field
+                if v is not None and v == v:
+                    try:
+                        data[name][i] = parse(v)
+                    except (TypeError, ValueError):
+                        pass
+            data["stale"][i] = 0
+        finally:
+            seq[i] += 1
+        self.version += 1
+
+    def gap(self, symbols):
+        """Marks symbols stale, until their next update"""
+        cols = self._cols
+        for s in symbols:
+            i = self._ids.get(s.upper())
+            if i is not None:
+                cols.seq[i] += 1
+                cols.data["stale"][i] = 1
+                cols.seq[i] += 1
+        self.version += 1
+
+    def feed(self, message):
+        """Applies a stream() message or tick. Writer thread only"""
+        kind = getattr(message, "kind", None)
+        if kind is not None:
+            self.update(kind, message)
+            return
+
+        for kind, tick in message.items():
+            if kind == "gap":
+                self.gap(tick.get("symbols", ()))
+            elif isinstance(tick, dict):
+                self.update(kind, tick)
+
+    def tee(self, messages):
+        """Applies messages while passing them on"""
+        for message in messages:
+            self.feed(message)
+            yield message
+
+    def follow(self, messages):
+        """Applies messages on a background thread, which it returns"""
+
+        def run():
+            for message in messages:
+                self.feed(message)
+
+        t = threading.Thread(target=run, name="TopOfBook", daemon=True)
+        t.start()
+        return t
+
+    def get(self, symbol: str):
+        """One symbol's row as a dictionary, or None if never seen"""
+        i = self._ids.get(symbol.upper())
+        if i is None:
+            return None
+
+        while True:
+            cols = self._cols
+            before = cols.seq[i]
+            if not before & 1:
+                row = {name: col[i] for name, col in cols.data.items()}
+                if cols.seq[i] == before:
+                    row["stale"] = bool(row["stale"])
+                    row["symbol"] = self.symbols[i]
+                    row["seq"] = before // 2
+                    return row
+
+            # Let the writer finish
+            time.sleep(0)
+
+    __getitem__ = get
+
+    def snapshot(self):
+        """Every symbol's row at once, as columns.
+
+        Each row is consistent on its own; rows may be from moments
+        apart, see 'seq', the number of updates of each row so far.
+        """
+        import numpy as np
+
+        # Columns grow before symbols are added, so read n first
+        n = len(self.symbols)
+        cols = self._cols
+
+        views = cols.views
+        before = views["seq"][:n].copy()
+        result = {name: views[name][:n].copy() for name in cols.data}
+        after = views["seq"][:n]
+
+        # Rows written to while being copied
+        for i in np.flatnonzero((before != after) | (before & 1 == 1)):
+            row = self.get(self.symbols[i])
+            for name in result:
+                result[name][i] = row[name]
+            before[i] = row["seq"] * 2
+
+        result["seq"] = before // 2
+        result["symbol"] = np.array(self.symbols[:n], dtype=object)
+        return result
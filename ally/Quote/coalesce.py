@@ -0,0 +1,177 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Merges concurrent quote() calls into shared requests.
+
+Every quote request costs one unit of the 60/minute quote budget, no matter
+how many symbols it asks for. When several threads ask for quotes at about
+the same time, it is much cheaper to send one request for all of them.
+"""
+
+import threading
+import time
+
+from .. import RateLimit
+from ..classes import RequestType
+from ..exception import RateLimitException
+from .quote import SYMBOLS_PER_REQUEST, fetch, project, split
+
+
+class Batch:
+    """The union of several callers' quote requests"""
+
+    def __init__(self):
+        # Ordered set
+        self.symbols = {}
+
+        # None means all fields
+        self.fields = set()
+
+        self.block = False
+        self.done = threading.Event()
+        self.rows = None
+        self.error = None
+
+    def add(self, symbols, fields, block):
+        self.symbols.update(dict.fromkeys(symbols))
+
+        if not fields:
+            self.fields = None
+        elif self.fields is not None:
+            self.fields.update(fields)
+
+        self.block = self.block or block
+
+
+class QuoteCoalescer:
+    """Merges quote() calls made within a short window into one request.
+
+    The first caller to arrive opens a batch and waits `window` seconds for
+    others to join, then sends a single request for the union of every
+    caller's symbols and fields. Each caller gets back just the quotes (and
+    fields) it asked for, in the order it asked for them.
+    """
+
+    def __init__(
+        self, ally, window: float = 0.02, max_symbols: int = SYMBOLS_PER_REQUEST
+    ):
+        self._ally = ally
+        self.window = window
+        self.max_symbols = max_symbols
+
+        self._lock = threading.Lock()
+        self._batch = None
+
+        # Caller calls, and the requests they actually cost
+        self.calls = 0
+        self.requests = 0
+
+    def quote(self, symbols, fields=[], block: bool = True):
+        """Get quotes, sharing a request with any concurrent callers.
+
+        Returns:
+            flat list of dictionaries, each one a single quote
+        """
+        symbols = [s.upper() for s in split(symbols)]
+        fields = split(fields)
+
+        # Don't wait around for a batch we can't join
+        if not block and RateLimit.wait_time(RequestType.Quote) > 0:
+            raise RateLimitException("Too many attempts.")
+
+        with self._lock:
+            b = self._batch
+            leader = b is None or len(b.symbols.keys() | symbols) > self.max_symbols
+            if leader:
+                b = self._batch = Batch()
+
+            b.add(symbols, fields, block)
+            self.calls += 1
+
+        if leader:
+            self._send(b)
+        else:
+            b.done.wait()
+
+        if b.error is not None:
+            raise b.error
+
+        # Rate limited
+        if b.rows is None:
+            return None
+
+        return [project(b.rows[s], fields) for s in symbols if s in b.rows]
+
+    def _send(self, b):
+        """Let others join, then make the request on everybody's behalf"""
+        time.sleep(self.window)
+
+        # Close the batch
+        with self._lock:
+            if self._batch is b:
+                self._batch = None
+            self.requests += 1
+
+        try:
+            rows = fetch(
+                self._ally, list(b.symbols), sorted(b.fields or []), block=b.block
+            )
+            if rows is not None:
+                b.rows = {row["symbol"].upper(): row for row in rows}
+        except Exception as e:
+            b.error = e
+        finally:
+            b.done.set()
+
+
+def coalesce_quotes(self, window: float = 0.02, enable: bool = True):
+    """Merges concurrent quote() calls into shared requests.
+
+    Once enabled, quote() calls made from different threads within `window`
+    seconds of each other are sent as a single request for all of their
+    symbols and fields, and the results are split back out per caller.
+    A burst of callers then spends one unit of the quote budget instead of
+    one each.
+
+    Args:
+            window:
+                    seconds the first caller waits for others to join
+
+            enable:
+                    False to go back to one request per call
+
+    Returns:
+            The QuoteCoalescer, which counts calls and requests
+
+    Example:
+
+    .. code-block:: python
+
+            a.coalesce_quotes(window=0.05)
+
+            # These threads share one request
+            with ThreadPoolExecutor(8) as pool:
+                    frames = list(pool.map(a.quote, ['spy', 'gld', 'tsla', ...]))
+
+    """
+    self.quote_coalescer = QuoteCoalescer(self, window) if enable else None
+    return self.quote_coalescer
@@ -0,0 +1,413 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Shares one stream() connection between any number of consumers.
+
+A StreamHub keeps a single upstream stream open for the union of the
+symbols its subscribers want, sharded over more connections only past 256
+symbols (see ShardedStream). Each subscription has its own bounded queue,
+and a policy for when its consumer falls behind:
+
+    drop_oldest: the oldest queued message makes room, and is counted
+    block: the hub waits for room, holding up every other subscriber too
+    conflate: only the latest quote and trade of each symbol are kept
+
+When the union of symbols changes, the upstream connection is reopened
+with the new set, after a short pause that batches nearby changes.
+
+The upstream is supervised by default: dropped connections come back on
+their own, and subscribers get the gap and resync messages of their
+symbols (see ally.Quote.shard).
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from ..utils import StreamMetrics
+from .quote import get
+from .shard import IDLE, ShardedStream
+
+# Seconds to wait after a change of symbols before reconnecting
+SETTLE = 0.1
+
+POLICIES = ("drop_oldest", "block", "conflate")
+
+# Guards creating an Ally instance's hub
+_hub_lock = threading.Lock()
+
+
+def _split(symbols):
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+    return {s.strip().upper() for s in symbols if s.strip()}
+
+
+def _key(message):
+    """(kind, symbol) of a stream() message"""
+    for kind, tick in message.items():
+        if isinstance(tick, dict):
+            return kind, tick.get("symbol")
+    return None, None
+
+
+class Subscription:
+    """One consumer's view of a StreamHub.
+
+    Iterate over it for stream() messages of its symbols. Iteration ends
+    once the subscription is closed, and raises if the upstream stream
+    failed.
+    """
+
+    def __init__(self, hub, symbols, maxsize: int = 1024, policy: str = "drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of {0}".format(POLICIES))
+
+        self.hub = hub
+        self.symbols = frozenset(symbols)
+        self.maxsize = maxsize
+        self.policy = policy
+
+        # Conflated queues keep one message per (kind, symbol)
+        self._queue = OrderedDict() if policy == "conflate" else deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.error = None
+
+        # Messages thrown away by drop_oldest, or replaced by conflate
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, message):
+        """Queue a message, following the policy when full"""
+        with self._cond:
+            if self.closed:
+                return
+
+            q = self._queue
+            if self.policy == "conflate":
+                key = _key(message)
+                if key in q:
+                    self.dropped += 1
+                q[key] = message
+            else:
+                if len(q) >= self.maxsize:
+                    if self.policy == "block":
+                        while len(q) >= self.maxsize and not self.closed:
+                            self._cond.wait()
+                        if self.closed:
+                            return
+                    else:
+                        q.popleft()
+                        self.dropped += 1
+                q.append(message)
+            self._cond.notify_all()
+
+    def get(self, timeout: float = None):
+        """Next message, waiting up to timeout seconds for one.
+
+        Returns None on timeout, and once closed with nothing left queued.
+        """
+        with self._cond:
+            if not self._queue and not self.closed:
+                self._cond.wait_for(lambda: self._queue or self.closed, timeout)
+
+            if self._queue:
+                if self.policy == "conflate":
+                    message = self._queue.popitem(last=False)[1]
+                else:
+                    message = self._queue.popleft()
+                self._cond.notify_all()
+                return message
+
+            if self.error is not None:
+                raise self.error
+            return None
+
+    def __iter__(self):
+        while True:
+            message = self.get()
+            if message is None:
+                return
+            yield message
+
+    def _end(self, error=None):
+        """Wake everyone up, no more messages will come"""
+        with self._cond:
+            self.closed = True
+            self.error = error
+            self._cond.notify_all()
+
+    def close(self):
+        """Unsubscribe. Queued messages can still be read"""
+        self._end()
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StreamHub:
+    """One upstream stream, fanned out to many subscriptions.
+
+    Example:
+
+    .. code-block:: python
+
+            hub = StreamHub(a)
+            with hub.subscribe(['spy', 'gld'], policy='conflate') as sub:
+                    for message in sub:
+                            print(message)
+    """
+
+    def __init__(
+        self, ally, settle: float = SETTLE, supervise: bool = True, idle: float = IDLE
+    ):
+        self.ally = ally
+        self.settle = settle
+        self.supervise = supervise
+        self.idle = idle
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._subscriptions = []
+
+        # Symbol -> subscriptions, replaced whole on every change so
+        #  the upstream thread can read it without the lock
+        self._routes = {}
+        self._symbols = frozenset()
+
+        self._endpoint = None
+        self._thread = None
+        self.closed = False
+
+        # Times the upstream stream was opened
+        self.connects = 0
+
+        # Shared by every upstream stream, for the hub's whole life
+        self.metrics = StreamMetrics()
+        self.metrics.watch("subscriptions", lambda: len(self._subscriptions))
+        self.metrics.watch(
+            "subscriber_queue_depth",
+            lambda: sum(len(sub) for sub in self._subscriptions),
+        )
+        self.metrics.watch(
+            "subscriber_dropped",
+            lambda: sum(sub.dropped for sub in self._subscriptions),
+        )
+
+    @property
+    def symbols(self):
+        """Symbols currently streamed"""
+        return self._symbols
+
+    def stats(self):
+        """Metrics of each upstream connection, see ShardedStream.stats()"""
+        endpoint = self._endpoint
+        return [] if endpoint is None else endpoint.stats()
+
+    def subscribe(self, symbols, maxsize: int = 1024, policy: str = "drop_oldest"):
+        """Subscribe to some symbols.
+
+        Args:
+                symbols: string or list of strings
+
+                maxsize: messages queued before the policy kicks in
+
+                policy: 'drop_oldest', 'block' or 'conflate'
+
+        Returns:
+                A Subscription to iterate over
+        """
+        sub = Subscription(self, _split(symbols), maxsize, policy)
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("StreamHub is closed")
+            self._subscriptions.append(sub)
+            self._update()
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="StreamHub", daemon=True
+                )
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        """Drop a subscription, see Subscription.close()"""
+        with self._lock:
+            if sub in self._subscriptions:
+                self._subscriptions.remove(sub)
+                self._update()
+
+    def _update(self):
+        """Recompute routes, reconnect if the symbols changed. Holds the lock"""
+        routes = {}
+        for sub in self._subscriptions:
+            for s in sub.symbols:
+                routes.setdefault(s, []).append(sub)
+
+        symbols = frozenset(routes)
+        self._routes = routes
+        if symbols != self._symbols:
+            self._symbols = symbols
+            self._changed.notify_all()
+            if self._endpoint is not None:
+                self._endpoint.close()
+
+    def _run(self):
+        """Upstream thread: (re)connect with the current symbols, dispatch"""
+        error = None
+        while True:
+            with self._lock:
+                self._changed.wait_for(lambda: self._symbols or self.closed)
+                if self.closed:
+                    break
+                symbols = self._symbols
+
+            # Let a burst of subscribes settle into one connection
+            time.sleep(self.settle)
+            with self._lock:
+                if self.closed:
+                    break
+                if symbols != self._symbols:
+                    continue
+
+                endpoint = self._endpoint = ShardedStream(
+                    self.ally.auth,
+                    self.ally.account_nbr,
+                    sorted(symbols),
+                    supervise=self.supervise,
+                    idle=self.idle,
+                    resync=self._resync,
+                    metrics=self.metrics,
+                    cache=self.ally.quote_cache,
+                )
+                self.connects += 1
+
+            try:
+                for message in endpoint.request():
+                    kind, symbol = _key(message)
+                    if kind == "gap":
+                        self._broadcast(message)
+                        continue
+                    for sub in self._routes.get(symbol, ()):
+                        sub.put(message)
+            except Exception as e:
+                error = e
+                break
+            finally:
+                with self._lock:
+                    self._endpoint = None
+
+            # Ended on its own, not closed for a change of symbols
+            if not endpoint.closed:
+                break
+
+        self._stop(error)
+
+    def _resync(self, symbols):
+        # The cache went without the gap's messages, so ask the API
+        return get(self.ally, symbols, [])
+
+    def _broadcast(self, message):
+        """Hand a gap to every subscriber of one of its symbols"""
+        routes = self._routes
+        subs = {}
+        for s in message["gap"]["symbols"]:
+            for sub in routes.get(s, ()):
+                subs[id(sub)] = sub
+        for sub in subs.values():
+            sub.put(message)
+
+    def _stop(self, error=None):
+        with self._lock:
+            self.closed = True
+            subs, self._subscriptions = self._subscriptions, []
+            self._routes = {}
+            self._changed.notify_all()
+            if self._endpoint is not None:
+                self._endpoint.close()
+
+        for sub in subs:
+            sub._end(error)
+
+    def close(self):
+        """Close the upstream connection and every subscription"""
+        self._stop()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def subscribe(
+    self, symbols: list = [], maxsize: int = 1024, policy: str = "drop_oldest"
+):
+    """Subscribes to live quotes over one stream shared in this process.
+
+            Every subscribe() of an Ally instance shares a single stream()
+            connection, opened for all of their symbols together, and reopened
+            when those change. Each subscription gets only its own symbols'
+            messages, through its own bounded queue.
+
+            Args:
+                    symbols:
+                            string or list of strings, as for stream()
+
+                    maxsize:
+                            messages queued for a consumer that falls behind,
+                            before the policy kicks in
+
+                    policy:
+                            'drop_oldest' throws away the oldest queued message,
+                            'block' holds up the stream (and every other
+                            subscriber) until there is room, 'conflate' keeps
+                            only the latest quote and trade of each symbol
+
+            Returns:
+                    A Subscription, iterating over stream() messages.
+                    close() it when done.
+
+            Example:
+
+    .. code-block:: python
+
+                    with a.subscribe(['spy', 'gld'], policy='conflate') as sub:
+                            for quote in sub:
+                                    print(quote)
+
+    """
+    with _hub_lock:
+        if self.stream_hub is None or self.stream_hub.closed:
+            self.stream_hub = StreamHub(self)
+        hub = self.stream_hub
+    return hub.subscribe(symbols, maxsize, policy)
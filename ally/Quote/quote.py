@@ -20,7 +20,42 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .. import schema
 from ..Api import AuthenticatedEndpoint, RequestType
+from ..exception import PartialResultException, RateLimitException
+
+logger = logging.getLogger(__name__)
+
+# Ally doesn't document a cap on symbols per request,
+#  this keeps any single request modest
+SYMBOLS_PER_REQUEST = 200
+
+# Chunk requests in flight at once. The rate limiter still paces them,
+#  more threads would only queue up behind it
+FETCH_WORKERS = 4
+
+# Stream fields that are named differently in quote responses
+_stream_renames = {"trade": {"cvol": "vl", "vl": "incr_vl"}}
+
+
+def split(x):
+    """Turn 'a,b' or ['a','b'] into ['a','b']"""
+    if isinstance(x, str):
+        x = x.split(",")
+    return [s.strip() for s in x if s.strip()]
+
+
+def project(row, fields):
+    """Copy of a quote, with just the fields asked for"""
+    if not fields:
+        return dict(row)
+    return {k: row[k] for k in fields + ["symbol"] if k in row}
 
 
 class Quote(AuthenticatedEndpoint):
@@ -28,6 +63,7 @@ class Quote(AuthenticatedEndpoint):
     _resource = "market/ext/quotes.json"
     _method = "POST"
     _symbols = []
+    _schema = schema.QUOTE
 
     def extract(self, response):
         """Extract certain fields from response"""
@@ -78,27 +114,331 @@ class Quote(AuthenticatedEndpoint):
         # return params, data
         return data, params
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        # Create dataframe from our dataset
-        df = (
-            pd.DataFrame(raw)
-            .replace({"na": None})
-            .apply(
-                # And also cast relevent fields to numeric values
-                pd.to_numeric,
-                errors="ignore",
-            )
-            .set_index("symbol")
+        # Columns come typed already
+        return pd.DataFrame(cls.Columns(raw)).set_index("symbol")
+
+
+def chunks(symbols, size: int = SYMBOLS_PER_REQUEST):
+    """Cut a list of symbols into request-sized pieces"""
+    return [symbols[i : i + size] for i in range(0, len(symbols), size)]
+
+
+def fetch_one(ally, symbols, fields, block: bool = True):
+    """Send a single quote request, and return the list of quotes"""
+    return Quote(
+        auth=ally.auth,
+        account_nbr=ally.account_nbr,
+        symbols=symbols,
+        fields=fields,
+        block=block,
+    ).request(block=block)
+
+
+def fetch(ally, symbols, fields, block: bool = True, progress=None):
+    """Get quotes for any number of symbols.
+
+    Symbols are cut into chunks of SYMBOLS_PER_REQUEST, which are requested
+    concurrently within the rate limit. Quotes come back in the order of the
+    symbols asked for.
+
+    Raises:
+        PartialResultException: if some chunks failed or were rate limited,
+            carrying the quotes of those that weren't. Its errors are keyed
+            by tuples of the symbols of each failed chunk
+    """
+    pieces = chunks(split(symbols))
+
+    if len(pieces) <= 1:
+        rows = fetch_one(ally, symbols, fields, block=block)
+        if progress is not None and rows is not None:
+            progress(len(rows), len(rows), rows)
+        return rows
+
+    total = sum(len(p) for p in pieces)
+    done = 0
+    results = [None] * len(pieces)
+
+    with ThreadPoolExecutor(min(FETCH_WORKERS, len(pieces))) as pool:
+        futures = {
+            pool.submit(fetch_one, ally, p, fields, block): i
+            for i, p in enumerate(pieces)
+        }
+
+        for f in as_completed(futures):
+            i = futures[f]
+            try:
+                results[i] = f.result()
+            except Exception as e:
+                results[i] = e
+                continue
+
+            # Rate limited
+            if results[i] is None:
+                continue
+
+            done += len(pieces[i])
+            if progress is not None:
+                progress(done, total, results[i])
+
+    return merge(pieces, results)
+
+
+def merge(pieces, results):
+    """Put the quotes of chunks back together, in order.
+
+    results holds what each chunk of symbols in pieces came back with: its
+    quotes, None if rate limited, or the exception it raised. None if every
+    chunk was rate limited, as for a single request.
+    """
+    if all(r is None for r in results):
+        return None
+
+    rows, errors = [], {}
+    for piece, r in zip(pieces, results):
+        if r is None:
+            r = RateLimitException("Rate limited, %d symbols not fetched" % len(piece))
+        if isinstance(r, BaseException):
+            errors[tuple(piece)] = r
+        else:
+            rows += r
+
+    if errors:
+        if not rows:
+            raise next(iter(errors.values()))
+        raise PartialResultException(
+            "%d of %d quote requests failed" % (len(errors), len(pieces)),
+            rows,
+            errors,
         )
 
-        return df
+    return rows
+
+
+def get(ally, symbols, fields, block: bool = True, progress=None):
+    """Get quotes from the API, sharing requests if the ally object coalesces"""
+    small = len(split(symbols)) <= SYMBOLS_PER_REQUEST
+
+    # A universe too large for one request has nothing to share
+    if ally.quote_coalescer is not None and small and progress is None:
+        return ally.quote_coalescer.quote(symbols, fields, block=block)
+    return fetch(ally, symbols, fields, block=block, progress=progress)
+
+
+class QuoteCache:
+    """Keeps recent quotes, so that repeated calls don't spend the quote budget.
+
+    Entries are keyed by symbol and field set. A quote younger than `ttl` is
+    served as-is. One that is older, but within another `stale` seconds, is
+    still served instantly, while a single background request refreshes it.
+    Anything older is fetched before returning. The least recently used
+    entries are evicted past `maxsize`.
+
+    A running stream() keeps the cached quotes of its symbols current.
+    """
+
+    def __init__(self, ttl: float = 1.0, stale: float = 5.0, maxsize: int = 4096):
+        self.ttl = ttl
+        self.stale = stale
+        self.maxsize = maxsize
+
+        # (symbol, frozenset of fields or None) -> [quote, time]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # symbol -> keys of its entries
+        self._keys = {}
+
+        # Keys with a refresh in flight
+        self._refreshing = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Hit and miss counters, and current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def _lookup(self, symbol, key, now):
+        """Find a cached quote, and how old it is. Must hold the lock"""
+        # A quote with all fields can answer any set of fields
+        for k in ((symbol, key), (symbol, None)):
+            entry = self._entries.get(k)
+            if entry is not None:
+                self._entries.move_to_end(k)
+                return k, entry[0], now - entry[1]
+        return None, None, None
+
+    def _store(self, rows, key, now):
+        """Cache freshly fetched quotes"""
+        with self._lock:
+            for row in rows:
+                symbol = row["symbol"].upper()
+                k = (symbol, key)
+                self._entries[k] = [row, now]
+                self._entries.move_to_end(k)
+                self._keys.setdefault(symbol, set()).add(k)
+
+            while len(self._entries) > self.maxsize:
+                k, _ = self._entries.popitem(last=False)
+                self._keys[k[0]].discard(k)
+                if not self._keys[k[0]]:
+                    del self._keys[k[0]]
+
+    def quote(self, ally, symbols, fields=[], block: bool = True, progress=None):
+        """Get quotes, from the cache where possible.
+
+        Returns:
+            flat list of dictionaries, each one a single quote
+        """
+        symbols = [s.upper() for s in split(symbols)]
+        fields = split(fields)
+        key = frozenset(fields) if fields else None
+        now = time.monotonic()
+
+        found, missing, stale = {}, [], []
+        with self._lock:
+            for s in symbols:
+                k, row, age = self._lookup(s, key, now)
+                if row is None or age > self.ttl + self.stale:
+                    missing.append(s)
+                    self.misses += 1
+                    continue
+
+                found[s] = row
+                if age <= self.ttl:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    if k not in self._refreshing:
+                        self._refreshing.add(k)
+                        stale.append(k)
+
+        if stale:
+            threading.Thread(
+                target=self._refresh, args=(ally, stale, block), daemon=True
+            ).start()
+
+        if missing:
+            rows = get(ally, missing, fields, block=block, progress=progress)
+
+            # Rate limited
+            if rows is None:
+                return None
+
+            self._store(rows, key, time.monotonic())
+            found.update((r["symbol"].upper(), r) for r in rows)
+
+        return [project(found[s], fields) for s in symbols if s in found]
+
+    def _refresh(self, ally, keys, block):
+        """Refetch stale quotes in the background, grouped by field set"""
+        groups = {}
+        for symbol, key in keys:
+            groups.setdefault(key, []).append(symbol)
+
+        try:
+            for key, symbols in groups.items():
+                rows = get(ally, symbols, sorted(key or []), block=block)
+                if rows is not None:
+                    self._store(rows, key, time.monotonic())
+        except Exception:
+            logger.exception("Background quote refresh failed")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(keys)
+
+    def feed(self, message):
+        """Update cached quotes from a stream() message.
+
+        Only fields a cached quote already has are overwritten.
+        """
+        for kind, tick in message.items():
+            if not isinstance(tick, dict) or "symbol" not in tick:
+                continue
+
+            renames = _stream_renames.get(kind, {})
+            symbol = tick["symbol"].upper()
+            now = time.monotonic()
+
+            with self._lock:
+                for k in self._keys.get(symbol, ()):
+                    entry = self._entries[k]
+                    row = entry[0]
+                    for f, v in tick.items():
+                        f = renames.get(f, f)
+                        if f in row and f != "symbol":
+                            row[f] = v
+                    entry[1] = now
+
+
+def cache_quotes(
+    self, ttl: float = 1.0, stale: float = 5.0, maxsize: int = 4096, enable=True
+):
+    """Serves repeated quote() calls from a short-lived cache.
+
+    Once enabled, a quote fetched in the last `ttl` seconds is returned
+    without spending any of the quote budget. Quotes up to `stale` seconds
+    past that are returned immediately as well, while one background request
+    refreshes them. While stream() runs, it keeps the cached quotes of its
+    symbols up to date.
+
+    Args:
+            ttl:
+                    seconds a quote is considered fresh
+
+            stale:
+                    further seconds a quote may be served while it is refreshed
+
+            maxsize:
+                    most quotes kept, least recently used are dropped first
+
+            enable:
+                    False to turn the cache off again
+
+    Returns:
+            The QuoteCache. Its stats() method reports hits and misses.
+
+    Example:
+
+    .. code-block:: python
+
+            cache = a.cache_quotes(ttl=2.0)
+
+            a.quote('spy')  # request
+            a.quote('spy')  # cached
+
+            cache.stats()
+            # {'hits': 1, 'stale_hits': 0, 'misses': 1, 'size': 1}
+
+    """
+    self.quote_cache = QuoteCache(ttl, stale, maxsize) if enable else None
+    return self.quote_cache
 
 
 def quote(
-    self, symbols: list = [], fields: list = [], dataframe=True, block: bool = True
+    self,
+    symbols: list = [],
+    fields: list = [],
+    dataframe=True,
+    block: bool = True,
+    progress=None,
+    columnar: bool = False,
 ):
     """Gets the most current market data on the price of a symbol.
 
@@ -121,13 +461,30 @@ def quote(
                     block:
                             Specify whether to block thread if request exceeds rate limit
 
+                    progress:
+                            Optional callable, progress(done, total, quotes), called as
+                            each chunk of a large request arrives
+
+                    columnar:
+                            flag, return a dictionary of typed numpy arrays, one per
+                            field, instead. Overrides dataframe
+
             Returns:
                     Depends on dataframe flag. Will return pandas dataframe, or possibly
                     list of dictionaries, each one a single quote.
 
+                    Any number of symbols may be asked for. More than fit in one
+                    request are fetched concurrently in chunks, and put back together
+                    in the order given.
+
             Raises:
                     RateLimitException: If block=False, rate limit problems will be raised
 
+                    PartialResultException: If some chunks of a large request failed,
+                    or were rate limited.
+                    The quotes that did arrive are in its .results, and .errors
+                    maps the symbols of each failed chunk, as a tuple, to its exception
+
             Examples:
 
     .. code-block:: python
@@ -153,15 +510,27 @@ def quote(
             # Access a specific symbol in the dict
             print(quotes['AAPL'])
 
+
+
+    .. code-block:: python
+
+            # A whole universe, with a progress report
+            quotes = a.quote(
+                    universe, # 3000 symbols
+                    progress=lambda done, total, chunk: print(done, '/', total)
+            )
+
     """
 
-    result = Quote(
-        auth=self.auth,
-        account_nbr=self.account_nbr,
-        symbols=symbols,
-        fields=fields,
-        block=block,
-    ).request()
+    if self.quote_cache is not None:
+        result = self.quote_cache.quote(
+            self, symbols, fields, block=block, progress=progress
+        )
+    else:
+        result = get(self, symbols, fields, block=block, progress=progress)
+
+    if columnar:
+        return None if result is None else Quote.Columns(result)
 
     if dataframe:
         try:
@@ -0,0 +1,345 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Streams any number of symbols, over as few connections as it takes.
+
+Ally takes at most 256 symbols on one stream. A ShardedStream splits its
+symbols into that many per shard, streams each shard on its own thread and
+connection, and hands every message over through one queue, in the order
+they arrived.
+
+Supervised, a shard whose connection drops, or goes quiet for too long,
+reconnects on its own with exponential backoff. Consumers are told about it
+with a gap message as soon as it happens:
+
+    {"gap": {"shard": 0, "symbols": [...], "since": 1597757400.0,
+             "reason": "..."}}
+
+where since is when the last message arrived (epoch seconds). Once the
+shard is back, a burst of REST quotes brings every one of its symbols up
+to date, each as a {"resync": quote} message.
+"""
+
+import math
+import queue
+import random
+import threading
+import time
+
+from ..exception import RateLimitException
+from ..utils import StreamMetrics
+from .stream import Stream
+from .ticks import typed
+
+# Ally allows this many symbols on one stream
+MAX_SYMBOLS = 256
+
+# Seconds without any data before a supervised connection is deemed dead
+IDLE = 60.0
+
+# First reconnect delay, doubling on each failure up to MAX_BACKOFF
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+
+class Shard:
+    """One upstream connection of a ShardedStream, and its metrics.
+
+    Lag is how long after its exchange timestamp a message arrived, with
+    the one second resolution of those timestamps.
+    """
+
+    def __init__(self, index: int, symbols):
+        self.index = index
+        self.symbols = symbols
+        self.endpoint = None
+        self.error = None
+
+        # Connections lost, and reconnects tried
+        self.gaps = 0
+        self.reconnects = 0
+
+        # Start of a gap not caught up on yet
+        self.since = None
+
+        self.messages = 0
+        self.started = None
+        self.last_arrival = None
+        self.lag_last = None
+        self.lag_max = None
+        self._lag_sum = 0.0
+        self._lags = 0
+
+    def record(self, message, now: float):
+        """Count a message that arrived at now (epoch seconds)"""
+        self.messages += 1
+        self.last_arrival = now
+
+        for tick in message.values():
+            try:
+                lag = now - int(tick["timestamp"])
+            except (KeyError, TypeError, ValueError):
+                return
+            self.lag_last = lag
+            if self.lag_max is None or lag > self.lag_max:
+                self.lag_max = lag
+            self._lag_sum += lag
+            self._lags += 1
+            return
+
+    def stats(self):
+        """Dictionary of this shard's metrics"""
+        now = time.time()
+        elapsed = now - self.started if self.started else 0.0
+        return {
+            "shard": self.index,
+            "symbols": len(self.symbols),
+            "connected": self.endpoint is not None and self.error is None,
+            "messages": self.messages,
+            "rate": self.messages / elapsed if elapsed > 0 else 0.0,
+            "idle": now - self.last_arrival if self.last_arrival else None,
+            "lag_last": self.lag_last,
+            "lag_mean": self._lag_sum / self._lags if self._lags else None,
+            "lag_max": self.lag_max,
+            "gaps": self.gaps,
+            "reconnects": self.reconnects,
+            "error": self.error,
+        }
+
+
+class ShardedStream:
+    """stream() for any number of symbols, merged into one iterator.
+
+    Iterating opens one connection per shard of up to 256 symbols. If any
+    shard ends, so does the whole stream, raising that shard's error if it
+    had one. Supervised, shards reconnect instead, see the module docstring.
+
+    Args:
+            auth, account_nbr: as for any endpoint
+
+            symbols: list of symbols, or a comma-separated string
+
+            supervise: reconnect dropped shards, with gap and resync messages
+
+            idle: seconds without data before a connection is reconnected,
+            None to wait forever
+
+            resync: called with a shard's symbols after it reconnects, returns
+            their quotes as a list of dictionaries. Typically quote() with
+            dataframe=False
+
+            metrics: StreamMetrics every shard records into, a new one by
+            default. Read it as s.metrics
+
+            cache: QuoteCache to keep current with every message, see
+            cache_quotes()
+
+            typed: yield QuoteTick and TradeTick objects, see ally.Quote.ticks
+
+    Example:
+
+    .. code-block:: python
+
+            s = ShardedStream(a.auth, a.account_nbr, universe)
+            for message in s:
+                    ...
+            print(s.stats())
+    """
+
+    def __init__(
+        self,
+        auth,
+        account_nbr=None,
+        symbols=(),
+        per_shard: int = MAX_SYMBOLS,
+        supervise: bool = False,
+        idle: float = IDLE,
+        resync=None,
+        metrics: StreamMetrics = None,
+        cache=None,
+        typed: bool = False,
+    ):
+        if isinstance(symbols, str):
+            symbols = symbols.split(",")
+        symbols = list(dict.fromkeys(s.upper() for s in symbols))
+
+        self.auth = auth
+        self.account_nbr = account_nbr
+        self.supervise = supervise
+        self.idle = idle if supervise else None
+        self.resync = resync
+        self.cache = cache
+        self.typed = typed
+
+        # Fewest shards, evenly sized
+        n = max(1, math.ceil(len(symbols) / per_shard))
+        size = math.ceil(len(symbols) / n)
+        self.shards = [Shard(i, symbols[i * size : (i + 1) * size]) for i in range(n)]
+
+        self._queue = queue.SimpleQueue()
+        self.metrics = StreamMetrics() if metrics is None else metrics
+        self.metrics.watch("shard_queue_depth", self._queue.qsize)
+
+        self._lock = threading.Lock()
+        self._iter = None
+        self.closed = False
+
+        # Set once shards should stop for good, wakes them from backoff
+        self._stop = threading.Event()
+
+    @property
+    def symbols(self):
+        return [s for shard in self.shards for s in shard.symbols]
+
+    def _run(self, shard):
+        """Shard thread: stream into the shared queue, reconnecting if supervised"""
+        put = self._queue.put
+        attempt = 0
+        try:
+            while True:
+                with self._lock:
+                    if self._stop.is_set():
+                        return
+
+                    # A fresh request every time, since each needs a fresh
+                    #  signature. The session, and its pool, stay the same
+                    endpoint = shard.endpoint = Stream(
+                        auth=self.auth,
+                        account_nbr=self.account_nbr,
+                        symbols=shard.symbols,
+                    )
+                    endpoint.metrics = self.metrics
+                if shard.started is None:
+                    shard.started = time.time()
+
+                error = None
+                try:
+                    for message in endpoint.request(
+                        self.idle, lambda: self._connected(shard)
+                    ):
+                        attempt = 0
+                        shard.record(message, time.time())
+                        put(message)
+                except Exception as e:
+                    error = e
+
+                if self._stop.is_set() or not self.supervise:
+                    shard.error = error
+                    return
+
+                if shard.since is None:
+                    shard.since = shard.last_arrival or shard.started
+                    shard.gaps += 1
+                    self.metrics.count("gaps")
+                    put(self._gap(shard, error or "stream ended"))
+
+                # Full jitter, so shards don't all come back at once
+                delay = min(MAX_BACKOFF, BACKOFF * 2**attempt)
+                if self._stop.wait(delay * (0.5 + random.random() / 2)):
+                    return
+                attempt += 1
+                shard.reconnects += 1
+                self.metrics.count("reconnects")
+        finally:
+            put(shard)
+
+    def _gap(self, shard, reason):
+        return {
+            "gap": {
+                "shard": shard.index,
+                "symbols": shard.symbols,
+                "since": shard.since,
+                "reason": str(reason),
+            }
+        }
+
+    def _connected(self, shard):
+        """A stream was accepted: catch up on any gap over REST"""
+        if shard.since is None:
+            return
+
+        if self.resync is not None:
+            try:
+                rows = self.resync(shard.symbols)
+                if rows is None:
+                    raise RateLimitException("Rate limited")
+            except Exception as e:
+                self._queue.put(self._gap(shard, "resync failed: {0}".format(e)))
+                rows = ()
+
+            for row in rows:
+                self._queue.put({"resync": row})
+
+        shard.since = None
+
+    def request(self):
+        """Generator over the messages of every shard, in order of arrival"""
+        for shard in self.shards:
+            threading.Thread(
+                target=self._run,
+                args=(shard,),
+                name="StreamShard-{0}".format(shard.index),
+                daemon=True,
+            ).start()
+
+        get = self._queue.get
+        cache = self.cache
+        try:
+            while True:
+                message = get()
+
+                # A shard thread finishing puts itself on the queue
+                if isinstance(message, Shard):
+                    if message.error is not None and not self.closed:
+                        raise message.error
+                    return
+
+                if cache is not None:
+                    cache.feed(message)
+                yield typed(message) if self.typed else message
+        finally:
+            self._stop.set()
+            self._disconnect()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iter is None:
+            self._iter = self.request()
+        return next(self._iter)
+
+    def close(self):
+        """Close every shard's connection, from any thread"""
+        with self._lock:
+            self.closed = True
+            self._stop.set()
+        self._disconnect()
+
+    def _disconnect(self):
+        for shard in self.shards:
+            if shard.endpoint is not None:
+                shard.endpoint.close()
+
+    def stats(self):
+        """Metrics of each shard, see Shard"""
+        return [shard.stats() for shard in self.shards]
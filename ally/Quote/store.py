@@ -0,0 +1,253 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Keeps timesales bars on disk, so history outlives the API's 5-day window.
+
+Bars of each (interval, symbol) are kept in one numpy file, sorted by time,
+and read back memory-mapped. A small JSON file next to it records which days
+have been fetched. A timesales() call then only asks the API for the days
+not on disk yet, and serves everything else from the file.
+"""
+
+import datetime
+import json
+import os
+import re
+import threading
+
+from .. import schema
+from .bars import EASTERN
+from .timesales import Timesales, fetch
+
+
+def _today(now=None) -> datetime.date:
+    """The market's date at now, an aware datetime, or at present.
+
+    Days the API still adds bars to aren't complete, and get fetched
+    again. That's a New York day, whatever the host's own zone says.
+    """
+    import pytz
+
+    tz = pytz.timezone(EASTERN)
+    return now.astimezone(tz).date() if now else datetime.datetime.now(tz).date()
+
+
+_unsafe = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def _day(d) -> datetime.date:
+    """Date from 'YYYY-MM-DD', a date or a datetime"""
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    if isinstance(d, datetime.date):
+        return d
+    return datetime.date.fromisoformat(str(d)[:10])
+
+
+def _ranges(days):
+    """Collapse sorted days into [first, last] runs of consecutive days"""
+    runs = []
+    for d in days:
+        if runs and d - runs[-1][1] == datetime.timedelta(days=1):
+            runs[-1][1] = d
+        else:
+            runs.append([d, d])
+    return runs
+
+
+class TimesalesStore:
+    """On-disk timesales history, keyed by symbol and interval.
+
+    Layout under `path`: one `<interval>/<SYMBOL>.npy` file of bars, a
+    structured array sorted by time with the fields of ally.schema.TIMESALES,
+    and one `<interval>/<SYMBOL>.json` file listing the days fetched so far.
+    Files are replaced atomically, so readers never see half a write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        # (interval, SYMBOL) -> lock, so symbols don't wait on each other
+        self._locks = {}
+
+    @property
+    def dtype(self):
+        import numpy as np
+
+        return np.dtype([(k, f.dtype) for k, f in schema.TIMESALES.items()])
+
+    def _file(self, symbol, interval, ext):
+        d = os.path.join(self.path, _unsafe.sub("_", interval))
+        return os.path.join(d, _unsafe.sub("_", symbol.upper()) + ext)
+
+    def _replace(self, name, write):
+        """Write to a temporary file, then move it into place"""
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        tmp = "{0}.{1}.tmp".format(name, os.getpid())
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, name)
+
+    def coverage(self, symbol: str, interval: str = "5min"):
+        """Set of days on disk for this symbol and interval"""
+        try:
+            with open(self._file(symbol, interval, ".json")) as f:
+                runs = json.load(f)["days"]
+        except FileNotFoundError:
+            return set()
+
+        days = set()
+        for first, last in runs:
+            d, last = _day(first), _day(last)
+            while d <= last:
+                days.add(d)
+                d += datetime.timedelta(days=1)
+        return days
+
+    def bars(self, symbol: str, interval: str = "5min"):
+        """All stored bars, as a read-only memory-mapped structured array"""
+        import numpy as np
+
+        try:
+            return np.load(self._file(symbol, interval, ".npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return np.empty(0, dtype=self.dtype)
+
+    def read(self, symbol: str, startdate, enddate, interval: str = "5min"):
+        """Stored bars between two days, both included.
+
+        Returns:
+            dictionary of field name to numpy array, like Timesales.Columns
+        """
+        bars = self.bars(symbol, interval)
+        lo, hi = bars["date"].searchsorted(
+            [_day(startdate), _day(enddate) + datetime.timedelta(days=1)]
+        )
+        return {k: bars[k][lo:hi].copy() for k in bars.dtype.names}
+
+    def missing(self, symbol: str, startdate, enddate, interval: str = "5min"):
+        """Runs of days between two days that aren't on disk yet
+
+        Returns:
+            list of [first, last] dates
+        """
+        have = self.coverage(symbol, interval)
+        d, last = _day(startdate), _day(enddate)
+        days = []
+        while d <= last:
+            if d not in have:
+                days.append(d)
+            d += datetime.timedelta(days=1)
+        return _ranges(days)
+
+    def merge(self, symbol: str, interval: str, first, last, columns):
+        """Put fetched bars for days first..last on disk, replacing any there"""
+        import numpy as np
+
+        first, last = _day(first), _day(last)
+        new = np.empty(len(next(iter(columns.values()), [])), dtype=self.dtype)
+        for k in new.dtype.names:
+            if k in columns:
+                new[k] = columns[k]
+            else:
+                new[k] = schema.TIMESALES[k].fill
+
+        old = self.bars(symbol, interval)
+        keep = (old["date"] < np.datetime64(first)) | (
+            old["date"] > np.datetime64(last)
+        )
+        bars = np.concatenate([old[keep], new])
+        bars = bars[np.argsort(bars["datetime"], kind="stable")]
+
+        # Today's bars are still coming in
+        days = self.coverage(symbol, interval)
+        d = first
+        while d <= last and d < _today():
+            days.add(d)
+            d += datetime.timedelta(days=1)
+
+        runs = [[str(a), str(b)] for a, b in _ranges(sorted(days))]
+        self._replace(self._file(symbol, interval, ".npy"), lambda f: np.save(f, bars))
+        self._replace(
+            self._file(symbol, interval, ".json"),
+            lambda f: f.write(json.dumps({"days": runs}).encode()),
+        )
+
+    def timesales(
+        self, ally, symbol: str, startdate, enddate, interval="5min", block=True
+    ):
+        """Bars between two days, fetching only the days not on disk yet.
+
+        Returns:
+            dictionary of field name to numpy array, like Timesales.Columns
+        """
+        with self._lock:
+            lock = self._locks.setdefault((interval, symbol.upper()), threading.Lock())
+
+        with lock:
+            for first, last in self.missing(symbol, startdate, enddate, interval):
+                rows = fetch(ally, symbol, str(first), str(last), interval, block)
+
+                # Rate limited
+                if rows is None:
+                    return None
+
+                self.merge(symbol, interval, first, last, Timesales.Columns(rows))
+
+            return self.read(symbol, startdate, enddate, interval)
+
+
+def store_timesales(self, path: str, enable: bool = True):
+    """Keeps fetched timesales on disk, and only fetches what isn't there.
+
+    Once enabled, timesales() serves every day it has already fetched from
+    `path`, and asks the API only for the rest. The API just keeps the last
+    5 trading days, so over time the store holds far more history than the
+    API can give. Days are refetched until they are over.
+
+    Args:
+            path:
+                    directory to keep the bars in
+
+            enable:
+                    False to go back to fetching everything
+
+    Returns:
+            The TimesalesStore
+
+    Example:
+
+    .. code-block:: python
+
+            a.store_timesales('~/.ally/timesales')
+
+            # Fetched
+            a.timesales('spy', '2020-08-17', '2020-08-21')
+
+            # Only fetches the 24th
+            a.timesales('spy', '2020-08-17', '2020-08-24')
+
+    """
+    path = os.path.expanduser(path)
+    self.timesales_store = TimesalesStore(path) if enable else None
+    return self.timesales_store
@@ -21,6 +21,10 @@
 # SOFTWARE.
 
 from ..Api import RequestType, StreamEndpoint
+from ..utils import StreamMetrics
+from .bars import BarBuilder
+from .quote import get
+from .ticks import ticks
 
 
 class Stream(StreamEndpoint):
@@ -59,20 +63,54 @@ class Stream(StreamEndpoint):
 
 
 # stream = template(Stream)
-def stream(self, symbols: list = []):
-    """Live-streams market quotes for up to 256 stock and options.
+def stream(
+    self,
+    symbols: list = [],
+    supervise: bool = False,
+    idle: float = 60.0,
+    typed: bool = False,
+):
+    """Live-streams market quotes for stocks and options.
 
             The stream generator that yields dictionaries. Specify one or more
             symbols, and the stream object establishes a connection with the API servers,
             then starts returning symbol-keyed quote objects in real-time.
 
+            Ally takes up to 256 symbols on one connection. More are split
+            across as few connections as it takes, and merged back into one
+            ShardedStream, in order of arrival. Its stats() has message rates
+            and lag of each connection.
+
+            A supervised stream reconnects on its own when a connection drops
+            or goes quiet, with exponential backoff. It tells consumers with a
+            {'gap': {...}} message right away, and follows the reconnect with
+            a {'resync': quote} message per symbol, fetched from the API
+            rather than the quote cache.
+            See ally.Quote.shard for their contents.
+
+            Every stream of an Ally instance records into its stream_metrics,
+            a StreamMetrics with message and byte rates, decode time and lag
+            histograms and reconnect counts, as_dict() or prometheus() text.
+
             Args:
                     symbols:
                             string or list of strings, each string a symbol to be queried.
                             Notice symbols=['spy'], symbols='spy both work.
 
+                    supervise:
+                            flag, reconnect instead of ending when a connection drops
+
+                    idle:
+                            seconds without any data before a supervised
+                            connection is reconnected, None to never time out
+
+                    typed:
+                            flag, yield compact QuoteTick and TradeTick objects,
+                            with numbers already parsed, instead of quote and
+                            trade dictionaries. See ally.Quote.ticks
+
             Returns:
-                    A generator
+                    A generator, or a ShardedStream if supervised or past 256 symbols
 
             Example:
 
@@ -82,9 +120,80 @@ def stream(self, symbols: list = []):
                             print(quote)
 
     """
-
-    result = Stream(
-        auth=self.auth, account_nbr=self.account_nbr, symbols=symbols
-    ).request()
+    from .shard import MAX_SYMBOLS, ShardedStream
+
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+
+    if self.stream_metrics is None:
+        self.stream_metrics = StreamMetrics()
+
+    if supervise or len(symbols) > MAX_SYMBOLS:
+        # Feeds the cache and types ticks itself, so it is returned
+        #  as is, close() and stats() included
+        return ShardedStream(
+            self.auth,
+            self.account_nbr,
+            symbols,
+            supervise=supervise,
+            idle=idle,
+            # Past the cache, which missed what the gap carried
+            resync=lambda s: get(self, s, []),
+            metrics=self.stream_metrics,
+            cache=self.quote_cache,
+            typed=typed,
+        )
+
+    endpoint = Stream(auth=self.auth, account_nbr=self.account_nbr, symbols=symbols)
+    endpoint.metrics = self.stream_metrics
+    result = endpoint.request()
+
+    # Keep cached quotes current
+    if self.quote_cache is not None:
+        result = _feed(self.quote_cache, result)
+
+    if typed:
+        result = ticks(result)
 
     return result
+
+
+def stream_bars(self, symbols: list = [], rule: str = "1min", delay: float = 2.0):
+    """Live-streams bars built from the trades of stream().
+
+            Args:
+                    symbols:
+                            string or list of strings, as for stream()
+
+                    rule:
+                            bar width, like '1min', '5min' or '1h'. Bars start
+                            at 9:30 New York time and every rule after
+
+                    delay:
+                            seconds past the end of a bucket its bars are closed,
+                            even without trades. Trades later than that miss it
+
+            Returns:
+                    A generator of dictionaries of numpy arrays, one batch of
+                    closed bars each time a bucket ends: 'symbol', 'datetime'
+                    (bar start, UTC), 'opn', 'hi', 'lo', 'last', 'incr_vl',
+                    'vwap' and 'count' (trades in the bar). See BarBuilder.
+
+            Example:
+
+    .. code-block:: python
+
+                    for bars in a.stream_bars(['spy', 'gld'], '1min'):
+                            print(bars['symbol'], bars['last'])
+
+    """
+    if isinstance(symbols, str):
+        symbols = symbols.split(",")
+
+    return BarBuilder(symbols, rule).run(self.stream(symbols, typed=True), delay)
+
+
+def _feed(cache, messages):
+    for message in messages:
+        cache.feed(message)
+        yield message
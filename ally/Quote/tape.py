@@ -0,0 +1,375 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Records stream() messages to disk, and plays them back.
+
+A tape is two files. The records file has a 64 byte header, then one fixed
+width record per quote or trade, appended as they arrive. Next to it,
+<path>.symbols lists the symbols, one per line; a record's symbol is its
+line number. Symbols are written before any record using them, so a tape
+cut short by a crash still reads back, minus at most a partial record.
+
+Records are read back memory-mapped, as a numpy structured array, or
+replayed as stream() messages at any speed.
+"""
+
+import os
+import struct
+import time
+
+from .ticks import QuoteTick, TradeTick
+
+MAGIC = b"ALLYTAPE"
+VERSION = 1
+HEADER = 64
+
+# Records buffered before each write
+BUFFER = 4096
+
+# Records turned into Python objects at once, during replay
+CHUNK = 65536
+
+QUOTE, TRADE = 0, 1
+
+# (name, type) of each record field, laid out aligned
+FIELDS = [
+    ("arrival", "f8"),  # local time received, epoch seconds
+    ("timestamp", "i8"),  # exchange time, epoch seconds
+    ("bid", "f8"),
+    ("ask", "f8"),
+    ("last", "f8"),
+    ("cvol", "i8"),  # trades: day's volume so far
+    ("bidsz", "i4"),
+    ("asksz", "i4"),
+    ("vl", "i4"),  # trades: size of this trade
+    ("symbol", "u2"),
+    ("kind", "u1"),
+]
+
+
+def dtype():
+    import numpy as np
+
+    return np.dtype(FIELDS, align=True)
+
+
+def _float(tick, name):
+    try:
+        return float(tick[name])
+    except (KeyError, TypeError, ValueError):
+        return float("nan")
+
+
+def _int(tick, name):
+    try:
+        return int(tick[name])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+class TickRecorder:
+    """Appends stream() messages to a tape.
+
+    Example:
+
+    .. code-block:: python
+
+            with TickRecorder('2020-08-18.tape') as tape:
+                    for message in tape.tee(a.stream(['spy', 'gld'])):
+                            ...
+    """
+
+    def __init__(self, path: str, buffer: int = BUFFER):
+        import numpy as np
+
+        self.path = path
+        self._dtype = dtype()
+        self._buffer = np.zeros(buffer, self._dtype)
+        self._n = 0
+
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        if new:
+            header = struct.pack("<8sHH", MAGIC, VERSION, self._dtype.itemsize)
+            self._file.write(header.ljust(HEADER, b"\0"))
+        else:
+            _check(path, self._dtype)
+
+            # Drop a record cut short by a crash
+            whole = (os.path.getsize(path) - HEADER) // self._dtype.itemsize
+            self._file.truncate(HEADER + whole * self._dtype.itemsize)
+
+        # Symbols known so far, appended to as new ones show up
+        self.symbols = _symbols(path)
+        self._ids = {s: i for i, s in enumerate(self.symbols)}
+        self._symbol_file = open(path + ".symbols", "a")
+
+        self.written = 0
+
+    def _id(self, symbol: str) -> int:
+        i = self._ids.get(symbol)
+        if i is None:
+            i = self._ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self._symbol_file.write(symbol + "\n")
+            self._symbol_file.flush()
+        return i
+
+    def write(self, message, arrival: float = None):
+        """Records one stream() message, received at arrival (default now)"""
+        if arrival is None:
+            arrival = time.time()
+
+        t = type(message)
+        if t is QuoteTick or t is TradeTick:
+            self._add(self._row(message, arrival))
+            return
+
+        for kind, tick in message.items():
+            if kind == "quote":
+                row = (
+                    arrival,
+                    _int(tick, "timestamp"),
+                    _float(tick, "bid"),
+                    _float(tick, "ask"),
+                    float("nan"),
+                    0,
+                    _int(tick, "bidsz"),
+                    _int(tick, "asksz"),
+                    0,
+                    self._id(tick["symbol"]),
+                    QUOTE,
+                )
+            elif kind == "trade":
+                row = (
+                    arrival,
+                    _int(tick, "timestamp"),
+                    float("nan"),
+                    float("nan"),
+                    _float(tick, "last"),
+                    _int(tick, "cvol"),
+                    0,
+                    0,
+                    _int(tick, "vl"),
+                    self._id(tick["symbol"]),
+                    TRADE,
+                )
+            else:
+                continue
+            self._add(row)
+
+    def _row(self, tick, arrival):
+        """Record of a QuoteTick or TradeTick"""
+        nan = float("nan")
+        if type(tick) is QuoteTick:
+            return (
+                arrival,
+                tick.timestamp,
+                tick.bid,
+                tick.ask,
+                nan,
+                0,
+                tick.bidsz,
+                tick.asksz,
+                0,
+                self._id(tick.symbol),
+                QUOTE,
+            )
+        return (
+            arrival,
+            tick.timestamp,
+            nan,
+            nan,
+            tick.last,
+            tick.cvol,
+            0,
+            0,
+            tick.vl,
+            self._id(tick.symbol),
+            TRADE,
+        )
+
+    def _add(self, row):
+        self._buffer[self._n] = row
+        self._n += 1
+        if self._n == len(self._buffer):
+            self.flush()
+
+    def tee(self, messages):
+        """Records messages while passing them on"""
+        for message in messages:
+            self.write(message)
+            yield message
+
+    def flush(self):
+        """Writes out buffered records"""
+        if self._n:
+            self._file.write(self._buffer[: self._n].tobytes())
+            self.written += self._n
+            self._n = 0
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._symbol_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check(path, expected):
+    with open(path, "rb") as f:
+        magic, version, size = struct.unpack("<8sHH", f.read(12))
+    if magic != MAGIC or version != VERSION or size != expected.itemsize:
+        raise ValueError("{0} is not a version {1} tape".format(path, VERSION))
+
+
+def _symbols(path):
+    try:
+        with open(path + ".symbols") as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+class TickTape:
+    """A recorded tape, memory-mapped.
+
+    Attributes:
+            records: numpy structured array of every record, see FIELDS
+            symbols: symbol of each id in records['symbol']
+
+    Example:
+
+    .. code-block:: python
+
+            tape = TickTape('2020-08-18.tape')
+            for message in tape.replay(speed=10):
+                    builder.feed(message)
+    """
+
+    def __init__(self, path: str):
+        import numpy as np
+
+        self.path = path
+        d = dtype()
+        _check(path, d)
+
+        n = (os.path.getsize(path) - HEADER) // d.itemsize
+        if n:
+            self.records = np.memmap(path, d, "r", offset=HEADER, shape=(n,))
+        else:
+            self.records = np.zeros(0, d)
+        self.symbols = _symbols(path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, symbols=None, start: float = None, end: float = None):
+        """Records of some symbols, arrived between start and end (epoch seconds)
+
+        Records are in order of arrival, so a time range is a view of the
+        memmap. Only picking symbols copies, and only the records picked.
+        """
+        import numpy as np
+
+        r = self.records
+        if start is not None or end is not None:
+            arrival = r["arrival"]
+            lo = 0 if start is None else np.searchsorted(arrival, start, "left")
+            hi = len(r) if end is None else np.searchsorted(arrival, end, "left")
+            r = r[lo:hi]
+
+        if symbols is not None:
+            if isinstance(symbols, str):
+                symbols = symbols.split(",")
+            wanted = [s.upper() for s in symbols]
+            ids = [i for i, s in enumerate(self.symbols) if s in wanted]
+            r = r[np.isin(r["symbol"], ids)]
+        return r
+
+    def replay(self, speed: float = None, symbols=None, start=None, end=None):
+        """Plays records back as stream() messages.
+
+        Args:
+                speed: 1 for the pace they arrived at, 10 for ten times
+                faster, None for as fast as possible
+
+                symbols, start, end: see select()
+
+        Yields:
+                {'quote': {...}} and {'trade': {...}} messages, with the fields
+                of a stream() message that a tape keeps, already numbers
+        """
+        records = self.select(symbols, start, end)
+        if not len(records):
+            return
+
+        symbols = self.symbols
+        t0, clock = records["arrival"][0], time.monotonic()
+
+        for i in range(0, len(records), CHUNK):
+            for row in records[i : i + CHUNK].tolist():
+                (
+                    received,
+                    timestamp,
+                    bid,
+                    ask,
+                    last,
+                    cvol,
+                    bidsz,
+                    asksz,
+                    vl,
+                    symbol,
+                    kind,
+                ) = row
+
+                if speed is not None:
+                    wait = (received - t0) / speed - (time.monotonic() - clock)
+                    if wait > 0:
+                        time.sleep(wait)
+
+                if kind == QUOTE:
+                    yield {
+                        "quote": {
+                            "ask": ask,
+                            "asksz": asksz,
+                            "bid": bid,
+                            "bidsz": bidsz,
+                            "symbol": symbols[symbol],
+                            "timestamp": timestamp,
+                        }
+                    }
+                else:
+                    yield {
+                        "trade": {
+                            "cvol": cvol,
+                            "last": last,
+                            "symbol": symbols[symbol],
+                            "timestamp": timestamp,
+                            "vl": vl,
+                        }
+                    }
@@ -0,0 +1,1130 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Runs test cases on the quote functions, without touching the network."""
+
+import datetime
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from .bars import BarAggregator, BarBuilder, resample
+from .book import TopOfBook
+from .coalesce import QuoteCoalescer
+from .hub import StreamHub, Subscription
+from .shard import ShardedStream
+from .stream import stream
+from ..exception import PartialResultException, RateLimitException
+from .quote import QuoteCache, fetch, quote
+from .store import TimesalesStore, _today
+from .tape import TickRecorder, TickTape
+from .ticks import QuoteTick, TradeTick, ticks, typed
+from .timesales import iter_timesales, timesales_many
+
+
+def fake_quotes(ally, symbols, fields, block=True, **kwargs):
+    """Stands in for a quote request"""
+    fake_quotes.calls.append((list(symbols), list(fields)))
+    return [
+        {"symbol": s, "bid": "1.00", "ask": "1.01", "vl": "10", "name": s.lower()}
+        for s in symbols
+    ]
+
+
+class TestQuoteCoalescer(unittest.TestCase):
+    def setUp(self):
+        fake_quotes.calls = []
+        patcher = mock.patch("ally.Quote.coalesce.fetch", fake_quotes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_merge(self):
+        c = QuoteCoalescer(None, window=0.2)
+        results = {}
+
+        def job(symbols, fields):
+            results[symbols] = c.quote(symbols, fields)
+
+        threads = [
+            threading.Thread(target=job, args=("spy,gld", ["bid"])),
+            threading.Thread(target=job, args=("gld", ["ask"])),
+            threading.Thread(target=job, args=("f", [])),
+        ]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        self.assertEqual(len(fake_quotes.calls), 1, "One request for three callers")
+        self.assertEqual(fake_quotes.calls[0][0], ["SPY", "GLD", "F"])
+        self.assertEqual((c.calls, c.requests), (3, 1))
+
+        # Everyone gets just what they asked for
+        self.assertEqual(
+            results["spy,gld"],
+            [{"bid": "1.00", "symbol": "SPY"}, {"bid": "1.00", "symbol": "GLD"}],
+        )
+        self.assertEqual(results["gld"], [{"ask": "1.01", "symbol": "GLD"}])
+        self.assertEqual(len(results["f"][0]), 5, "All fields")
+
+    def test_max_symbols(self):
+        c = QuoteCoalescer(None, window=0.1, max_symbols=2)
+        threads = [
+            threading.Thread(target=c.quote, args=(s,)) for s in ("a,b", "c", "d")
+        ]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        for symbols, fields in fake_quotes.calls:
+            self.assertLessEqual(len(symbols), 2)
+
+
+class TestQuoteCache(unittest.TestCase):
+    # Just enough of an Ally object
+    ally = mock.Mock(quote_coalescer=None)
+
+    def setUp(self):
+        fake_quotes.calls = []
+        patcher = mock.patch("ally.Quote.quote.fetch", fake_quotes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_miss(self):
+        c = QuoteCache(ttl=10.0)
+        c.quote(self.ally, ["spy", "gld"])
+        rows = c.quote(self.ally, "gld,spy", ["bid"])
+
+        self.assertEqual(len(fake_quotes.calls), 1, "Second call fully cached")
+        self.assertEqual(rows[0], {"bid": "1.00", "symbol": "GLD"})
+        self.assertEqual(c.stats()["hits"], 2)
+        self.assertEqual(c.stats()["misses"], 2)
+
+    def test_stale_while_revalidate(self):
+        c = QuoteCache(ttl=0.0, stale=10.0)
+        c.quote(self.ally, "spy")
+
+        def slow_quotes(*args, **kwargs):
+            time.sleep(0.05)
+            return fake_quotes(*args, **kwargs)
+
+        patcher = mock.patch("ally.Quote.quote.fetch", slow_quotes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Served from cache, with a single refresh in the background
+        for i in range(5):
+            self.assertEqual(len(c.quote(self.ally, "spy")), 1)
+        time.sleep(0.1)
+
+        self.assertEqual(len(fake_quotes.calls), 2)
+        self.assertEqual(c.stats()["stale_hits"], 5)
+
+    def test_lru(self):
+        c = QuoteCache(ttl=10.0, maxsize=2)
+        c.quote(self.ally, "a,b")
+        c.quote(self.ally, "a")
+        c.quote(self.ally, "c")
+        c.quote(self.ally, "a")
+        self.assertEqual(fake_quotes.calls[-1][0], ["C"], "A stayed, B was evicted")
+
+    def test_feed(self):
+        c = QuoteCache(ttl=10.0)
+        c.quote(self.ally, "spy", ["bid", "vl"])
+        c.feed({"quote": {"symbol": "SPY", "bid": "2.00", "bidsz": "3"}})
+        c.feed({"trade": {"symbol": "SPY", "cvol": "1000", "last": "2.00"}})
+
+        self.assertEqual(
+            c.quote(self.ally, "spy", ["bid", "vl"]),
+            [{"bid": "2.00", "vl": "1000", "symbol": "SPY"}],
+        )
+
+
+class TestChunkedFetch(unittest.TestCase):
+    def setUp(self):
+        fake_quotes.calls = []
+        patcher = mock.patch("ally.Quote.quote.fetch_one", self.fetch_one)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fail_on = None
+        self.limit_on = None
+
+    def fetch_one(self, ally, symbols, fields, block=True):
+        # First chunk finishes last
+        if symbols[0] == "S0":
+            time.sleep(0.05)
+        if symbols[0] == self.fail_on:
+            raise ValueError("boom")
+        if symbols[0] == self.limit_on:
+            return None
+        return fake_quotes(ally, symbols, fields)
+
+    def test_order(self):
+        symbols = ["S%d" % i for i in range(450)]
+        progress = []
+        rows = fetch(None, symbols, [], progress=lambda *a: progress.append(a[:2]))
+
+        self.assertEqual(sorted(len(c) for c, f in fake_quotes.calls), [50, 200, 200])
+        self.assertEqual([r["symbol"] for r in rows], symbols)
+        self.assertEqual(progress[-1], (450, 450))
+        self.assertEqual(len(progress), 3)
+
+    def test_partial(self):
+        self.fail_on = "S200"
+        with self.assertRaises(PartialResultException) as cm:
+            fetch(None, ["S%d" % i for i in range(450)], [])
+
+        self.assertEqual(len(cm.exception.results), 250)
+        [(chunk, error)] = cm.exception.errors.items()
+        self.assertEqual(chunk, tuple("S%d" % i for i in range(200, 400)))
+        self.assertIsInstance(error, ValueError)
+
+    def test_partly_rate_limited(self):
+        self.limit_on = "S0"
+        with self.assertRaises(PartialResultException) as cm:
+            fetch(None, ["S%d" % i for i in range(450)], [])
+
+        self.assertEqual(len(cm.exception.results), 250)
+        [(chunk, error)] = cm.exception.errors.items()
+        self.assertEqual(chunk[0], "S0")
+        self.assertIsInstance(error, RateLimitException)
+
+    def test_rate_limited(self):
+        a = mock.Mock(quote_cache=None, quote_coalescer=None)
+
+        # Not to be mistaken for no quotes at all
+        with mock.patch("ally.Quote.quote.fetch_one", return_value=None):
+            self.assertIsNone(quote(a, "spy", columnar=True))
+            self.assertIsNone(quote(a, "spy", dataframe=False))
+
+
+def fake_bars(ally, symbol, startdate, enddate, interval="5min", block=True):
+    """Two bars per weekday, like a tiny timesales response"""
+    fake_bars.calls.append((startdate, enddate))
+    d, last = datetime.date.fromisoformat(startdate), datetime.date.fromisoformat(
+        enddate
+    )
+    rows = []
+    while d <= last:
+        if d.weekday() < 5:
+            for t, px in (("09:30", "1.5"), ("09:35", "2.5")):
+                rows.append(
+                    {
+                        "date": str(d),
+                        "datetime": "{0}T{1}:00-04:00".format(d, t),
+                        "last": px,
+                        "vl": "100",
+                    }
+                )
+        d += datetime.timedelta(days=1)
+    return rows
+
+
+class TestTimesalesStore(unittest.TestCase):
+    def setUp(self):
+        fake_bars.calls = []
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        for target, new in (
+            ("ally.Quote.store.fetch", fake_bars),
+            ("ally.Quote.store._today", lambda: datetime.date(2020, 8, 24)),
+        ):
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.store = TimesalesStore(self.path)
+
+    def test_fetch_once(self):
+        cols = self.store.timesales(None, "spy", "2020-08-17", "2020-08-21")
+        self.assertEqual(len(cols["last"]), 10)
+        self.assertEqual(cols["vl"].dtype.kind, "i")
+        self.assertEqual(fake_bars.calls, [("2020-08-17", "2020-08-21")])
+
+        # All from disk
+        cols = self.store.timesales(None, "SPY", "2020-08-18", "2020-08-19")
+        self.assertEqual(len(cols["last"]), 4)
+        self.assertEqual(len(fake_bars.calls), 1)
+
+    def test_gaps(self):
+        self.store.timesales(None, "spy", "2020-08-18", "2020-08-19")
+        cols = self.store.timesales(None, "spy", "2020-08-17", "2020-08-21")
+
+        self.assertEqual(
+            fake_bars.calls[1:],
+            [("2020-08-17", "2020-08-17"), ("2020-08-20", "2020-08-21")],
+        )
+        self.assertTrue((cols["datetime"][1:] > cols["datetime"][:-1]).all())
+        self.assertEqual(len(cols["datetime"]), 10)
+
+    def test_today_refetched(self):
+        self.store.timesales(None, "spy", "2020-08-21", "2020-08-24")
+        self.store.timesales(None, "spy", "2020-08-21", "2020-08-24")
+        self.assertEqual(fake_bars.calls[-1], ("2020-08-24", "2020-08-24"))
+
+        # No duplicates from refetching
+        cols = self.store.read("spy", "2020-08-24", "2020-08-24")
+        self.assertEqual(len(cols["datetime"]), 2)
+
+    def test_today_in_new_york(self):
+        # Evening in New York is already tomorrow in UTC
+        now = datetime.datetime(2020, 8, 25, 1, 30, tzinfo=datetime.timezone.utc)
+        self.assertEqual(_today(now), datetime.date(2020, 8, 24))
+
+
+def some_bars(ally, symbol, startdate, enddate, interval="5min", block=True):
+    """fake_bars, except that BAD fails"""
+    if symbol == "BAD":
+        raise ValueError(symbol)
+    return fake_bars(ally, symbol, startdate, enddate, interval, block)
+
+
+class TestTimesalesMany(unittest.TestCase):
+    def setUp(self):
+        fake_bars.calls = []
+        self.ally = mock.Mock(timesales_store=None)
+
+        for target in ("ally.Quote.timesales.fetch", "ally.Quote.store.fetch"):
+            patcher = mock.patch(target, some_bars)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_long(self):
+        df = timesales_many(self.ally, "spy,gld,tsla", "2020-08-17", "2020-08-18")
+        self.assertEqual(len(df), 12)
+        self.assertEqual(list(df.columns[:1]), ["symbol"])
+        self.assertEqual(list(df["symbol"].unique()), ["SPY", "GLD", "TSLA"])
+        self.assertEqual(df["vl"].dtype.kind, "i")
+        self.assertEqual(len(fake_bars.calls), 3)
+
+    def test_isolated(self):
+        with self.assertRaises(PartialResultException) as cm:
+            timesales_many(
+                self.ally,
+                ["spy", "bad", "gld"],
+                "2020-08-17",
+                "2020-08-17",
+                columnar=True,
+            )
+        e = cm.exception
+        self.assertEqual(list(e.errors), ["BAD"])
+        self.assertIsInstance(e.errors["BAD"], ValueError)
+        self.assertEqual(list(e.results["symbol"]), ["SPY", "SPY", "GLD", "GLD"])
+
+    def test_iter(self):
+        got = {
+            symbol: error
+            for symbol, cols, error in iter_timesales(
+                self.ally, ["spy", "bad", "gld"], "2020-08-17", "2020-08-17"
+            )
+        }
+        self.assertEqual(set(got), {"SPY", "BAD", "GLD"})
+        self.assertIsNone(got["SPY"])
+        self.assertIsInstance(got["BAD"], ValueError)
+
+    def test_iter_break(self):
+        started = []
+
+        def slow_bars(ally, symbol, *args, **kwargs):
+            started.append(symbol)
+            time.sleep(0.2)
+            return some_bars(ally, symbol, *args, **kwargs)
+
+        symbols = ["S%d" % i for i in range(20)]
+        start = time.monotonic()
+        with mock.patch("ally.Quote.timesales.fetch", slow_bars):
+            for symbol, cols, error in iter_timesales(
+                self.ally, symbols, "2020-08-17", "2020-08-17", workers=2
+            ):
+                break
+
+        # Back without waiting on the rest, which were never sent
+        self.assertLess(time.monotonic() - start, 0.35)
+        time.sleep(0.3)
+        self.assertLessEqual(len(started), 4)
+
+    def test_records(self):
+        rows = timesales_many(
+            self.ally, "spy,gld", "2020-08-17", "2020-08-17", dataframe=False
+        )
+        self.assertIsInstance(rows, list)
+        self.assertEqual([r["symbol"] for r in rows], ["SPY", "SPY", "GLD", "GLD"])
+        self.assertEqual(set(rows[0]), set(rows[-1]))
+
+    def test_repeats(self):
+        df = timesales_many(self.ally, "spy,gld,SPY", "2020-08-17", "2020-08-17")
+        self.assertEqual(list(df["symbol"]), ["SPY", "SPY", "GLD", "GLD"])
+        self.assertEqual(len(fake_bars.calls), 2)
+
+    def test_store(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.ally.timesales_store = TimesalesStore(path)
+
+        with mock.patch("ally.Quote.store._today", lambda: datetime.date(2020, 8, 24)):
+            for i in range(2):
+                cols = timesales_many(
+                    self.ally,
+                    ["spy", "gld"],
+                    "2020-08-17",
+                    "2020-08-18",
+                    columnar=True,
+                )
+
+        self.assertEqual(len(cols["symbol"]), 8)
+        self.assertEqual(len(fake_bars.calls), 2)
+
+
+def five_minute_bars(day="2020-08-17", n=84):
+    """n five minute bars from 9:30 New York time, as typed columns"""
+    import numpy as np
+
+    start = np.datetime64(day + "T13:30:00")
+    i = np.arange(n)
+    return {
+        "datetime": start + i * np.timedelta64(300, "s"),
+        "opn": i * 1.0,
+        "hi": i + 2.0,
+        "lo": i - 1.0,
+        "last": i + 0.5,
+        "incr_vl": np.full(n, 100),
+    }
+
+
+class TestBars(unittest.TestCase):
+    def test_hourly(self):
+        bars = resample(five_minute_bars(), "1h")
+
+        # 9:30 to 16:00 is six and a half hours; after the close is dropped
+        self.assertEqual(list(bars["count"]), [12] * 6 + [6])
+        self.assertEqual(str(bars["datetime"][1]), "2020-08-17T14:30:00")
+        self.assertEqual(list(bars["opn"][:2]), [0.0, 12.0])
+        self.assertEqual(list(bars["hi"][:2]), [13.0, 25.0])
+        self.assertEqual(list(bars["lo"][:2]), [-1.0, 11.0])
+        self.assertEqual(list(bars["last"][:2]), [11.5, 23.5])
+        self.assertEqual(bars["incr_vl"][0], 1200)
+
+    def test_vwap(self):
+        cols = five_minute_bars(n=2)
+        cols["incr_vl"][:] = [100, 300]
+        bars = resample(cols, "session")
+        typical = (cols["hi"] + cols["lo"] + cols["last"]) / 3
+        self.assertAlmostEqual(bars["vwap"][0], (typical * [1, 3]).sum() / 4)
+
+        # Resampling again keeps the vwap
+        self.assertAlmostEqual(resample(bars, "session")["vwap"][0], bars["vwap"][0])
+
+    def test_cuts_and_symbols(self):
+        import numpy as np
+
+        one, two = five_minute_bars(), five_minute_bars()
+        cols = {k: np.concatenate((one[k], two[k])) for k in one}
+        cols["symbol"] = np.array(["SPY"] * 84 + ["GLD"] * 84, dtype=object)
+
+        bars = resample(cols, ["09:30", "12:00"])
+        self.assertEqual(list(bars["symbol"]), ["SPY", "SPY", "GLD", "GLD"])
+        self.assertEqual(list(bars["count"]), [30, 48, 30, 48])
+
+    def test_winter(self):
+        # Standard time, the session opens at 14:30 UTC
+        bars = resample(five_minute_bars("2020-12-01"), "session")
+        self.assertEqual(str(bars["datetime"][0]), "2020-12-01T14:30:00")
+        self.assertEqual(bars["count"][0], 72)
+
+    def test_incremental(self):
+        cols = five_minute_bars()
+        whole = resample(cols, "1h")
+
+        agg = BarAggregator("1h")
+        parts = [
+            agg.append({k: v[i : i + 7] for k, v in cols.items()})
+            for i in range(0, 84, 7)
+        ]
+        parts.append(agg.flush())
+        self.assertIsNone(agg.current)
+
+        for k, v in whole.items():
+            got = [x for p in parts for x in p[k]]
+            self.assertEqual(got, list(v), k)
+
+
+def trade(symbol, last, vl, timestamp):
+    """A stream() trade message, strings like the API sends"""
+    return {
+        "trade": {
+            "symbol": symbol,
+            "last": str(last),
+            "vl": str(vl),
+            "timestamp": str(timestamp),
+        }
+    }
+
+
+class TestBarBuilder(unittest.TestCase):
+    # 2020-08-18 9:30 New York time
+    OPEN = 1597757400
+
+    def test_bars(self):
+        builder = BarBuilder(["spy", "gld"], "1min")
+        messages = [
+            trade("SPY", 10, 100, self.OPEN),
+            {"quote": {"symbol": "SPY", "bid": "9.99"}},
+            trade("GLD", 20, 5, self.OPEN + 1),
+            trade("SPY", 12, 300, self.OPEN + 30),
+            trade("SPY", 9, 100, self.OPEN + 59),
+            # Starts the next minute, closing the first
+            trade("GLD", 21, 5, self.OPEN + 60),
+        ]
+        out = list(builder.run(messages))
+        self.assertEqual(len(out), 1)
+
+        bars = out[0]
+        self.assertEqual(list(bars["symbol"]), ["SPY", "GLD"])
+        self.assertEqual(str(bars["datetime"][0]), "2020-08-18T13:30:00")
+        self.assertEqual(list(bars["opn"]), [10, 20])
+        self.assertEqual(list(bars["hi"]), [12, 20])
+        self.assertEqual(list(bars["lo"]), [9, 20])
+        self.assertEqual(list(bars["last"]), [9, 20])
+        self.assertEqual(list(bars["incr_vl"]), [500, 5])
+        self.assertEqual(list(bars["count"]), [3, 1])
+        self.assertAlmostEqual(bars["vwap"][0], (1000 + 3600 + 900) / 500)
+
+        # The second minute is still open, until time moves on
+        self.assertEqual(len(builder.drain()["symbol"]), 0)
+        builder.advance(self.OPEN + 120)
+        self.assertEqual(list(builder.drain()["last"]), [21])
+
+    def test_late_and_bad(self):
+        builder = BarBuilder(["spy"], "5min")
+        builder.feed(trade("SPY", 10, 100, self.OPEN + 300))
+        builder.feed(trade("SPY", 11, 100, self.OPEN + 299))
+        builder.feed(trade("SPY", "na", 100, self.OPEN + 301))
+        builder.feed(trade("XYZ", 11, 100, self.OPEN + 302))
+        self.assertEqual((builder.late, builder.bad), (1, 1))
+
+        builder.advance(self.OPEN + 600)
+        bars = builder.drain()
+        self.assertEqual(list(bars["count"]), [1])
+        self.assertEqual(str(bars["datetime"][0]), "2020-08-18T13:35:00")
+
+    def test_quotes_close_bars(self):
+        builder = BarBuilder(["spy", "gld"], "1min")
+        builder.feed(trade("SPY", 10, 100, self.OPEN))
+
+        # Nothing but quotes from then on, typed or not
+        builder.feed({"quote": {"symbol": "GLD", "bid": "20"}})
+        builder.feed({"quote": {"symbol": "GLD", "timestamp": str(self.OPEN + 59)}})
+        self.assertEqual(len(builder.drain()["symbol"]), 0)
+        builder.feed(QuoteTick("GLD", 20.0, 20.1, 1, 1, self.OPEN + 300))
+        self.assertEqual(list(builder.drain()["last"]), [10])
+
+        # Time has moved on
+        builder.feed(trade("SPY", 11, 100, self.OPEN + 60))
+        self.assertEqual((builder.late, builder.bad), (1, 0))
+
+    def test_run_clock(self):
+        builder = BarBuilder(["spy"], "1min")
+        messages = [
+            trade("SPY", 10, 100, self.OPEN),
+            {"status": "connected"},
+            {"status": "connected"},
+        ]
+        now = [self.OPEN + 30, self.OPEN + 61, self.OPEN + 62.5]
+        with mock.patch("time.time", side_effect=now):
+            out = list(builder.run(messages, delay=2))
+
+        # Closed once the clock was 2s past the minute
+        self.assertEqual(len(out), 1)
+        self.assertEqual(list(out[0]["last"]), [10])
+
+    def test_anchor(self):
+        # Hourly bars start on the half hour
+        builder = BarBuilder(["spy"], "1h")
+        builder.update("SPY", 10.0, 1, self.OPEN + 3599)
+        builder.update("SPY", 11.0, 1, self.OPEN + 3600)
+        self.assertEqual(str(builder.drain()["datetime"][0]), "2020-08-18T13:30:00")
+
+
+class FakeStream:
+    """Stands in for Stream, yielding whatever the test puts in .feed"""
+
+    opened = []
+
+    # Connections to turn away, before accepting any
+    refuse = 0
+
+    def __init__(self, auth=None, account_nbr=None, symbols=()):
+        self.symbols = symbols
+        self.closed = False
+        self.feed = queue.Queue()
+        FakeStream.opened.append(self)
+
+    def request(self, timeout=None, on_connect=None):
+        if FakeStream.refuse:
+            FakeStream.refuse -= 1
+            raise ConnectionError("refused")
+        if on_connect is not None:
+            on_connect()
+
+        while not self.closed:
+            message = self.feed.get()
+            if message is None:
+                return
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    def close(self):
+        self.closed = True
+        self.feed.put(None)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+def tick(symbol, kind="quote", **fields):
+    return {kind: dict(symbol=symbol, **fields)}
+
+
+class TestStreamHub(unittest.TestCase):
+    def setUp(self):
+        FakeStream.opened = []
+        patcher = mock.patch("ally.Quote.shard.Stream", FakeStream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.hub = StreamHub(mock.Mock(), settle=0)
+        self.addCleanup(self.hub.close)
+
+    def upstream(self, n=1):
+        """The n-th upstream connection, once it is open"""
+        wait_until(lambda: len(FakeStream.opened) >= n)
+        return FakeStream.opened[n - 1]
+
+    def test_fan_out(self):
+        spy = self.hub.subscribe("spy")
+        both = self.hub.subscribe(["spy", "gld"])
+        wait_until(lambda: self.upstream().symbols == ["GLD", "SPY"])
+
+        up = FakeStream.opened[-1]
+        up.feed.put(tick("SPY", bid="1"))
+        up.feed.put(tick("GLD", bid="2"))
+
+        self.assertEqual(spy.get(1)["quote"]["bid"], "1")
+        self.assertEqual(both.get(1)["quote"]["symbol"], "SPY")
+        self.assertEqual(both.get(1)["quote"]["symbol"], "GLD")
+        self.assertIsNone(spy.get(0.01))
+
+        # Cached quotes kept current too
+        self.hub.ally.quote_cache.feed.assert_any_call(tick("GLD", bid="2"))
+
+    def test_resubscribe(self):
+        spy = self.hub.subscribe("spy")
+        first = self.upstream()
+        self.assertEqual(first.symbols, ["SPY"])
+
+        gld = self.hub.subscribe("gld")
+        self.assertTrue(first.closed)
+        wait_until(lambda: FakeStream.opened[-1].symbols == ["GLD", "SPY"])
+
+        # Back down to one symbol, on one connection
+        gld.close()
+        wait_until(lambda: FakeStream.opened[-1].symbols == ["SPY"])
+        self.assertEqual(self.hub.symbols, {"SPY"})
+        self.assertEqual(sum(not s.closed for s in FakeStream.opened), 1)
+
+        # Same symbols again, no reconnect
+        n = self.hub.connects
+        self.hub.subscribe("spy").close()
+        self.assertEqual(self.hub.connects, n)
+
+    def test_error(self):
+        self.hub = StreamHub(mock.Mock(), settle=0, supervise=False)
+        self.addCleanup(self.hub.close)
+
+        sub = self.hub.subscribe("spy")
+        self.upstream().feed.put(tick("SPY"))
+        self.upstream().feed.put(ValueError("gone"))
+
+        with self.assertRaises(ValueError):
+            list(sub)
+        self.assertTrue(self.hub.closed)
+
+    def test_gap(self):
+        spy = self.hub.subscribe("spy")
+        gld = self.hub.subscribe("gld")
+        wait_until(lambda: self.upstream().symbols == ["GLD", "SPY"])
+
+        # Only SPY's shard, as if it were one of several
+        message = {"gap": {"symbols": ["SPY"], "since": 0, "reason": "test"}}
+        self.hub._broadcast(message)
+        self.assertEqual(spy.get(0), message)
+        self.assertIsNone(gld.get(0))
+
+        # Straight from the API, not from cached quotes missing the gap
+        coalescer = self.hub.ally.quote_coalescer
+        coalescer.quote.return_value = [{"symbol": "GLD", "bid": "1"}]
+        self.assertEqual(self.hub._resync(["GLD"]), [{"symbol": "GLD", "bid": "1"}])
+        coalescer.quote.assert_called_once_with(["GLD"], [], block=True)
+        self.hub.ally.quote_cache.quote.assert_not_called()
+
+    def test_sharded(self):
+        self.hub.subscribe(["S{0:03d}".format(i) for i in range(200)])
+        sub = self.hub.subscribe(["T{0:03d}".format(i) for i in range(100)])
+        # Two even shards, past 256 symbols
+        open = lambda: [s for s in FakeStream.opened if not s.closed]
+        wait_until(lambda: [len(s.symbols) for s in open()] == [150, 150])
+
+        shard = next(s for s in open() if "T050" in s.symbols)
+        shard.feed.put(tick("T050"))
+        self.assertEqual(sub.get(1), tick("T050"))
+
+
+class TestSubscription(unittest.TestCase):
+    def test_drop_oldest(self):
+        sub = Subscription(mock.Mock(), {"SPY"}, maxsize=2)
+        for i in range(3):
+            sub.put(tick("SPY", bid=i))
+        self.assertEqual(sub.dropped, 1)
+        self.assertEqual([sub.get(0)["quote"]["bid"] for i in range(2)], [1, 2])
+
+    def test_conflate(self):
+        sub = Subscription(mock.Mock(), {"SPY", "GLD"}, policy="conflate")
+        sub.put(tick("SPY", bid=1))
+        sub.put(tick("GLD", bid=2))
+        sub.put(tick("SPY", "trade", last=3))
+        sub.put(tick("SPY", bid=4))
+
+        got = [sub.get(0) for i in range(3)]
+        self.assertEqual(got[0], tick("SPY", bid=4))
+        self.assertEqual(got[1], tick("GLD", bid=2))
+        self.assertEqual(got[2], tick("SPY", "trade", last=3))
+        self.assertEqual(sub.dropped, 1)
+
+    def test_block(self):
+        sub = Subscription(mock.Mock(), {"SPY"}, maxsize=1, policy="block")
+        sub.put(tick("SPY", bid=1))
+
+        t = threading.Thread(target=sub.put, args=(tick("SPY", bid=2),))
+        t.start()
+        t.join(0.05)
+        self.assertTrue(t.is_alive())
+
+        self.assertEqual(sub.get(0)["quote"]["bid"], 1)
+        t.join(1)
+        self.assertEqual(sub.get(0)["quote"]["bid"], 2)
+        self.assertEqual(sub.dropped, 0)
+
+    def test_close(self):
+        sub = Subscription(mock.Mock(), {"SPY"})
+        sub.put(tick("SPY"))
+        sub.close()
+        sub.put(tick("SPY"))
+        self.assertEqual(list(sub), [tick("SPY")])
+
+
+class TestShardedStream(unittest.TestCase):
+    def setUp(self):
+        FakeStream.opened = []
+        FakeStream.refuse = 0
+        for target, new in (
+            ("ally.Quote.shard.Stream", FakeStream),
+            ("ally.Quote.shard.BACKOFF", 0.001),
+        ):
+            patcher = mock.patch(target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def read(self, s):
+        """Read s on a thread, into a list"""
+        got = []
+        threading.Thread(target=lambda: got.extend(s), daemon=True).start()
+        return got
+
+    def test_stream(self):
+        a = mock.Mock(quote_cache=mock.Mock(), stream_metrics=None)
+        s = stream(a, "spy", supervise=True, typed=True)
+
+        # Not hidden behind any generator
+        self.assertIsInstance(s, ShardedStream)
+        self.addCleanup(s.close)
+        got = self.read(s)
+
+        wait_until(lambda: FakeStream.opened)
+        FakeStream.opened[0].feed.put(tick("SPY", bid="1.5"))
+        wait_until(lambda: got)
+
+        self.assertIsInstance(got[0], QuoteTick)
+        self.assertEqual(got[0].bid, 1.5)
+        a.quote_cache.feed.assert_called_once_with(tick("SPY", bid="1.5"))
+        self.assertEqual(len(s.stats()), 1)
+
+        a.quote_coalescer.quote.return_value = [{"symbol": "SPY", "bid": "2"}]
+        self.assertEqual(s.resync(["SPY"]), [{"symbol": "SPY", "bid": "2"}])
+        a.quote_cache.quote.assert_not_called()
+
+    def test_shards(self):
+        s = ShardedStream(None, symbols=["S{0}".format(i) for i in range(600)])
+        self.assertEqual([len(x.symbols) for x in s.shards], [200, 200, 200])
+        self.assertEqual(len(set(s.symbols)), 600)
+
+        s = ShardedStream(None, symbols="spy,gld,spy")
+        self.assertEqual([x.symbols for x in s.shards], [["SPY", "GLD"]])
+
+    def test_merge(self):
+        s = ShardedStream(None, symbols=["S{0}".format(i) for i in range(300)])
+        got, errors = [], []
+
+        def read():
+            try:
+                for message in s:
+                    got.append(message)
+            except ValueError as e:
+                errors.append(e)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        wait_until(lambda: len(FakeStream.opened) == 2)
+
+        now = int(time.time())
+        first, second = sorted(FakeStream.opened, key=lambda x: "S0" not in x.symbols)
+        second.feed.put(tick("S200", timestamp=str(now - 2)))
+        wait_until(lambda: got)
+        first.feed.put(tick("S0", timestamp=str(now)))
+        wait_until(lambda: len(got) == 2)
+        self.assertEqual(
+            got, [tick("S200", timestamp=str(now - 2)), tick("S0", timestamp=str(now))]
+        )
+
+        stats = {x["shard"]: x for x in s.stats()}
+        self.assertEqual(stats[1]["messages"], 1)
+        self.assertGreaterEqual(stats[1]["lag_last"], 2)
+        self.assertTrue(stats[0]["connected"])
+
+        # One shard failing ends the whole stream
+        first.feed.put(ValueError("gone"))
+        reader.join(1)
+        self.assertFalse(reader.is_alive())
+        self.assertTrue(second.closed)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(s.stats()[0]["error"], ValueError)
+
+    def test_close(self):
+        s = ShardedStream(None, symbols=["S{0}".format(i) for i in range(300)])
+        done = threading.Event()
+        threading.Thread(target=lambda: (list(s), done.set()), daemon=True).start()
+        wait_until(lambda: len(FakeStream.opened) == 2)
+
+        s.close()
+        self.assertTrue(done.wait(1))
+
+    def test_supervised(self):
+        quotes = lambda symbols: [{"symbol": x, "bid": "1"} for x in symbols]
+        s = ShardedStream(None, symbols="spy,gld", supervise=True, resync=quotes)
+        self.addCleanup(s.close)
+        got = self.read(s)
+
+        wait_until(lambda: FakeStream.opened)
+        FakeStream.opened[0].feed.put(tick("SPY"))
+        wait_until(lambda: got)
+
+        # Drop it, and turn the first two reconnects away
+        FakeStream.refuse = 2
+        FakeStream.opened[0].feed.put(ValueError("gone"))
+        wait_until(lambda: len(FakeStream.opened) == 4)
+        FakeStream.opened[3].feed.put(tick("GLD"))
+        wait_until(lambda: len(got) == 5)
+
+        gap = got[1]["gap"]
+        self.assertEqual(gap["symbols"], ["SPY", "GLD"])
+        self.assertEqual(gap["reason"], "gone")
+        self.assertAlmostEqual(gap["since"], time.time(), delta=1)
+        self.assertEqual(
+            got[2:],
+            [
+                {"resync": {"symbol": "SPY", "bid": "1"}},
+                {"resync": {"symbol": "GLD", "bid": "1"}},
+                tick("GLD"),
+            ],
+        )
+
+        stats = s.stats()[0]
+        self.assertEqual((stats["gaps"], stats["reconnects"]), (1, 3))
+        self.assertTrue(stats["connected"])
+
+        metrics = s.metrics.as_dict()
+        self.assertEqual((metrics["gaps"], metrics["reconnects"]), (1, 3))
+        self.assertEqual(metrics["shard_queue_depth"], 0)
+
+    def test_resync_failed(self):
+        def broken(symbols):
+            raise ValueError("no quotes")
+
+        s = ShardedStream(None, symbols="spy", supervise=True, resync=broken)
+        self.addCleanup(s.close)
+        got = self.read(s)
+
+        wait_until(lambda: FakeStream.opened)
+        FakeStream.opened[0].close()
+        wait_until(lambda: len(got) == 2)
+        self.assertEqual(got[0]["gap"]["reason"], "stream ended")
+        self.assertIn("no quotes", got[1]["gap"]["reason"])
+
+    def test_resync_rate_limited(self):
+        s = ShardedStream(None, symbols="spy", supervise=True, resync=lambda s: None)
+        self.addCleanup(s.close)
+        got = self.read(s)
+
+        wait_until(lambda: FakeStream.opened)
+        FakeStream.opened[0].close()
+        wait_until(lambda: len(got) == 2)
+        self.assertIn("Rate limited", got[1]["gap"]["reason"])
+
+
+class TestTape(unittest.TestCase):
+    messages = [
+        tick("SPY", bid="10.01", ask="10.02", bidsz="3", asksz="4", timestamp="100"),
+        tick("GLD", "trade", last="20.5", vl="7", cvol="1000", timestamp="101"),
+        {"status": "connected"},
+        tick("SPY", "trade", last="10.015", vl="1", cvol="5", timestamp="102"),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = self.dir + "/t.tape"
+
+    def record(self, messages, **kwargs):
+        with TickRecorder(self.path, **kwargs) as rec:
+            for i, m in enumerate(messages):
+                rec.write(m, arrival=1000.0 + i * 0.05)
+
+    def test_round_trip(self):
+        self.record(self.messages)
+        tape = TickTape(self.path)
+        self.assertEqual(len(tape), 3)
+        self.assertEqual(tape.symbols, ["SPY", "GLD"])
+
+        got = list(tape.replay())
+        self.assertEqual(
+            got[0],
+            tick("SPY", bid=10.01, ask=10.02, bidsz=3, asksz=4, timestamp=100),
+        )
+        self.assertEqual(
+            got[1], tick("GLD", "trade", last=20.5, vl=7, cvol=1000, timestamp=101)
+        )
+        self.assertEqual(got[2]["trade"]["symbol"], "SPY")
+
+        # Replayed messages feed what stream() feeds
+        builder = BarBuilder(["spy", "gld"])
+        for m in got:
+            builder.feed(m)
+        self.assertEqual(builder.bad, 0)
+
+    def test_append_and_crash(self):
+        self.record(self.messages[:2], buffer=1)
+        self.record(self.messages[2:])
+
+        # Half a record at the end, as if cut short
+        with open(self.path, "ab") as f:
+            f.write(b"x" * 10)
+        self.assertEqual(len(TickTape(self.path)), 3)
+
+        self.record(self.messages[:1])
+        tape = TickTape(self.path)
+        self.assertEqual(len(tape), 4)
+        self.assertEqual(tape.symbols, ["SPY", "GLD"])
+
+    def test_select(self):
+        import numpy as np
+
+        self.record(self.messages)
+        tape = TickTape(self.path)
+        self.assertEqual(len(tape.select("spy")), 2)
+        self.assertEqual(len(tape.select(start=1000.05, end=1000.1)), 1)
+        self.assertEqual(len(tape.select("gld", start=1000.05)), 1)
+
+        # No symbols, no copy
+        self.assertIs(tape.select(), tape.records)
+        window = tape.select(start=1000.01)
+        self.assertEqual(len(window), 2)
+        self.assertTrue(np.shares_memory(window, tape.records))
+        self.assertEqual(list(tape.replay(symbols=["xyz"])), [])
+
+    def test_speed(self):
+        self.record(self.messages)
+        tape = TickTape(self.path)
+
+        # Arrived over 0.15s
+        start = time.monotonic()
+        list(tape.replay(speed=1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.14)
+
+        start = time.monotonic()
+        list(tape.replay(speed=100))
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_not_a_tape(self):
+        with open(self.path, "wb") as f:
+            f.write(b"{}" * 40)
+        with self.assertRaises(ValueError):
+            TickTape(self.path)
+
+
+class TestTopOfBook(unittest.TestCase):
+    def test_updates(self):
+        book = TopOfBook(["spy"])
+        book.feed(tick("SPY", bid="10.01", ask="10.02", bidsz="3", timestamp="100"))
+        book.feed(tick("SPY", "trade", last="10.015", vl="7", cvol="900"))
+        book.feed(tick("SPY", bid="na", ask="10.03"))
+
+        row = book["spy"]
+        self.assertEqual(
+            (row["bid"], row["ask"], row["bidsz"], row["last"], row["size"]),
+            (10.01, 10.03, 3, 10.015, 7),
+        )
+        self.assertEqual((row["volume"], row["timestamp"], row["seq"]), (900, 100, 3))
+        self.assertIsNone(book.get("gld"))
+        self.assertEqual(book.version, 3)
+
+    def test_gap_and_resync(self):
+        book = TopOfBook()
+        book.feed(tick("SPY", bid="1"))
+        book.feed({"gap": {"symbols": ["SPY", "XYZ"], "since": 0}})
+        self.assertTrue(book["SPY"]["stale"])
+
+        book.feed({"resync": {"symbol": "SPY", "bid": "2", "vl": "5000"}})
+        row = book["SPY"]
+        self.assertFalse(row["stale"])
+        self.assertEqual((row["bid"], row["volume"]), (2.0, 5000))
+        self.assertNotIn("XYZ", book)
+
+    def test_grow(self):
+        book = TopOfBook(capacity=2)
+        for i in range(10):
+            book.feed(tick("S{0}".format(i), bid=str(i)))
+
+        snap = book.snapshot()
+        self.assertEqual(list(snap["bid"]), list(range(10)))
+        self.assertEqual(list(snap["symbol"][:2]), ["S0", "S1"])
+        self.assertEqual(list(snap["seq"]), [1] * 10)
+
+    def test_consistent(self):
+        # The writer keeps bid == ask == bidsz in every row
+        book = TopOfBook(["S{0}".format(i) for i in range(64)])
+        stop = threading.Event()
+
+        def write():
+            n = 0
+            while not stop.is_set():
+                n += 1
+                v = str(n)
+                book.update(
+                    "quote",
+                    {"symbol": "S{0}".format(n % 64), "bid": v, "ask": v, "bidsz": v},
+                )
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(200):
+                snap = book.snapshot()
+                same = (snap["bid"] == snap["ask"]) & (snap["bid"] == snap["bidsz"])
+                self.assertTrue((same | (snap["seq"] == 0)).all())
+                row = book["S7"]
+                self.assertTrue(row["seq"] == 0 or row["bid"] == row["ask"])
+        finally:
+            stop.set()
+            writer.join()
+
+
+class TestTicks(unittest.TestCase):
+    quote = tick(
+        "SPY",
+        bid="10.01",
+        ask="na",
+        bidsz="3",
+        asksz="4",
+        timestamp="100",
+        qcond="REGULAR",
+        exch={},
+        datetime="2020-08-18T09:30:00-04:00",
+    )
+    trade = tick(
+        "SPY", "trade", last="10.5", vl="7", cvol="900", vwap="10.4", timestamp="101"
+    )
+
+    def test_parse(self):
+        q, t = typed(self.quote), typed(self.trade)
+        self.assertIsInstance(q, QuoteTick)
+        self.assertEqual(
+            (q.symbol, q.bid, q.bidsz, q.asksz, q.timestamp), ("SPY", 10.01, 3, 4, 100)
+        )
+        self.assertNotEqual(q.ask, q.ask)
+        self.assertEqual(
+            (t.last, t.vl, t.cvol, t.vwap, t.timestamp), (10.5, 7, 900, 10.4, 101)
+        )
+        self.assertFalse(hasattr(t, "__dict__"))
+
+        # Symbols are interned, other messages pass through
+        self.assertIs(typed(self.trade).symbol, typed(self.quote).symbol)
+        gap = {"gap": {"symbols": ["SPY"]}}
+        self.assertEqual(list(ticks([gap])), [gap])
+
+    def test_consumers(self):
+        # Ticks work wherever stream() messages do, with the same results
+        messages = [self.quote, self.trade]
+
+        books = TopOfBook(), TopOfBook()
+        for m in messages:
+            books[0].feed(m)
+            books[1].feed(typed(m))
+        rows = [b["SPY"] for b in books]
+        for row in rows:
+            ask = row.pop("ask")
+            self.assertNotEqual(ask, ask)
+        self.assertEqual(rows[0], rows[1])
+
+        builders = BarBuilder(["spy"]), BarBuilder(["spy"])
+        for m in messages:
+            builders[0].feed(m)
+            builders[1].feed(typed(m))
+        for b in builders:
+            b.advance(10**10)
+        self.assertEqual(
+            list(builders[0].drain()["last"]), list(builders[1].drain()["last"])
+        )
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for name, convert in (("dicts", lambda m: m), ("ticks", typed)):
+            with TickRecorder(path + "/" + name) as rec:
+                for m in messages:
+                    rec.write(convert(m), arrival=1.0)
+        a, b = TickTape(path + "/dicts").records, TickTape(path + "/ticks").records
+        self.assertEqual(a.tobytes(), b.tobytes())
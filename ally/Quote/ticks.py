@@ -0,0 +1,138 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Compact, typed stream() ticks.
+
+stream(..., typed=True) yields a QuoteTick or TradeTick in place of each
+{"quote": {...}} or {"trade": {...}} message. They have __slots__ instead
+of dictionaries, numbers parsed once, and symbols interned, so that
+holding on to many ticks costs a fraction of the memory, and far fewer
+objects for the garbage collector to walk. Values the API left blank
+('na') become NaN, or 0 for counts.
+"""
+
+import sys
+
+_intern = sys.intern
+_nan = float("nan")
+
+
+def _float(v) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return _nan
+
+
+def _int(v) -> int:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return 0
+
+
+class QuoteTick:
+    """A stream() quote: best bid and ask"""
+
+    __slots__ = ("symbol", "bid", "ask", "bidsz", "asksz", "timestamp", "qcond")
+
+    kind = "quote"
+
+    def __init__(self, symbol, bid, ask, bidsz, asksz, timestamp, qcond=None):
+        self.symbol = symbol
+        self.bid = bid
+        self.ask = ask
+        self.bidsz = bidsz
+        self.asksz = asksz
+        self.timestamp = timestamp
+        self.qcond = qcond
+
+    @classmethod
+    def parse(cls, tick):
+        """From the inner dictionary of a stream() quote message"""
+        g = tick.get
+        qcond = g("qcond")
+        return cls(
+            _intern(g("symbol", "")),
+            _float(g("bid")),
+            _float(g("ask")),
+            _int(g("bidsz")),
+            _int(g("asksz")),
+            _int(g("timestamp")),
+            None if qcond is None else _intern(qcond),
+        )
+
+    def __repr__(self):
+        return "QuoteTick({0} {1}x{2} {3}x{4} @{5})".format(
+            self.symbol, self.bidsz, self.bid, self.ask, self.asksz, self.timestamp
+        )
+
+
+class TradeTick:
+    """A stream() trade"""
+
+    __slots__ = ("symbol", "last", "vl", "cvol", "vwap", "timestamp")
+
+    kind = "trade"
+
+    def __init__(self, symbol, last, vl, cvol, vwap, timestamp):
+        self.symbol = symbol
+        self.last = last
+        self.vl = vl
+        self.cvol = cvol
+        self.vwap = vwap
+        self.timestamp = timestamp
+
+    @classmethod
+    def parse(cls, tick):
+        """From the inner dictionary of a stream() trade message"""
+        g = tick.get
+        return cls(
+            _intern(g("symbol", "")),
+            _float(g("last")),
+            _int(g("vl")),
+            _int(g("cvol")),
+            _float(g("vwap")),
+            _int(g("timestamp")),
+        )
+
+    def __repr__(self):
+        return "TradeTick({0} {1}@{2} @{3})".format(
+            self.symbol, self.vl, self.last, self.timestamp
+        )
+
+
+def typed(message):
+    """A stream() message as a tick, or as it was if neither quote nor trade"""
+    tick = message.get("quote")
+    if tick is not None:
+        return QuoteTick.parse(tick)
+    tick = message.get("trade")
+    if tick is not None:
+        return TradeTick.parse(tick)
+    return message
+
+
+def ticks(messages):
+    """Turns stream() messages into ticks as they arrive"""
+    for message in messages:
+        yield typed(message)
@@ -20,7 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .. import schema
 from ..Api import AuthenticatedEndpoint, RequestType
+from ..exception import PartialResultException, RateLimitException
+from ..utils.columnar import TEXT
+from .quote import FETCH_WORKERS, split
 
 
 class Timesales(AuthenticatedEndpoint):
@@ -28,11 +34,14 @@ class Timesales(AuthenticatedEndpoint):
     _resource = "market/timesales.json"
     _method = "GET"
     _symbols = []
+    _schema = schema.TIMESALES
 
     def extract(self, response):
         """Extract certain fields from response"""
         response = response.json()["response"]
-        quotes = response["quotes"]["quote"]
+
+        # Days without trading come back empty
+        quotes = (response.get("quotes") or {}).get("quote", [])
 
         # and return it to the world
         return quotes
@@ -63,17 +72,24 @@ class Timesales(AuthenticatedEndpoint):
         data = None
         return params, data
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        # Create dataframe from our dataset
-        df = pd.DataFrame(raw).apply(
-            # And also cast relevent fields to numeric values
-            pd.to_numeric,
-            errors="ignore",
-        )
-        return df
+        # Columns come typed already
+        return pd.DataFrame(cls.Columns(raw))
+
+
+def fetch(ally, symbol, startdate, enddate, interval="5min", block: bool = True):
+    """Send a single timesales request, and return the list of bars"""
+    return Timesales(
+        auth=ally.auth,
+        account_nbr=ally.account_nbr,
+        symbols=symbol,
+        interval=interval,
+        startdate=startdate,
+        enddate=enddate,
+    ).request(block=block)
 
 
 def timesales(
@@ -84,6 +100,7 @@ def timesales(
     interval: str = "5min",
     dataframe=True,
     block: bool = True,
+    columnar: bool = False,
 ):
     """Gets the most current market data on the price of a symbol.
 
@@ -120,10 +137,16 @@ def timesales(
 
                     block: Specify whether to block thread if request exceeds rate limit
 
+                    columnar: Return a dictionary of typed numpy arrays, one per field,
+                    instead. Overrides dataframe
+
             Returns:
                     Depends on dataframe flag. Will return pandas dataframe, or possibly
                     list of dictionaries, each one a single quote.
 
+                    Once store_timesales() is enabled, days already on disk aren't
+                    fetched again, and records come back typed (see ally.schema).
+
             Raises:
                     RateLimitException: If block=False, rate limit problems will be raised
 
@@ -139,15 +162,25 @@ def timesales(
             print(gld_history.loc[0])
 
     """
-    result = Timesales(
-        auth=self.auth,
-        account_nbr=self.account_nbr,
-        symbols=symbols,
-        interval=interval,
-        startdate=startdate,
-        enddate=enddate,
-        block=block,
-    ).request()
+    if self.timesales_store is not None:
+        result = self.timesales_store.timesales(
+            self, symbols, startdate, enddate, interval, block=block
+        )
+        if columnar or result is None:
+            return result
+        if dataframe:
+            import pandas as pd
+
+            return pd.DataFrame(result)
+
+        # Back to records, typed this time
+        names = list(result)
+        return [dict(zip(names, row)) for row in zip(*result.values())]
+
+    result = fetch(self, symbols, startdate, enddate, interval, block=block)
+
+    if columnar:
+        return None if result is None else Timesales.Columns(result)
 
     if dataframe:
         try:
@@ -156,3 +189,173 @@ def timesales(
             raise
 
     return result
+
+
+def columns(ally, symbol, startdate, enddate, interval="5min", block: bool = True):
+    """One symbol's bars as typed columns, from the store if there is one"""
+    if ally.timesales_store is not None:
+        result = ally.timesales_store.timesales(
+            ally, symbol, startdate, enddate, interval, block=block
+        )
+    else:
+        result = fetch(ally, symbol, startdate, enddate, interval, block=block)
+        if result is not None:
+            result = Timesales.Columns(result)
+
+    if result is None:
+        raise RateLimitException("Too many attempts.")
+    return result
+
+
+def stack(parts):
+    """Concatenates (symbol, columns) pairs into one long set of columns"""
+    import numpy as np
+
+    names = list(Timesales.Columns([]))
+    for symbol, cols in parts:
+        names += [k for k in cols if k not in names]
+
+    lengths = [len(next(iter(cols.values()), ())) for symbol, cols in parts]
+    result = {
+        "symbol": np.repeat(
+            np.array([symbol for symbol, cols in parts], dtype=object), lengths
+        )
+    }
+    for k in names:
+        field = Timesales._schema.get(k, TEXT)
+        result[k] = np.concatenate(
+            [
+                cols[k] if k in cols else np.full(n, field.fill, field.dtype)
+                for (symbol, cols), n in zip(parts, lengths)
+            ]
+            + [np.empty(0, field.dtype)]
+        )
+    return result
+
+
+def iter_timesales(
+    self,
+    symbols,
+    startdate: str,
+    enddate: str,
+    interval: str = "5min",
+    block: bool = True,
+    workers: int = FETCH_WORKERS,
+):
+    """Gets timesales for many symbols, yielding each as soon as it arrives.
+
+    Requests run on a pool of threads, paced by the quote rate limit.
+    A failed symbol doesn't stop the others.
+
+    Args:
+            symbols: list of symbols, or a comma-separated string. Repeats are
+            fetched once
+
+            workers: requests in flight at once
+
+            See timesales() for the rest.
+
+    Yields:
+            (symbol, columns, error) in order of completion. columns is a
+            dictionary of typed numpy arrays, as with columnar=True, or None
+            if the symbol failed with the exception in error.
+
+    Example:
+
+    .. code-block:: python
+
+            for symbol, cols, error in a.iter_timesales(universe, '2020-08-17', '2020-08-21'):
+                    if error is None:
+                            print(symbol, cols['last'][-1])
+
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in split(symbols)))
+    if not symbols:
+        return
+
+    pool = ThreadPoolExecutor(min(workers, len(symbols)))
+    futures = {
+        pool.submit(columns, self, s, startdate, enddate, interval, block=block): s
+        for s in symbols
+    }
+
+    try:
+        for f in as_completed(futures):
+            try:
+                yield futures[f], f.result(), None
+            except Exception as e:
+                yield futures[f], None, e
+    finally:
+        # Left early: drop the requests not sent yet, and don't wait on
+        #  those in flight, so no more budget goes on unread results
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def timesales_many(
+    self,
+    symbols,
+    startdate: str,
+    enddate: str,
+    interval: str = "5min",
+    dataframe: bool = True,
+    block: bool = True,
+    columnar: bool = False,
+    workers: int = FETCH_WORKERS,
+):
+    """Gets timesales for many symbols at once, in a single long table.
+
+    Args:
+            symbols: list of symbols, or a comma-separated string
+
+            workers: requests in flight at once
+
+            See timesales() for the rest.
+
+    Returns:
+            Every symbol's bars, one after the other in the order the symbols
+            were given, with an added leading 'symbol' column. A pandas
+            dataframe by default, a flat list of dictionaries with
+            dataframe=False, or a dictionary of numpy arrays with columnar.
+
+    Raises:
+            PartialResultException: If some symbols failed. The bars of the
+            others are in its .results, and .errors maps each failed symbol
+            to its exception
+
+    Example:
+
+    .. code-block:: python
+
+            bars = a.timesales_many(['spy', 'gld', 'tsla'], '2020-08-17', '2020-08-21')
+            bars.groupby('symbol')['last'].last()
+
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in split(symbols)))
+    done, errors = {}, {}
+    for symbol, cols, error in iter_timesales(
+        self, symbols, startdate, enddate, interval, block=block, workers=workers
+    ):
+        if error is None:
+            done[symbol] = cols
+        else:
+            errors[symbol] = error
+
+    result = stack([(s, done[s]) for s in symbols if s in done])
+
+    if not columnar and dataframe:
+        import pandas as pd
+
+        result = pd.DataFrame(result)
+    elif not columnar:
+        # Records, typed like the columns
+        names = list(result)
+        result = [dict(zip(names, row)) for row in zip(*result.values())]
+
+    if errors:
+        raise PartialResultException(
+            "{0} of {1} symbols failed".format(len(errors), len(symbols)),
+            result,
+            errors,
+        )
+
+    return result
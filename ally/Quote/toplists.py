@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from .. import schema
 from ..Api import AuthenticatedEndpoint, RequestType
 
 
@@ -27,6 +28,7 @@ class TopLists(AuthenticatedEndpoint):
     _type = RequestType.Quote
     _resource = "market/toplists/{}.json"
     _method = "GET"
+    _schema = schema.TOPLIST
 
     def resolve(self, **kwargs):
         """Inject the account number into the call"""
@@ -51,23 +53,12 @@ class TopLists(AuthenticatedEndpoint):
         # return params, data
         return params, None
 
-    @staticmethod
-    def DataFrame(raw):
+    @classmethod
+    def DataFrame(cls, raw):
         import pandas as pd
 
-        # Create dataframe from our dataset
-        df = (
-            pd.DataFrame(raw)
-            .replace({"na": None})
-            .apply(
-                # And also cast relevent fields to numeric values
-                pd.to_numeric,
-                errors="ignore",
-            )
-            .set_index("symbol")
-        )
-
-        return df
+        # Columns come typed already
+        return pd.DataFrame(cls.Columns(raw)).set_index("symbol")
 
 
 def toplists(
@@ -76,6 +67,7 @@ def toplists(
     exchange: str = "Q",
     dataframe: bool = True,
     block: bool = True,
+    columnar: bool = False,
 ):
     """Gets the most recent toplists for a given exchange.
 
@@ -99,6 +91,10 @@ def toplists(
                     block:
                             Specify whether to block thread if request exceeds rate limit
 
+                    columnar:
+                            flag, return a dictionary of typed numpy arrays, one per
+                            field, instead. Overrides dataframe
+
             Returns:
                     Depends on dataframe flag. Will return pandas dataframe, or possibly
                     list of dictionaries, each one a single quote.
@@ -130,6 +126,9 @@ def toplists(
         block=block,
     ).request()
 
+    if columnar:
+        return None if result is None else TopLists.Columns(result)
+
     if dataframe:
         try:
             result = TopLists.DataFrame(result)
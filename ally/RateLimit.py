@@ -28,34 +28,38 @@ Rate limits
 	* 180 per minute, user info like balance, summary, etc
 
 """
+import contextlib
+import mmap
+import os
+import struct
+import threading
 import time
 from datetime import datetime, timedelta, timezone
 
-import pytz
-
 from .classes import RequestType
 from .exception import RateLimitException
 
 __all__ = ["query"]
 
-centraltz = pytz.timezone("America/Chicago")
+# Ally's servers keep Chicago time
+CENTRAL = "America/Chicago"
 
-_rl_exp_datetime = {
-    RequestType.Order.value: None,
-    RequestType.Quote.value: None,
-    RequestType.Info.value: None,
-}
-_rl_remaining = {
-    RequestType.Order.value: -1,
-    RequestType.Quote.value: -1,
-    RequestType.Info.value: -1,
-}
-_rl_used = {
-    RequestType.Order.value: -1,
-    RequestType.Quote.value: -1,
-    RequestType.Info.value: -1,
+# How long to cool down when we know nothing about the window
+DEFAULT_WINDOW = 60.5
+
+# Length of a rate limit window, in seconds
+WINDOW = 60.0
+
+# Documented calls per window, see module docstring
+DOCUMENTED_LIMITS = {
+    RequestType.Order: 40,
+    RequestType.Quote: 60,
+    RequestType.Info: 180,
 }
 
+# Fraction of the limit that may be spent in a single burst
+BURST = 0.25
+
 ########### UTILS
 
 
@@ -78,6 +82,10 @@ def absolute_ally_time(ally_time: float):
     Returns:
         datetime: timezone-aware
     """
+    # Only needed once a response arrives, so spare the import until then
+    import pytz
+
+    centraltz = pytz.timezone(CENTRAL)
     texp = datetime.fromtimestamp(ally_time, tz=centraltz).replace(tzinfo=timezone.utc)
 
     # API clock is off by around 1 minute. This corrects
@@ -85,37 +93,474 @@ def absolute_ally_time(ally_time: float):
     return texp + timedelta(seconds=60.2)
 
 
-def update_vals(r, req_type_val):
-    """Updates the correct records in the right spot."""
-    _rl_remaining[req_type_val] = r["remain"]
-    _rl_used[req_type_val] = r["used"]
+########### STATE
+
+
+class Bucket:
+    """Token bucket for a single RequestType.
+
+    Tokens accrue continuously, up to a burst capacity. Before the API has told
+    us anything, the refill rate is chosen so that no 60 second span can ever
+    see more calls than the documented limit: burst + rate * WINDOW == limit.
+
+    Once responses arrive, the API's own count (remaining, expire) caps what we
+    hand out, and whatever is left of it is spread evenly over the rest of
+    the window. Must only be touched while holding the owning RateLimiter's lock.
+    """
+
+    def __init__(self, lock, limit: int, burst: float, now: float):
+        # Calls per window
+        self.limit = limit
+        self._burst = burst
+
+        # Our own budget
+        self.tokens = self.capacity
+        self.stamp = now
+
+        # What the API last told us, -1 and None if nothing (yet)
+        self.remaining = -1
+        self.used = -1
+        self.expire = None
+
+        # Reserved, but not yet committed or cancelled
+        self.pending = 0
+
+        # Waiters, and whether one of them is already sleeping on the clock
+        self.cond = threading.Condition(lock)
+        self.timer = False
+
+    @property
+    def capacity(self):
+        """Most tokens we will ever hold at once"""
+        return max(1.0, self.limit * self._burst)
+
+    def rate(self, now: float):
+        """Tokens added per second"""
+        base = (self.limit - self.capacity) / WINDOW
+
+        if self.expire is None:
+            return base
+
+        # Spread the rest of the API's budget over the rest of its window
+        left = self.remaining - self.pending - self.tokens
+        return max(base, left / max(self.expire - now, 1.0))
+
+    def refill(self, now: float):
+        """Accrue tokens, and forget the API's window once it has expired"""
+        if self.expire is not None and now >= self.expire:
+            self.expire = None
+            self.remaining = -1
+            self.used = 0
+
+        if now > self.stamp:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.stamp) * self.rate(now)
+            )
+            self.stamp = now
+
+    def available(self):
+        """Tokens that can be handed out right now"""
+        if self.remaining < 0:
+            return self.tokens
+        return min(self.tokens, self.remaining - self.pending)
+
+    def wait_time(self, now: float):
+        """Seconds until a token frees up, 0.0 if one is free now"""
+        self.refill(now)
+        if self.available() >= 1:
+            return 0.0
+
+        # The API's budget is spent, nothing to do but wait it out
+        if self.remaining >= 0 and self.remaining - self.pending < 1:
+            return max(self.expire - now, 0.0)
+
+        return (1 - self.tokens) / max(self.rate(now), 1e-9)
+
+    def try_reserve(self, now: float):
+        """Take a token and return 0.0, or return seconds to wait"""
+        wait = self.wait_time(now)
+        if wait == 0.0:
+            self.tokens -= 1
+            self.pending += 1
+        return wait
+
+    def release(self):
+        """A reserved call has finished, one way or another"""
+        if self.pending > 0:
+            self.pending -= 1
+
+
+class MemoryBackend:
+    """Keeps rate limit state inside this process (the default)."""
+
+    def lock(self):
+        """Exclusive access to the shared state, on top of the thread lock"""
+        return contextlib.nullcontext()
+
+    def load(self, index: int, bucket: Bucket):
+        """Refresh a bucket's shared fields"""
+        pass
+
+    def store(self, index: int, bucket: Bucket):
+        """Publish a bucket's shared fields"""
+        pass
+
+
+class FileBackend(MemoryBackend):
+    """Shares rate limit state between processes through a memory-mapped file.
+
+    Every process that opens the same path draws from one budget per
+    RequestType. Access is serialized with flock(), which the kernel drops
+    if a process dies, and calls in flight are only counted by the process
+    that made them, so a crashed worker never strands any budget.
+
+    Only available where fcntl is (not on Windows).
+    """
+
+    _magic = b"PYALLYRL"
+    _header = struct.Struct("<8sI")
+
+    # limit, remaining, used, tokens, stamp, expire
+    _record = struct.Struct("<qqqddd")
+
+    def __init__(self, path: str):
+        import fcntl
+
+        self._fcntl = fcntl
+        self.path = path
+
+        size = self._header.size + self._record.size * len(RequestType)
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.lock():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+
+            magic, _ = self._header.unpack_from(self._map, 0)
+            if magic != self._magic:
+                # Fresh file, buckets are seeded by whoever gets there first
+                self._map[:size] = bytes(size)
+                self._header.pack_into(self._map, 0, self._magic, 1)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextlib.contextmanager
+    def lock(self):
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def _offset(self, index: int):
+        return self._header.size + self._record.size * (index - 1)
+
+    def load(self, index: int, bucket: Bucket):
+        limit, remaining, used, tokens, stamp, expire = self._record.unpack_from(
+            self._map, self._offset(index)
+        )
+
+        # Never written, keep our own starting values
+        if limit == 0:
+            return
+
+        bucket.limit = limit
+        bucket.remaining = remaining
+        bucket.used = used
+        bucket.tokens = tokens
+        bucket.stamp = stamp
+        bucket.expire = expire or None
+
+    def store(self, index: int, bucket: Bucket):
+        self._record.pack_into(
+            self._map,
+            self._offset(index),
+            bucket.limit,
+            bucket.remaining,
+            bucket.used,
+            bucket.tokens,
+            bucket.stamp,
+            bucket.expire or 0.0,
+        )
+
+
+class RateLimiter:
+    """Thread-safe rate limit bookkeeping, with one token bucket per RequestType.
+
+    Budgets start from the documented limits, so that a cold process paces
+    itself before it has seen a single response. A call reserves a token
+    before it is sent, then commits the token with the X-RateLimit headers of
+    its response, or cancels it if nothing was sent. Reservations and updates
+    are atomic under one lock.
+
+    Threads that find a bucket empty wait on its condition variable. Only one
+    of them sleeps until the next token is due; the others are woken one by
+    one, as tokens accrue or are given back, rather than all at once.
+
+    The budgets themselves live in a backend, so that they can be shared
+    with other processes (see FileBackend).
+    """
+
+    def __init__(
+        self,
+        limits: dict = None,
+        burst: float = BURST,
+        clock=time.time,
+        backend: MemoryBackend = None,
+    ):
+        """Create a rate limiter.
+
+        Args:
+            limits: calls per minute, keyed by RequestType (default DOCUMENTED_LIMITS)
+            burst: fraction of each limit that may be spent at once
+            clock: time source, in epoch seconds
+            backend: where budgets are kept (default MemoryBackend)
+        """
+        limits = {**DOCUMENTED_LIMITS, **(limits or {})}
+
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.backend = backend or MemoryBackend()
+
+        now = clock()
+        self._buckets = {
+            t.value: Bucket(self._lock, limits[t], burst, now) for t in RequestType
+        }
 
+    @contextlib.contextmanager
+    def _shared(self, req_type: RequestType):
+        """Yield a bucket with its shared state up to date, and publish changes.
+
+        Must be called with the thread lock held.
+        """
+        i = req_type.value
+        b = self._buckets[i]
+        with self.backend.lock():
+            self.backend.load(i, b)
+            try:
+                yield b
+            finally:
+                self.backend.store(i, b)
+
+    def _wait(self, req_type: RequestType, block: bool, take: bool):
+        """Wait for a token, and take it if asked to"""
+        b = self._buckets[req_type.value]
+
+        with self._lock:
+            while True:
+                now = self._clock()
+                with self._shared(req_type):
+                    wait = b.try_reserve(now) if take else b.wait_time(now)
+                if wait == 0.0:
+                    return
+
+                if not block:
+                    raise RateLimitException("Too many attempts.")
+
+                if b.timer:
+                    # Someone is already watching the clock
+                    b.cond.wait()
+                else:
+                    b.timer = True
+                    try:
+                        b.cond.wait(wait)
+                    finally:
+                        b.timer = False
+
+                        # Hand the clock to the next waiter
+                        b.cond.notify()
+
+    def reserve(self, req_type: RequestType, block: bool = True):
+        """Take a token for a call about to be made
+
+        Args:
+            req_type:
+                RequestType enum value
+
+            block:
+                Whether to wait for a token, or raise RateLimitException
+
+        """
+        self._wait(req_type, block, take=True)
+
+    def check(self, req_type: RequestType, block: bool = True):
+        """Like reserve(), but doesn't take the token"""
+        self._wait(req_type, block, take=False)
+
+    def try_reserve(self, req_type: RequestType):
+        """Take a token without blocking.
+
+        Returns:
+            0.0 if a token was taken, otherwise seconds until one may be free
+
+        """
+        with self._lock, self._shared(req_type) as b:
+            return b.try_reserve(self._clock())
+
+    def wait_time(self, req_type: RequestType):
+        """Seconds until a call of this type may be made, 0.0 if right now"""
+        with self._lock, self._shared(req_type) as b:
+            return b.wait_time(self._clock())
+
+    def cancel(self, req_type: RequestType):
+        """Give back a reserved token, when the call was never made"""
+        with self._lock, self._shared(req_type) as b:
+            b.release()
+            b.tokens = min(b.capacity, b.tokens + 1)
+            b.cond.notify()
+
+    def commit(self, headers_dict, req_type: RequestType):
+        """Settle a reserved token with the response's rate limit headers"""
+        with self._lock, self._shared(req_type) as b:
+            b.refill(self._clock())
+            b.release()
+
+            # Some responses (errors, mostly) carry no rate limit information
+            if "X-RateLimit-Remaining" not in headers_dict:
+                if b.remaining > 0:
+                    b.remaining -= 1
+                return
+
+            rl = extract_ratelimit(headers_dict)
+            a_time = absolute_ally_time(rl["expire"]).timestamp()
+
+            # 1) If new endtime is later than our stored endtime, it's a new window
+            # 2) Otherwise only move forward, responses can arrive out of order
+            if b.expire is None or b.expire < a_time:
+                b.expire = a_time
+            elif b.used >= rl["used"]:
+                return
+
+            b.remaining = rl["remain"]
+            b.used = rl["used"]
+            if rl["limit"] > 0:
+                b.limit = rl["limit"]
+
+            # Never hold more than the API will honour
+            b.tokens = min(b.tokens, b.capacity, max(b.remaining - b.pending, 0))
+
+            # A fresh window: whoever watches the clock may be sleeping until
+            #  the old expiry, so wake everyone to work out their wait again
+            if b.remaining - b.pending >= 1:
+                b.cond.notify_all()
+
+    def force_update(self, req_type: RequestType):
+        """Halt all calls of this type for the rest of the window (HTTP 429)"""
+        with self._lock, self._shared(req_type) as b:
+            b.release()
+            b.remaining = 0
+            b.used = 0
+            b.tokens = 0.0
+
+            now = self._clock()
+            if b.expire is None or b.expire <= now:
+                b.expire = now + DEFAULT_WINDOW
+
+    def snapshot(self, req_type: RequestType):
+        """See snapshot()"""
+        with self._lock, self._shared(req_type) as b:
+            b.refill(self._clock())
+            return {
+                "expiration": None
+                if b.expire is None
+                else datetime.fromtimestamp(b.expire, tz=timezone.utc),
+                "remaining": b.remaining,
+                "used": b.used,
+                "pending": b.pending,
+                "budget": int(b.available()),
+            }
+
+
+# Shared by every request in the process
+limiter = RateLimiter()
 
 ########### METHODS
 
 
-def wait_until_ally_time(req_type):
-    """Blocks thread until certain type's reported expire time.
+def set_backend(backend: MemoryBackend):
+    """Chooses where rate limit budgets are kept.
+
+    Args:
+        backend:
+            MemoryBackend() (the default) to keep them in this process, or
+            FileBackend(path) to share one budget with every process on
+            this host that uses the same path.
+
+    Example:
+
+    .. code-block:: python
+
+        # In every worker process
+        ally.RateLimit.set_backend(
+            ally.RateLimit.FileBackend('/tmp/ally-ratelimit')
+        )
+
+    """
+    with limiter._lock:
+        limiter.backend = backend
+
+
+def reserve(req_type: RequestType, block: bool = True):
+    """Takes a rate limit token for a call about to be made.
+
+    Every reserve() must be followed by one of normal_update(), force_update()
+    or cancel(), once the call has been answered (or failed to go out).
+
+    Args:
+        req_type:
+            RequestType enum value
+
+        block:
+            Whether or not to block thread, or raise exception
+
+    Raises:
+        RateLimitException: if block=False and no token is available
+
+    """
+    limiter.reserve(req_type, block=block)
+
+
+def try_reserve(req_type: RequestType):
+    """Takes a rate limit token if one is free, without blocking.
+
+    Returns:
+        0.0 if a token was taken, otherwise the number of seconds to wait
+
+    """
+    return limiter.try_reserve(req_type)
+
+
+def cancel(req_type: RequestType):
+    """Gives back a token taken by reserve(), for a call never made."""
+    limiter.cancel(req_type)
+
+
+def wait_time(req_type):
+    """Returns number of seconds until a call of this type may be made.
 
     Args:
         req_type:
             RequestType
 
+    Returns:
+        float, 0.0 if the call can be made right now
+
     """
-    # Get our stuff in utc
-    now = datetime.now(tz=timezone.utc)
+    return limiter.wait_time(req_type)
 
-    # Get the time we have stored
-    a_time = _rl_exp_datetime[req_type.value]
 
-    # Make sure we have a valid time
-    if a_time is None:
-        a_time = now + timedelta(seconds=60.5)
+def wait_until_ally_time(req_type):
+    """Blocks thread until a call of this type may be made.
 
-    # Block thread
-    total_seconds = (a_time - now).total_seconds()
-    if total_seconds > 0:
-        time.sleep(total_seconds)
+    Args:
+        req_type:
+            RequestType
+
+    """
+    limiter.check(req_type, block=True)
 
 
 def check(req_type: RequestType, block: bool):
@@ -128,16 +573,8 @@ def check(req_type: RequestType, block: bool):
         block:
             Whether or not to block thread, or raise exception
 
-    Returns:
-        waittime: None, or datetime point in time when next call can occur
-
     """
-
-    if _rl_remaining.get(req_type.value) == 0:
-        if block:
-            wait_until_ally_time(req_type)
-        else:
-            raise RateLimitException("Too many attempts.")
+    limiter.check(req_type, block=block)
 
 
 def normal_update(headers_dict, req_type):
@@ -151,26 +588,7 @@ def normal_update(headers_dict, req_type):
             one of RequestType enum
 
     """
-    rl = extract_ratelimit(headers_dict)
-
-    # 1) Identify quote type
-    # 2) If new endtime is later than our stored endtime, overwrite
-    # 3) conditionally increment
-
-    now = datetime.now()
-    our_expire = _rl_exp_datetime[req_type.value]
-
-    a_time = absolute_ally_time(rl["expire"])
-
-    if our_expire is None or our_expire < a_time:
-
-        # Store the new date, and all new values
-        _rl_exp_datetime[req_type.value] = a_time
-        update_vals(rl, req_type.value)
-
-    # Only decrement
-    elif _rl_used[req_type.value] < rl["used"]:
-        update_vals(rl, req_type.value)
+    limiter.commit(headers_dict, req_type)
 
 
 def force_update(req_type):
@@ -183,7 +601,7 @@ def force_update(req_type):
             RequestType value
 
     """
-    update_vals({"remain": 0, "used": 0}, req_type.value)
+    limiter.force_update(req_type)
 
 
 def snapshot(req_type):
@@ -194,7 +612,9 @@ def snapshot(req_type):
             one of RequestType.{Order,Quote,Info}
 
     Returns:
-        dictionary, with keys ['used','remaining','expiration']
+        dictionary, with keys ['used','remaining','expiration','pending','budget'].
+        'remaining' is what the API last reported (-1 before the first response),
+        'budget' is how many calls we would allow right now.
 
     Example:
 
@@ -205,13 +625,10 @@ def snapshot(req_type):
         {
             'expiration': datetime.datetime(2020, 6, 22, 17, 5, 42, 55080, tzinfo=datetime.timezone.utc),
             'remaining': 56,
-            'used': 4
+            'used': 4,
+            'pending': 0,
+            'budget': 2
         }
 
     """
-
-    return {
-        "expiration": _rl_exp_datetime.get(req_type.value),
-        "remaining": _rl_remaining.get(req_type.value),
-        "used": _rl_used.get(req_type.value),
-    }
+    return limiter.snapshot(req_type)
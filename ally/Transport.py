@@ -0,0 +1,199 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Controls the HTTP connections shared by every endpoint
+
+All requests, signed or not, are sent through one requests.Session. Its
+connection pools keep connections to the API hosts open between calls, so
+only the first call to each host pays for the TCP and TLS handshakes.
+
+"""
+
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# Hosts to keep a pool for
+POOL_CONNECTIONS = 4
+
+# Idle connections kept open, per host
+POOL_MAXSIZE = 16
+
+# Attempts at a request that failed before reaching the server,
+#  or got a gateway error back. Only GETs are retried after being sent
+RETRIES = 2
+
+# Seconds between retries, doubling each time
+BACKOFF = 0.25
+
+_lock = threading.Lock()
+_session = None
+_stats = {"requests": 0, "connections": 0}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+class _CountingHTTPPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count("connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count("connections")
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that counts the connections it opens"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPPool,
+            "https": _CountingHTTPSPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        _count("requests")
+        return super().send(request, *args, **kwargs)
+
+
+def _build(pool_connections, pool_maxsize, pool_block, retries, backoff):
+    """Create a session with our adapter mounted"""
+    adapter = PooledAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            # 429 is left to the rate limiter
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        ),
+    )
+    s = Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def configure(
+    pool_connections: int = POOL_CONNECTIONS,
+    pool_maxsize: int = POOL_MAXSIZE,
+    pool_block: bool = False,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+):
+    """Rebuilds the shared connection pool.
+
+    Connections of the previous pool are closed, endpoints created
+    afterwards use the new one.
+
+    Args:
+            pool_connections:
+                    number of hosts to keep connections open to
+
+            pool_maxsize:
+                    idle connections kept open to each host. Raise this when
+                    more threads than that make calls at once
+
+            pool_block:
+                    True to make threads wait for a free connection once
+                    pool_maxsize are in use, rather than open another
+
+            retries:
+                    attempts at a failed connection, or a GET answered by a
+                    gateway error
+
+            backoff:
+                    seconds to wait before the first retry, doubling after
+
+    Returns:
+            The new requests.Session
+
+    Example:
+
+    .. code-block:: python
+
+            ally.Transport.configure(pool_maxsize=32, retries=0)
+
+    """
+    global _session
+    s = _build(pool_connections, pool_maxsize, pool_block, retries, backoff)
+    with _lock:
+        old, _session = _session, s
+    if old is not None:
+        old.close()
+    return s
+
+
+def session() -> Session:
+    """The requests.Session shared by all endpoints"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build(POOL_CONNECTIONS, POOL_MAXSIZE, False, RETRIES, BACKOFF)
+        return _session
+
+
+def stats():
+    """Reports how well connections are being reused.
+
+    Returns:
+            dict with the number of requests sent, connections opened,
+            requests that went over an already open connection, and the
+            fraction of requests that did.
+
+    .. code-block:: python
+
+            ally.Transport.stats()
+            # {'requests': 12, 'connections': 1, 'reused': 11, 'reuse_ratio': 0.9166}
+
+    """
+    with _lock:
+        requests, connections = _stats["requests"], _stats["connections"]
+    reused = max(0, requests - connections)
+    return {
+        "requests": requests,
+        "connections": connections,
+        "reused": reused,
+        "reuse_ratio": reused / requests if requests else 0.0,
+    }
+
+
+def reset_stats():
+    """Sets the counters of stats() back to zero"""
+    with _lock:
+        _stats["requests"] = 0
+        _stats["connections"] = 0
@@ -30,6 +30,60 @@ After setting up API keys, PyAlly can provide the basic/essential Ally brokerage
 
 Make sure to read the docss at https://alienbrett.github.io/PyAlly
 """
-from . import Account, Info, News, Option, Order, RateLimit, exception, utils
-from .Ally import Ally
+
+import importlib
+import sys
+import types
+
 from .classes import RequestType
+
+# Submodules, imported on first use (PEP 562)
+_submodules = {
+    "Account",
+    "Info",
+    "News",
+    "Option",
+    "Order",
+    "Quote",
+    "RateLimit",
+    "Transport",
+    "Watchlist",
+    "exception",
+    "schema",
+    "utils",
+}
+
+# Classes, and the submodule each one lives in
+_classes = {"Ally": ".Ally", "AsyncAlly": ".AsyncAlly"}
+
+__all__ = sorted(_submodules | _classes.keys() | {"RequestType"})
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing the ally.Ally module binds it to this very name,
+        #  keep the class there instead
+        if name in _classes and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+
+def __getattr__(name):
+    if name in _classes:
+        value = getattr(importlib.import_module(_classes[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name)
+        )
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
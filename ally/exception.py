@@ -51,6 +51,22 @@ class RateLimitException(Exception):
     pass
 
 
+class PartialResultException(Exception):
+    """Part of a request split into several failed.
+
+    What did arrive is in .results. What went wrong is in .errors, a
+    dictionary mapping each failed request to its exception. Requests are
+    keyed by what they asked for: a symbol for timesales_many(), a tuple
+    of symbols for a chunk of quote(), a (first, last) pair of
+    expirations for option_chain().
+    """
+
+    def __init__(self, message, results, errors):
+        super().__init__(message)
+        self.results = results
+        self.errors = errors
+
+
 # Order formatting exceptions
 
 
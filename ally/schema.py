@@ -0,0 +1,115 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Field types of the records each endpoint returns.
+
+Each schema maps a field name to the Field its column is read with: the
+dtype it always has, the strings that mean a value is missing, and the
+format of its dates. Columns keep the same dtype from one call to the next,
+whatever values happen to come back, so results can be concatenated and
+stored without conversions. Fields a schema doesn't list are kept as text.
+
+Dates are datetime64[D], times are datetime64[s] in UTC.
+
+Integers can't hold NaN. The integer fields of a quote are all counts,
+sizes and parts of dates, never negative, so a missing one reads as -1
+rather than a 0 that could be a real volume or open interest: test for it
+with `cols["vl"] < 0`. Elsewhere a missing integer is 0, so the volumes of
+timesales still add up into bars.
+"""
+
+from .utils.columnar import Field
+
+Float = Field("f8")
+Int = Field("i8")
+Count = Field("i8", fill=-1)
+Text = Field(object)
+Date = Field("M8[D]")
+CompactDate = Field("M8[D]", format="%Y%m%d")
+Time = Field("M8[s]", format="%Y-%m-%dT%H:%M:%S%z")
+
+
+def fields(names, field):
+    """The same Field for several names, given as one string"""
+    return {name: field for name in names.split()}
+
+
+# market/ext/quotes, and the option quotes of market/options/search
+QUOTE = {
+    **fields(
+        "adp_100 adp_200 adp_50 ask beta bid chg cl div dollar_value eps hi iad"
+        " idelta igamma imp_volatility irho itheta ivega last lo opn opt_val"
+        " pchg pcls pe phi plo popn pr_adp_100 pr_adp_200 pr_adp_50 prbook"
+        " prchg strikeprice volatility12 vwap wk52hi wk52lo yield",
+        Float,
+    ),
+    **fields(
+        "adv_21 adv_30 adv_90 asksz bidsz contract_size days_to_expiration"
+        " incr_vl openinterest pr_openinterest prem_mult pvol sho timestamp"
+        " tr_num vl xday xmonth xyear",
+        Count,
+    ),
+    **fields(
+        "ask_time basis bid_time bidtick chg_sign cusip divfreq exch exch_desc"
+        " issue_desc name op_delivery op_flag op_style op_subclass pchg_sign"
+        " put_call qcond rootsymbol secclass sesn symbol tcond tradetick trend"
+        " under_cusip undersymbol",
+        Text,
+    ),
+    **fields("date pr_date", Date),
+    **fields("divexdate divpaydt wk52hidate wk52lodate xdate", CompactDate),
+    "datetime": Time,
+}
+
+# market/timesales
+TIMESALES = {
+    **fields("hi last lo opn", Float),
+    **fields("incr_vl timestamp vl", Int),
+    "date": Date,
+    "datetime": Time,
+}
+
+# market/toplists
+TOPLIST = {
+    **fields("chg last pchg pcls", Float),
+    **fields("rank vl", Int),
+    **fields("chg_sign name symbol", Text),
+}
+
+# accounts/{id}/history, as flattened by History._process
+HISTORY = {
+    **fields("amount commission fee price quantity secfee", Float),
+    **fields("accounttype side", Int),
+    **fields("activity cusip desc description sectyp symbol transactiontype", Text),
+    "date": Date,
+}
+
+# accounts/{id}/holdings, as flattened by Holdings._flatten_holding
+HOLDING = {
+    **fields(
+        "costbasis gainloss lastprice marketvalue marketvaluechange price"
+        " purchaseprice qty",
+        Float,
+    ),
+    "accounttype": Int,
+    **fields("sym underlying", Text),
+}
@@ -20,11 +20,558 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import http.server
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
+from oauthlib.oauth1 import Client
+from requests import Request
+
+from ally import RateLimit, Transport
+from ally.Api import Endpoint, StreamEndpoint
+from ally.Auth import FastOAuth1
+from ally.Info import Clock
+from ally.Quote.stream import Stream
+from ally.Option.tests import *
 from ally.Order.tests import *
+from ally.Quote.tests import *
+from ally.RateLimit import FileBackend, RateLimiter, absolute_ally_time
+from ally.classes import RequestType
+from ally.exception import PartialResultException, RateLimitException
 from ally.tests import *
 from ally.utils.tests import *
 
+
+def ratelimit_headers(remain, used=0, limit=60, expire_in=60.0):
+    # Work backwards through the clock correction in absolute_ally_time
+    now = time.time()
+    skew = absolute_ally_time(now).timestamp() - now
+    return {
+        "X-RateLimit-Used": str(used),
+        "X-RateLimit-Expire": str(now + expire_in - skew),
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remain),
+    }
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_cold_burst(self):
+        r = RateLimiter()
+        admitted = 0
+        for i in range(60):
+            try:
+                r.reserve(RequestType.Quote, block=False)
+                admitted += 1
+            except RateLimitException:
+                pass
+
+        # A quarter of the documented 60/min, the rest is paced out
+        self.assertEqual(admitted, 15, "Cold burst is capped before any response")
+        self.assertGreater(r.wait_time(RequestType.Quote), 0.0)
+
+    def test_exhaust(self):
+        r = RateLimiter()
+        r.reserve(RequestType.Quote)
+        r.commit(ratelimit_headers(remain=2, used=58), RequestType.Quote)
+
+        r.reserve(RequestType.Quote, block=False)
+        r.reserve(RequestType.Quote, block=False)
+        with self.assertRaises(RateLimitException):
+            r.reserve(RequestType.Quote, block=False)
+
+        # Other types are unaffected
+        r.reserve(RequestType.Info, block=False)
+
+        # Giving one back frees it up again
+        r.cancel(RequestType.Quote)
+        r.reserve(RequestType.Quote, block=False)
+
+    def test_no_overbooking(self):
+        r = RateLimiter()
+        r.reserve(RequestType.Order)
+        r.commit(ratelimit_headers(remain=5, limit=40), RequestType.Order)
+
+        admitted = []
+
+        def job():
+            try:
+                r.reserve(RequestType.Order, block=False)
+                admitted.append(1)
+            except RateLimitException:
+                pass
+
+        threads = [threading.Thread(target=job) for i in range(50)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(len(admitted), 5, "Exactly the remaining tokens handed out")
+
+    def test_waiters_paced(self):
+        # 240/min: burst of 60, then 3 per second
+        r = RateLimiter(limits={RequestType.Quote: 240})
+        for i in range(60):
+            r.reserve(RequestType.Quote, block=False)
+
+        admitted = []
+
+        def job():
+            r.reserve(RequestType.Quote)
+            admitted.append(time.time())
+
+        start = time.time()
+        threads = [threading.Thread(target=job) for i in range(4)]
+        [t.start() for t in threads]
+        [t.join(timeout=3.0) for t in threads]
+
+        self.assertEqual(len(admitted), 4)
+        gaps = [b - a for a, b in zip([start] + admitted, admitted)]
+        for g in gaps:
+            self.assertGreater(g, 0.25, "Waiters admitted one token at a time")
+
+    def test_cancel_wakes_waiter(self):
+        r = RateLimiter()
+        r.reserve(RequestType.Quote)
+        r.commit(ratelimit_headers(remain=0), RequestType.Quote)
+
+        admitted = []
+        t = threading.Thread(
+            target=lambda: admitted.append(r.reserve(RequestType.Quote))
+        )
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(admitted, [], "Budget spent, must wait for window")
+
+        # The API reports budget again
+        r.commit(ratelimit_headers(remain=10, used=50), RequestType.Quote)
+        r.cancel(RequestType.Quote)
+        t.join(timeout=2.0)
+        self.assertEqual(len(admitted), 1)
+
+    def test_commit_wakes_waiter(self):
+        r = RateLimiter()
+        r.reserve(RequestType.Quote)
+        r.reserve(RequestType.Quote)
+        r.commit(ratelimit_headers(remain=0, expire_in=30.0), RequestType.Quote)
+
+        admitted = []
+        t = threading.Thread(
+            target=lambda: admitted.append(r.reserve(RequestType.Quote))
+        )
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(admitted, [], "Budget spent, must wait for window")
+
+        # A new window with budget, reported by the other call alone
+        r.commit(
+            ratelimit_headers(remain=50, used=10, expire_in=60.0), RequestType.Quote
+        )
+        t.join(timeout=3.0)
+        self.assertEqual(len(admitted), 1, "Woken long before the old expiry")
+
+
+def _shared_burst(path, n, out):
+    r = RateLimiter(backend=FileBackend(path))
+    admitted = 0
+    for i in range(n):
+        try:
+            r.reserve(RequestType.Quote, block=False)
+            admitted += 1
+        except RateLimitException:
+            pass
+    out.put(admitted)
+
+
+def _die_holding_lock(path):
+    FileBackend(path).lock().__enter__()
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs fork and flock")
+class TestSharedRateLimit(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.ctx = multiprocessing.get_context("fork")
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_one_budget(self):
+        out = self.ctx.Queue()
+        procs = [
+            self.ctx.Process(target=_shared_burst, args=(self.path, 60, out))
+            for i in range(4)
+        ]
+        [p.start() for p in procs]
+        [p.join(timeout=10) for p in procs]
+
+        total = sum(out.get(timeout=1) for p in procs)
+        self.assertEqual(total, 15, "Four processes share a single cold burst")
+
+    def test_survives_crash(self):
+        p = self.ctx.Process(target=_die_holding_lock, args=(self.path,))
+        p.start()
+        p.join(timeout=10)
+
+        # The kernel dropped the dead worker's lock
+        r = RateLimiter(backend=FileBackend(self.path))
+        r.reserve(RequestType.Quote, block=False)
+
+
+class _KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"response": {"date": "2020-01-01 00:00:00.000"}}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), _KeepAliveHandler
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/" % self.server.server_port
+        Transport.configure()
+        Transport.reset_stats()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_shared_session(self):
+        # Even auth-less endpoints use the shared session
+        self.assertIs(Clock().s, Transport.session())
+
+    def test_configure_reaches_ally(self):
+        import ally
+        from ally.Quote.quote import Quote
+
+        a = ally.Ally(
+            {
+                "ALLY_OAUTH_SECRET": "a",
+                "ALLY_OAUTH_TOKEN": "b",
+                "ALLY_CONSUMER_SECRET": "c",
+                "ALLY_CONSUMER_KEY": "d",
+                "ALLY_ACCOUNT_NBR": "1",
+            }
+        )
+        old = Quote(auth=a.auth, account_nbr=a.account_nbr, symbols="spy").s
+
+        # Configured after the Ally exists, still picked up
+        new = Transport.configure(pool_maxsize=3)
+        endpoint = Quote(auth=a.auth, account_nbr=a.account_nbr, symbols="spy")
+        self.assertIsNot(old, new)
+        self.assertIs(endpoint.s, new)
+        self.assertEqual(endpoint.s.get_adapter("https://")._pool_maxsize, 3)
+
+    def test_reuse(self):
+        for i in range(5):
+            Transport.session().get(self.url).raise_for_status()
+
+        stats = Transport.stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 4)
+
+
+class _StreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # One quote, then nothing for a long time
+        body = b'{"quote":{"symbol":"SPY"}}'
+        try:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+            self.wfile.flush()
+            time.sleep(5)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TestStreamClose(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StreamHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_close_wakes_reader(self):
+        endpoint = Stream(auth=None, symbols="spy")
+        endpoint.req.url = "http://127.0.0.1:%d/" % self.server.server_port
+
+        got = []
+
+        def read():
+            for message in endpoint.request():
+                got.append(message)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        while not got:
+            time.sleep(0.001)
+
+        start = time.monotonic()
+        endpoint.close()
+        reader.join(2)
+        self.assertFalse(reader.is_alive())
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(got, [{"quote": {"symbol": "SPY"}}])
+
+    def test_idle_timeout(self):
+        endpoint = Stream(auth=None, symbols="spy")
+        endpoint.req.url = "http://127.0.0.1:%d/" % self.server.server_port
+
+        connected = []
+        messages = endpoint.request(timeout=0.2, on_connect=lambda: connected.append(1))
+        self.assertEqual(next(messages), {"quote": {"symbol": "SPY"}})
+        self.assertEqual(connected, [1])
+
+        metrics = endpoint.metrics
+        self.assertEqual((metrics.connects, metrics.messages), (1, 1))
+        self.assertEqual(metrics.bytes, len(b'{"quote":{"symbol":"SPY"}}'))
+        self.assertEqual(metrics.decode.count, 1)
+
+        start = time.monotonic()
+        with self.assertRaises(Exception):
+            next(messages)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+KEYS = {
+    "ALLY_OAUTH_SECRET": "a",
+    "ALLY_OAUTH_TOKEN": "b",
+    "ALLY_CONSUMER_SECRET": "c",
+    "ALLY_CONSUMER_KEY": "d",
+    "ALLY_ACCOUNT_NBR": "1",
+}
+
+
+@unittest.skipIf(web is None, "needs aiohttp")
+class TestAsyncAlly(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from ally.AsyncAlly import AsyncAlly
+
+        app = web.Application()
+        app.router.add_post("/market/ext/quotes.json", self.quotes)
+        app.router.add_post("/market/quotes.json", self.stream)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        host = "http://127.0.0.1:%d/" % self.runner.addresses[0][1]
+
+        for cls in (Endpoint, StreamEndpoint):
+            patcher = mock.patch.object(cls, "_host", host)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # A budget of our own, untouched by other tests
+        patcher = mock.patch.object(RateLimit, "limiter", RateLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # First symbol of a request -> status to answer it with
+        self.status = {}
+        self.received = []
+        self.a = AsyncAlly(KEYS)
+
+    async def asyncTearDown(self):
+        await self.a.close()
+        await self.runner.cleanup()
+
+    async def quotes(self, request):
+        symbols = (await request.post())["symbols"].split(",")
+        self.received.append(symbols)
+        status = self.status.get(symbols[0], 200)
+        if status != 200:
+            return web.Response(status=status)
+
+        quotes = [{"symbol": s, "last": str(len(s))} for s in symbols]
+        return web.json_response(
+            {"response": {"quotes": {"quote": quotes}}},
+            headers=ratelimit_headers(remain=100, limit=120),
+        )
+
+    async def stream(self, request):
+        r = web.StreamResponse()
+        await r.prepare(request)
+
+        # Messages cut anywhere, as the network would
+        for piece in (
+            b'{"status":"connected"}{"quote":{"symbol":"SP',
+            b'Y","bid":"10.01"}}\n{"trade":',
+            b'{"symbol":"GLD","last":"20.5"}}',
+        ):
+            await r.write(piece)
+        await r.write_eof()
+        return r
+
+    async def test_quote_chunks(self):
+        symbols = ["S%03d" % i for i in range(450)]
+        result = await self.a.quote(symbols, dataframe=False)
+
+        # Three requests in flight at once, merged back in order
+        self.assertEqual(sorted(map(len, self.received)), [50, 200, 200])
+        self.assertEqual([q["symbol"] for q in result], symbols)
+
+        df = await self.a.quote(["SPY", "GLD"])
+        self.assertEqual(list(df.index), ["SPY", "GLD"])
+        self.assertEqual(RateLimit.snapshot(RequestType.Quote)["pending"], 0)
+
+    async def test_rate_limited(self):
+        self.status = {"spy": 429}
+        self.assertIsNone(await self.a.quote("spy", columnar=True))
+        self.assertEqual(len(self.received), 1)
+
+        # handle() saw the 429, and the rest of the window is off limits
+        self.assertEqual(RateLimit.snapshot(RequestType.Quote)["pending"], 0)
+        with self.assertRaises(RateLimitException):
+            await self.a.quote("spy", dataframe=False, block=False)
+        self.assertEqual(len(self.received), 1)
+
+    async def test_partial(self):
+        symbols = ["S%03d" % i for i in range(450)]
+        self.status = {"S000": 500, "S200": 429}
+        with self.assertRaises(PartialResultException) as cm:
+            await self.a.quote(symbols, dataframe=False)
+
+        # The chunk that did arrive is kept, the others say why not
+        e = cm.exception
+        self.assertEqual([q["symbol"] for q in e.results], symbols[400:])
+        self.assertEqual(sorted(chunk[0] for chunk in e.errors), ["S000", "S200"])
+        self.assertIsInstance(e.errors[tuple(symbols[200:400])], RateLimitException)
+
+        self.assertEqual(await self.a.quote([], dataframe=False), [])
+
+    async def test_unanswered(self):
+        await self.runner.cleanup()
+        with self.assertRaises(Exception):
+            await self.a.quote("spy", dataframe=False)
+
+        # Never answered, so the token was given back
+        self.assertEqual(RateLimit.snapshot(RequestType.Quote)["pending"], 0)
+
+    async def test_stream(self):
+        got = [m async for m in self.a.stream("spy,gld")]
+        self.assertEqual(
+            got,
+            [
+                {"quote": {"symbol": "SPY", "bid": "10.01"}},
+                {"trade": {"symbol": "GLD", "last": "20.5"}},
+            ],
+        )
+
+
+class TestFastOAuth1(unittest.TestCase):
+    keys = ("consumer key", "consumer/secret", "token+1", "token&secret~")
+    urls = [
+        ("GET", "https://devapi.invest.ally.com/v1/market/clock.json"),
+        (
+            "POST",
+            "https://devapi.invest.ally.com/v1/market/ext/quotes.json"
+            "?symbols=SPY%2CGLD&fids=bid,ask,symbol",
+        ),
+        ("GET", "https://DEVAPI.invest.ally.com:443/v1/x.json?b=%20y&a=2&a=1&z="),
+    ]
+
+    def test_matches_oauthlib(self):
+        f = FastOAuth1(*self.keys)
+        c = Client(
+            self.keys[0],
+            client_secret=self.keys[1],
+            resource_owner_key=self.keys[2],
+            resource_owner_secret=self.keys[3],
+            nonce="1234567890",
+            timestamp="1600000000",
+        )
+        for method, url in self.urls * 2:
+            _, headers, _ = c.sign(url, method)
+            self.assertEqual(
+                f.header(method, url, "1234567890", "1600000000"),
+                headers["Authorization"],
+                url,
+            )
+
+    def test_body_falls_back(self):
+        f = FastOAuth1(*self.keys)
+        r = Request("POST", self.urls[0][1], data={"a": "b"}).prepare()
+        with mock.patch.object(f, "_slow", side_effect=lambda r: r) as slow:
+            f(r)
+        slow.assert_called_once()
+
+        r = Request("POST", self.urls[1][1]).prepare()
+        f(r)
+        self.assertTrue(r.headers["Authorization"].startswith("OAuth oauth_nonce="))
+
+
+def import_times(statement):
+    """Run a statement in a fresh interpreter under -X importtime
+
+    Returns:
+        dict of module name to cumulative import time, in microseconds
+    """
+    env = {k: v for k, v in os.environ.items() if not k.startswith("ALLY_")}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+
+    times = {}
+    for line in out.splitlines():
+        parts = line.split("|")
+        if line.startswith("import time:") and parts[1].strip().isdigit():
+            times[parts[2].strip()] = int(parts[1])
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+    heavy = ("requests", "pandas", "pytz", "pendulum", "aiohttp", "unittest")
+
+    def test_import_ally(self):
+        # Also, no keys needed to import
+        times = import_times("import ally")
+        for m in self.heavy:
+            self.assertNotIn(m, times, "import ally pulled in " + m)
+
+    def test_lazy_class(self):
+        times = import_times(
+            "import ally.Ally, ally; assert isinstance(ally.Ally, type)"
+        )
+        self.assertIn("requests", times)
+        self.assertNotIn("pandas", times)
+
+
 if __name__ == "__main__":
     unittest.main()
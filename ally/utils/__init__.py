@@ -20,7 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from . import tests
+from .columnar import NA, Field, column, columnar
 from .json import *
+from .metrics import StreamMetrics
 from .option import *
 from .utils import *
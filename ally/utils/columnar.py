@@ -0,0 +1,235 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Builds typed numpy columns straight from parsed API responses.
+
+The API sends every value as a string. Rather than building a DataFrame of
+strings and then asking pandas to guess a type for each column, the values
+of each field are collected once and converted in a single numpy call, as
+the Field declared for it in the endpoint's schema says.
+"""
+
+from datetime import datetime, timezone
+from itertools import chain
+from operator import itemgetter
+
+# Strings the API sends in place of a missing value
+NA = ("na", "")
+
+# Value a missing entry gets, by numpy dtype kind
+_fills = {"f": float("nan"), "i": 0, "u": 0, "M": "NaT", "O": None}
+
+
+class Field:
+    """How to read one field of an API record.
+
+    Args:
+        dtype: numpy dtype of the column, always. object for text
+        na: strings that stand for a missing value
+        fill: what missing (or unreadable) values become. Defaults to NaN
+            for floats, 0 for integers, NaT for dates and None for text.
+            Integers that can't be negative are better off with -1, which
+            can't be mistaken for a value
+        format: strptime format of dates and times, None for ISO 8601.
+            Times with an offset are converted to UTC
+    """
+
+    __slots__ = ("spec", "na", "format", "_fill", "_dtype")
+
+    def __init__(self, dtype, na=NA, fill=None, format=None):
+        # Schemas are declared at import, numpy is left until first use
+        self.spec = dtype
+        self.na = tuple(na)
+        self.format = format
+        self._fill = fill
+        self._dtype = None
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            import numpy as np
+
+            self._dtype = np.dtype(self.spec)
+        return self._dtype
+
+    @property
+    def fill(self):
+        return _fills[self.dtype.kind] if self._fill is None else self._fill
+
+    def __repr__(self):
+        return "Field({0!r}, format={1!r})".format(self.spec, self.format)
+
+    def _missing(self, s):
+        """Mask of the missing entries of an object array"""
+        import numpy as np
+
+        missing = np.equal(s, None)
+        for na in self.na:
+            missing |= s == na
+        return missing
+
+    def convert(self, values):
+        """Turn a sequence of raw values into a numpy array of our dtype"""
+        import numpy as np
+
+        kind = self.dtype.kind
+
+        # Fast path, nothing missing
+        if kind in "fiu" or (kind == "M" and self.format is None):
+            try:
+                return np.array(values, dtype=self.dtype)
+            except (ValueError, TypeError):
+                pass
+
+        s = np.empty(len(values), dtype=object)
+        s[:] = values
+        missing = self._missing(s)
+
+        if kind == "O":
+            s[missing] = self.fill
+            return s
+
+        if kind == "M":
+            return self._dates(s, missing)
+
+        s[missing] = self.fill
+        try:
+            return s.astype(self.dtype)
+        except (ValueError, TypeError):
+            return self._each(s, float if kind == "f" else _int)
+
+    def _dates(self, s, missing):
+        """Parse the present dates all at once, through ISO 8601"""
+        import numpy as np
+
+        out = np.full(len(s), self.fill, dtype=self.dtype)
+        present = s[~missing]
+
+        try:
+            if self.format is None:
+                out[~missing] = present.astype(self.dtype)
+            elif self.format == "%Y%m%d":
+                out[~missing] = [v[:4] + "-" + v[4:6] + "-" + v[6:] for v in present]
+            elif self.format == "%Y-%m-%dT%H:%M:%S%z":
+                local = np.array([v[:19] for v in present], dtype="M8[s]")
+                offset = np.array([_offset(v[19:]) for v in present], dtype="m8[s]")
+                out[~missing] = local - offset
+            else:
+                out[~missing] = [_strptime(v, self.format) for v in present]
+        except (ValueError, TypeError):
+            s[missing] = None
+            return self._each(s, lambda v: _strptime(v, self.format))
+
+        return out
+
+    def _each(self, s, parse):
+        """Slow path, one value at a time, anything unreadable filled"""
+        import numpy as np
+
+        out = []
+        for v in s:
+            try:
+                out.append(self.fill if v is None else parse(v))
+            except (ValueError, TypeError):
+                out.append(self.fill)
+        return np.array(out, dtype=self.dtype)
+
+
+def _int(v):
+    """int(), that also reads '12.0'"""
+    try:
+        return int(v)
+    except ValueError:
+        return int(float(v))
+
+
+def _offset(tz):
+    """Seconds east of UTC, from '-04:00', '+0530' or 'Z'"""
+    if tz in ("", "Z"):
+        return 0
+    sign = -1 if tz[0] == "-" else 1
+    tz = tz[1:].replace(":", "")
+    return sign * (int(tz[:2]) * 3600 + int(tz[2:4] or 0) * 60)
+
+
+def _strptime(v, format):
+    """Parse a date, as a naive UTC datetime"""
+    if format is None:
+        d = datetime.fromisoformat(v)
+    else:
+        d = datetime.strptime(v, format)
+    if d.tzinfo is not None:
+        d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
+
+
+# Fields a schema doesn't know are kept as text
+TEXT = Field(object)
+
+
+def column(values, field=None):
+    """Turn one field's values into a numpy array.
+
+    Args:
+        values: sequence of the field's values, as the API sent them
+        field: Field to read them with, or None for text
+    """
+    return (field or TEXT).convert(values)
+
+
+def columnar(raw, schema=None, drop=()):
+    """Turn a list of API records into typed numpy columns.
+
+    Args:
+        raw: list of dictionaries, one per record
+        schema: dictionary of field name to Field. Fields it leaves out are
+            kept as text
+        drop: names of fields to leave out
+
+    Returns:
+        dictionary of field name to numpy array, in the order the fields
+        first appear in the records
+    """
+    import numpy as np
+
+    schema = schema or {}
+
+    if isinstance(raw, dict):
+        raw = [raw]
+
+    if not raw:
+        return {
+            name: np.empty(0, dtype=field.dtype)
+            for name, field in schema.items()
+            if name not in drop
+        }
+
+    names = [k for k in dict.fromkeys(chain.from_iterable(raw)) if k not in drop]
+
+    # Transpose the records in one go, when every record has every field
+    try:
+        get = itemgetter(*names)
+        values = zip(*map(get, raw)) if len(names) > 1 else [list(map(get, raw))]
+    except KeyError:
+        values = ([row.get(name) for row in raw] for name in names)
+
+    return {name: column(v, schema.get(name)) for name, v in zip(names, values)}
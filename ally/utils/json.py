@@ -20,11 +20,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import codecs
 import json
 import re
 
 nonspace = re.compile(r"\S")
 
+# Refuse to hold more than this many undecoded characters
+#  (a healthy stream message is a few hundred bytes)
+MAX_BUFFER = 1 << 20
+
 ############################################################################
 class JSONStreamParser:
     """Iteratively decode a JSON string into an object.
@@ -72,3 +77,62 @@ class JSONStreamParser:
                 raise StopIteration
             else:
                 yield x
+
+
+class JSONStreamDecoder:
+    """Incrementally decode a stream of concatenated JSON objects.
+
+    Meant to be fed whole chunks straight off the socket, rather than
+    single characters. Each call to feed() returns every object completed
+    by that chunk, and drops the consumed input, so the internal buffer
+    never holds more than one partial object.
+    """
+
+    def __init__(self, max_buffer: int = MAX_BUFFER):
+        self.decoder = json.JSONDecoder()
+        self.max_buffer = max_buffer
+
+        # Multi-byte characters can be split across chunks
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+
+    def __len__(self):
+        """Number of characters waiting for the rest of their object"""
+        return len(self._buf)
+
+    def feed(self, chunk):
+        """Decode a chunk of bytes (or str), and return list of finished objects"""
+        if isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk)
+
+        s = self._buf + chunk if self._buf else chunk
+        raw_decode = self.decoder.raw_decode
+        out = []
+        pos = 0
+
+        while True:
+            matched = nonspace.search(s, pos)
+
+            # Only whitespace left
+            if matched is None:
+                pos = len(s)
+                break
+
+            # Decode one object, or wait for the rest of it
+            try:
+                obj, pos = raw_decode(s, matched.start())
+            except ValueError:
+                pos = matched.start()
+                break
+
+            out.append(obj)
+
+        # Throw away everything we have consumed
+        self._buf = s[pos:]
+
+        if len(self._buf) > self.max_buffer:
+            raise ValueError(
+                "Undecodable stream data: {0}...".format(self._buf[:64])
+            )
+
+        return out
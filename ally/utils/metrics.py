@@ -0,0 +1,260 @@
+# MIT License
+#
+# Copyright (c) 2020 Brett Graves
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Throughput and latency counters for streams, with no dependencies.
+
+A StreamMetrics is updated by the stream as chunks arrive, and read from
+any thread, as a dictionary or in the Prometheus text exposition format.
+"""
+
+import bisect
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+DECODE_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2, 0.1)
+LAG_BUCKETS = (0.5, 1, 2, 3, 5, 10, 30, 60, 300)
+
+# Seconds of history message and byte rates are averaged over
+WINDOW = 10
+
+
+class Histogram:
+    """Counts of observations per bucket, Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, n: int = 1):
+        """Count value n times"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += n
+        self.sum += value * n
+        self.count += n
+
+    def quantile(self, q: float):
+        """Estimated q-quantile, interpolated within its bucket. None if empty"""
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    # Past the last bucket, nothing better than its bound
+                    return lo
+                return lo + (self.buckets[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def cumulative(self):
+        """(upper bound, observations at or below it), ending with +Inf"""
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            yield bound, total
+
+
+class _Rate:
+    """Events per second over the last WINDOW seconds, in one second slots"""
+
+    def __init__(self, window: int = WINDOW):
+        self.slots = [0] * window
+        self.second = 0
+
+    def add(self, n, now: float):
+        second = int(now)
+        if second != self.second:
+            # Clear the slots skipped since last time
+            for s in range(
+                max(self.second + 1, second - len(self.slots) + 1), second + 1
+            ):
+                self.slots[s % len(self.slots)] = 0
+            self.second = second
+        self.slots[second % len(self.slots)] += n
+
+    def rate(self, now: float):
+        second = int(now)
+        window = len(self.slots)
+
+        # Only slots still inside the window, without the current partial second
+        total = sum(
+            self.slots[s % window]
+            for s in range(second - window + 1, second)
+            if self.second - window < s <= self.second
+        )
+        return total / (window - 1)
+
+
+class StreamMetrics:
+    """Messages, bytes, decode time, lag and reconnects of one or more streams.
+
+    Lag is how long after its exchange timestamp a message was received.
+    Those timestamps are in whole seconds, so lag is too coarse to tell
+    apart anything under a second.
+
+    Example:
+
+    .. code-block:: python
+
+            for quote in a.stream(universe):
+                    ...
+            a.stream_metrics.as_dict()['lag_p99']
+            print(a.stream_metrics.prometheus())
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+        self.messages = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.gaps = 0
+
+        self.decode = Histogram(DECODE_BUCKETS)
+        self.lag = Histogram(LAG_BUCKETS)
+        self._messages = _Rate()
+        self._bytes = _Rate()
+
+        # name -> callable returning a number, read on export
+        self.gauges = {}
+
+    def chunk(self, size: int, rows, decode: float, now: float = None):
+        """Record a chunk of size bytes, decoded into rows in decode seconds"""
+        if now is None:
+            now = time.time()
+
+        # Exchange timestamps are whole seconds, so a chunk's rows mostly
+        #  share one: observe each distinct timestamp once
+        stamps = {}
+        for row in rows:
+            tick = row.get("quote") or row.get("trade")
+            if tick:
+                ts = tick.get("timestamp")
+                stamps[ts] = stamps.get(ts, 0) + 1
+
+        with self._lock:
+            self.chunks += 1
+            self.bytes += size
+            self.messages += len(rows)
+            self._bytes.add(size, now)
+            self._messages.add(len(rows), now)
+            self.decode.observe(decode)
+
+            for ts, n in stamps.items():
+                try:
+                    self.lag.observe(now - int(ts), n)
+                except (TypeError, ValueError):
+                    pass
+
+    def count(self, name: str, n: int = 1):
+        """Add to the connects, reconnects or gaps counter"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def watch(self, name: str, gauge):
+        """Export gauge(), say a queue's depth, under name"""
+        self.gauges[name] = gauge
+
+    def as_dict(self):
+        """Every metric, as a flat dictionary"""
+        now = time.time()
+        with self._lock:
+            result = {
+                "uptime": now - self.started,
+                "messages": self.messages,
+                "bytes": self.bytes,
+                "chunks": self.chunks,
+                "messages_per_second": self._messages.rate(now),
+                "bytes_per_second": self._bytes.rate(now),
+                "connects": self.connects,
+                "reconnects": self.reconnects,
+                "gaps": self.gaps,
+            }
+            for name, h in (("decode", self.decode), ("lag", self.lag)):
+                result[name + "_mean"] = h.sum / h.count if h.count else None
+                for q in (50, 90, 99):
+                    result["{0}_p{1}".format(name, q)] = h.quantile(q / 100)
+
+        for name, gauge in self.gauges.items():
+            result[name] = gauge()
+        return result
+
+    def prometheus(self, prefix: str = "ally_stream", labels: dict = None) -> str:
+        """Every metric, in the Prometheus text exposition format"""
+        d = self.as_dict()
+        base = ",".join('{0}="{1}"'.format(k, v) for k, v in (labels or {}).items())
+
+        def sample(name, value, extra=""):
+            tags = ",".join(t for t in (base, extra) if t)
+            return "{0}_{1}{2} {3}".format(
+                prefix, name, "{" + tags + "}" if tags else "", value
+            )
+
+        lines = []
+        for name, kind, help in (
+            ("messages_total", "counter", "Messages received"),
+            ("bytes_total", "counter", "Bytes received"),
+            ("chunks_total", "counter", "Chunks read off the socket"),
+            ("connects_total", "counter", "Connections opened"),
+            ("reconnects_total", "counter", "Reconnects after a connection dropped"),
+            ("gaps_total", "counter", "Connections lost"),
+            ("messages_per_second", "gauge", "Messages per second, recently"),
+            ("bytes_per_second", "gauge", "Bytes per second, recently"),
+        ):
+            key = name[: -len("_total")] if name.endswith("_total") else name
+            lines += [
+                "# HELP {0}_{1} {2}".format(prefix, name, help),
+                "# TYPE {0}_{1} {2}".format(prefix, name, kind),
+                sample(name, d[key]),
+            ]
+
+        with self._lock:
+            for name, h, help in (
+                ("decode_seconds", self.decode, "Time to decode a chunk"),
+                ("lag_seconds", self.lag, "Receipt time behind exchange timestamp"),
+            ):
+                lines += [
+                    "# HELP {0}_{1} {2}".format(prefix, name, help),
+                    "# TYPE {0}_{1} histogram".format(prefix, name),
+                ]
+                for bound, n in h.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(sample(name + "_bucket", n, 'le="{0}"'.format(le)))
+                lines += [
+                    sample(name + "_sum", h.sum),
+                    sample(name + "_count", h.count),
+                ]
+
+        for name in self.gauges:
+            lines += [
+                "# TYPE {0}_{1} gauge".format(prefix, name),
+                sample(name, d[name]),
+            ]
+        return "\n".join(lines) + "\n"
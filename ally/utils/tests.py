@@ -22,6 +22,10 @@
 
 import unittest
 
+from ..schema import QUOTE
+from .columnar import Field, columnar
+from .json import *
+from .metrics import Histogram, StreamMetrics
 from .option import *
 
 
@@ -91,3 +95,169 @@ class TestOptionFormat(unittest.TestCase):
         self.assertEqual(
             option_maturity(sym), "2020-07-24", "Extract the expiration date"
         )
+
+
+class TestJSONStreamDecoder(unittest.TestCase):
+    raw = (
+        b'{"status":"connected"}\n'
+        b'{"quote":{"ask":"10.01","bid":"10.00","symbol":"F"}}'
+        b'{"trade":{"last":"10.00","symbol":"F","vl":"100"}} '
+        b'{"quote":{"symbol":"\xc3\xa9"}}'
+    )
+
+    def test_whole_chunk(self):
+        d = JSONStreamDecoder()
+        rows = d.feed(self.raw)
+        self.assertEqual(len(rows), 4, "Four objects in one chunk")
+        self.assertEqual(rows[2]["trade"]["vl"], "100")
+        self.assertEqual(len(d), 0, "Nothing left over")
+
+    def test_split_chunks(self):
+        # Every possible split point, including inside the utf-8 character
+        for i in range(len(self.raw)):
+            d = JSONStreamDecoder()
+            rows = d.feed(self.raw[:i]) + d.feed(self.raw[i:])
+            self.assertEqual(len(rows), 4, "Split at {0}".format(i))
+            self.assertEqual(rows[3]["quote"]["symbol"], "\u00e9")
+
+    def test_buffer_trimmed(self):
+        d = JSONStreamDecoder()
+        d.feed(self.raw + b'{"quote":{"sym')
+        self.assertEqual(len(d), len('{"quote":{"sym'), "Only partial object kept")
+
+    def test_garbage(self):
+        d = JSONStreamDecoder(max_buffer=16)
+        with self.assertRaises(ValueError):
+            d.feed(b"not json at all, not json at all")
+
+
+class TestColumnar(unittest.TestCase):
+    raw = [
+        {"symbol": "SPY", "bid": "1.50", "vl": "100", "name": "SPDR", "x": "7"},
+        {"symbol": "GLD", "bid": "na", "vl": "200", "name": "na", "x": "8"},
+        {"symbol": "F", "bid": "", "vl": "na", "name": "FORD", "y": "a"},
+    ]
+    schema = {
+        "symbol": Field(object),
+        "bid": Field("f8"),
+        "vl": Field("i8"),
+        "name": Field(object),
+    }
+
+    def test_types(self):
+        cols = columnar(self.raw, self.schema)
+
+        self.assertEqual(list(cols), ["symbol", "bid", "vl", "name", "x", "y"])
+        self.assertEqual(cols["bid"].dtype.kind, "f")
+        self.assertEqual(cols["bid"][0], 1.5)
+        self.assertTrue(all(v != v for v in cols["bid"][1:]), "na and empty")
+        self.assertEqual(list(cols["name"]), ["SPDR", None, "FORD"])
+
+    def test_stable(self):
+        # Same dtypes, whatever is missing
+        for raw in (self.raw, self.raw[:2], self.raw[2:], []):
+            cols = columnar(raw, self.schema)
+            self.assertEqual(cols["vl"].dtype.kind, "i")
+            self.assertEqual(cols["bid"].dtype.kind, "f")
+
+        self.assertEqual(list(columnar(self.raw, self.schema)["vl"]), [100, 200, 0])
+
+    def test_quote_counts(self):
+        # A missing count can't pass for a real zero
+        cols = columnar(self.raw, QUOTE)
+        self.assertEqual(list(cols["vl"]), [100, 200, -1])
+        self.assertEqual(list(cols["vl"] < 0), [False, False, True])
+
+    def test_unknown_is_text(self):
+        cols = columnar(self.raw, self.schema)
+        self.assertEqual(list(cols["x"]), ["7", "8", None])
+        self.assertEqual(list(cols["y"]), [None, None, "a"])
+
+    def test_dates(self):
+        raw = [
+            {"d": "2020-08-21", "c": "20200918", "t": "2020-08-21T09:30:00-04:00"},
+            {"d": "na", "c": "", "t": "na"},
+            {"d": "2020-08-24", "c": "bad", "t": "2020-08-21T13:30:00Z"},
+        ]
+        cols = columnar(
+            raw,
+            {
+                "d": Field("M8[D]"),
+                "c": Field("M8[D]", format="%Y%m%d"),
+                "t": Field("M8[s]", format="%Y-%m-%dT%H:%M:%S%z"),
+            },
+        )
+        self.assertEqual(
+            [str(x) for x in cols["d"]], ["2020-08-21", "NaT", "2020-08-24"]
+        )
+        self.assertEqual([str(x) for x in cols["c"]], ["2020-09-18", "NaT", "NaT"])
+
+        # UTC
+        self.assertEqual(str(cols["t"][0]), "2020-08-21T13:30:00")
+        self.assertEqual(cols["t"][0], cols["t"][2])
+
+
+class TestStreamMetrics(unittest.TestCase):
+    def test_histogram(self):
+        h = Histogram((1, 2, 4))
+        for x in (0.5, 1.5, 1.5, 3, 10):
+            h.observe(x)
+
+        self.assertEqual(h.counts, [1, 2, 1, 1])
+        self.assertEqual((h.count, h.sum), (5, 16.5))
+        self.assertEqual(list(h.cumulative())[-1], (float("inf"), 5))
+
+        # Interpolated within the bucket
+        self.assertAlmostEqual(h.quantile(0.5), 1.75)
+        self.assertAlmostEqual(h.quantile(0.2), 1)
+        self.assertEqual(h.quantile(1), 4)
+        self.assertIsNone(Histogram((1,)).quantile(0.5))
+
+    def test_chunk(self):
+        m = StreamMetrics()
+        now = 1000000.5
+        rows = [
+            {"quote": {"symbol": "SPY", "timestamp": "999998"}},
+            {"trade": {"symbol": "SPY"}},
+            {"status": "connected"},
+        ]
+        for second in range(10):
+            m.chunk(100, rows, 2e-5, now + second)
+
+        self.assertEqual((m.chunks, m.messages, m.bytes), (10, 30, 1000))
+        self.assertEqual((m.decode.count, m.lag.count), (10, 10))
+        self.assertEqual(m.lag.sum, sum(2.5 + s for s in range(10)))
+
+        # Full seconds of the window only
+        self.assertEqual(m._messages.rate(now + 9), 3)
+        self.assertEqual(m._bytes.rate(now + 9), 100)
+        self.assertEqual(m._messages.rate(now + 14), 5 * 3 / 9)
+        self.assertEqual(m._messages.rate(now + 30), 0)
+
+    def test_export(self):
+        m = StreamMetrics()
+        m.chunk(26, [{"quote": {"timestamp": "0"}}], 3e-5)
+        m.count("reconnects", 2)
+        m.watch("queue_depth", lambda: 7)
+
+        d = m.as_dict()
+        self.assertEqual((d["messages"], d["bytes"], d["reconnects"]), (1, 26, 2))
+        self.assertEqual(d["queue_depth"], 7)
+        self.assertEqual(d["lag_p50"], 300)
+        self.assertLess(d["decode_p99"], 5e-5)
+
+        text = m.prometheus(labels={"stream": "main"})
+        lines = text.splitlines()
+        self.assertIn("# TYPE ally_stream_messages_total counter", lines)
+        self.assertIn('ally_stream_messages_total{stream="main"} 1', lines)
+        self.assertIn('ally_stream_reconnects_total{stream="main"} 2', lines)
+        self.assertIn('ally_stream_queue_depth{stream="main"} 7', lines)
+        self.assertIn("# TYPE ally_stream_lag_seconds histogram", lines)
+        self.assertIn(
+            'ally_stream_decode_seconds_bucket{stream="main",le="5e-05"} 1', lines
+        )
+        self.assertIn(
+            'ally_stream_lag_seconds_bucket{stream="main",le="+Inf"} 1', lines
+        )
+        self.assertIn('ally_stream_lag_seconds_count{stream="main"} 1', lines)
+        self.assertTrue(text.endswith("\n"))
@@ -0,0 +1,104 @@
+"""Measures how fast BarBuilder turns streamed trades into bars.
+
+Builds decoded stream() trade messages for a set of symbols, a few trades a
+second each, and times feeding them through BarBuilder against keeping a
+dictionary of bar state per symbol in plain Python.
+
+    python benchmarks/bar_builder.py
+    python benchmarks/bar_builder.py --symbols 256 --trades 500000
+"""
+
+import argparse
+import random
+import time
+
+from ally.Quote.bars import BarBuilder
+
+# 2020-08-18 9:30 New York time
+OPEN = 1597757400
+
+
+def make_trades(n_symbols, n_trades, rng):
+    """Trade messages as the stream decoder hands them over"""
+    symbols = ["S{0:03d}".format(i) for i in range(n_symbols)]
+    per_second = n_symbols * 4
+    return symbols, [
+        {
+            "trade": {
+                "cvol": str(rng.randint(1, 10**7)),
+                "datetime": "2020-08-18T09:30:00-04:00",
+                "exch": {},
+                "last": "{0:.2f}".format(100 + rng.random()),
+                "symbol": symbols[rng.randrange(n_symbols)],
+                "timestamp": str(OPEN + i // per_second),
+                "vl": str(rng.randint(1, 500)),
+                "vwap": "100.00",
+            }
+        }
+        for i in range(n_trades)
+    ]
+
+
+def with_dicts(symbols, messages):
+    """Bars kept as a dictionary per symbol, closed as each one's minute ends"""
+    bars, closed = {}, []
+    for message in messages:
+        tick = message.get("trade")
+        if tick is None:
+            continue
+        price, size = float(tick["last"]), int(tick["vl"])
+        start = int(tick["timestamp"]) // 60 * 60
+        bar = bars.get(tick["symbol"])
+        if bar is None or bar["start"] != start:
+            if bar is not None:
+                closed.append(bar)
+            bar = bars[tick["symbol"]] = {
+                "start": start,
+                "opn": price,
+                "hi": price,
+                "lo": price,
+                "vol": 0,
+                "pv": 0.0,
+                "count": 0,
+            }
+        bar["hi"] = max(bar["hi"], price)
+        bar["lo"] = min(bar["lo"], price)
+        bar["last"] = price
+        bar["vol"] += size
+        bar["pv"] += price * size
+        bar["count"] += 1
+    return closed
+
+
+def with_builder(symbols, messages):
+    """BarBuilder, collecting every batch of closed bars"""
+    return list(BarBuilder(symbols, "1min").run(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=256)
+    parser.add_argument("--trades", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    symbols, messages = make_trades(args.symbols, args.trades, random.Random(0))
+    print("{0} trades, {1} symbols".format(len(messages), len(symbols)))
+
+    for name, f in (("dict per symbol", with_dicts), ("BarBuilder", with_builder)):
+        best = min(_timed(f, symbols, messages) for i in range(args.repeat))
+        print(
+            "{0:>16} {1:>10.1f} ms {2:>12,.0f} trades/s".format(
+                name, best * 1000, len(messages) / best
+            )
+        )
+
+
+def _timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compares a TopOfBook against keeping the latest quotes in dictionaries.
+
+Feeds decoded stream() messages through TopOfBook and through a dictionary
+of the latest fields per symbol, then times taking a snapshot of the whole
+universe from each: columns copied out of the book, against building a
+DataFrame out of the dictionaries.
+
+    python benchmarks/book.py
+    python benchmarks/book.py --symbols 1500 --messages 500000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from ally.Quote.book import TopOfBook
+
+from stream_decode import make_messages
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def with_dicts(messages, latest):
+    for message in messages:
+        for kind, tick in message.items():
+            latest.setdefault(tick["symbol"], {}).update(tick)
+
+
+def with_book(messages, book):
+    for message in messages:
+        book.feed(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=1500)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    messages = [
+        json.loads(m)
+        for m in make_messages(args.symbols, args.messages, random.Random(0))
+    ]
+    print("{0} messages, {1} symbols".format(len(messages), args.symbols))
+
+    import pandas as pd
+
+    latest, book = {}, TopOfBook()
+    for name, f, state, snapshot in (
+        ("dicts", with_dicts, latest, lambda: pd.DataFrame.from_dict(latest, "index")),
+        ("TopOfBook", with_book, book, book.snapshot),
+    ):
+        feed = timed(f, messages, state)
+        snap = min(timed(snapshot) for i in range(args.repeat))
+        print(
+            "{0:>10}  {1:>12,.0f} msg/s  snapshot {2:>8.3f} ms".format(
+                name, len(messages) / feed, snap * 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compares the ways of turning a large option chain into a table.
+
+Builds a synthetic chain of option quotes, as search() extracts them, then
+times the old DataFrame path (strings, then pd.to_numeric on every column)
+against the typed columns of Search.Columns, and the DataFrame built on them.
+
+    python benchmarks/columnar.py
+    python benchmarks/columnar.py --rows 20000 --repeat 5
+"""
+
+import argparse
+import random
+import time
+
+from ally.Option.search import Search
+from ally.schema import QUOTE
+
+
+def make_chain(rows, rng):
+    """Option quotes with every schema field, as strings like the API sends"""
+    chain = []
+    for i in range(rows):
+        row = {}
+        for name, field in QUOTE.items():
+            kind = field.dtype.kind
+            if kind == "f":
+                row[name] = "{0:.2f}".format(rng.random() * 100)
+            elif kind == "i":
+                row[name] = str(rng.randrange(100000))
+            elif field.format == "%Y%m%d":
+                row[name] = "202009{0:02d}".format(rng.randrange(1, 29))
+            elif kind == "M" and field.format:
+                row[name] = "2020-09-01T{0:02d}:30:00-04:00".format(rng.randrange(24))
+            elif kind == "M":
+                row[name] = "2020-09-{0:02d}".format(rng.randrange(1, 29))
+            else:
+                row[name] = "text{0}".format(rng.randrange(100))
+
+            # The API leaves plenty of fields blank
+            if rng.random() < 0.05:
+                row[name] = "na"
+        row["symbol"] = "SPY{0:06d}C".format(i)
+        chain.append(row)
+    return chain
+
+
+def legacy(raw):
+    """Search.DataFrame as it used to be"""
+    import pandas as pd
+
+    return (
+        pd.DataFrame(raw)
+        .replace({"na": None})
+        .apply(pd.to_numeric, errors="ignore")
+        .set_index("symbol")
+        .drop(columns="basis")
+    )
+
+
+def best(f, raw, repeat):
+    """Fastest of several runs, in milliseconds"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        f(raw)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = make_chain(args.rows, random.Random(0))
+    print("{0} rows, {1} fields".format(len(raw), len(raw[0])))
+
+    for name, f in (
+        ("legacy DataFrame", legacy),
+        ("Search.Columns", Search.Columns),
+        ("Search.DataFrame", Search.DataFrame),
+    ):
+        print("{0:>18} {1:>10.1f} ms".format(name, best(f, raw, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Reports how long `import ally` takes, and what it spends the time on.
+
+Each statement runs in a fresh interpreter under `python -X importtime`.
+Under each total, the slowest modules it pulled in are listed by
+cumulative time. Modules the interpreter loads at startup are left out.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --top 20 --repeat 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STATEMENTS = [
+    "import ally",
+    "import ally; ally.Ally",
+    "import ally; ally.Ally; from ally.Quote.quote import Quote; Quote.DataFrame([{'symbol': 'A'}])",
+]
+
+TIMED = """
+import time
+start = time.perf_counter()
+{0}
+print(time.perf_counter() - start)
+"""
+
+
+def run(statement):
+    """Seconds taken, and cumulative microseconds of each module imported"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TIMED.format(statement)],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if line.startswith("import time:") and parts[1].strip().isdigit():
+            modules[parts[2].strip()] = int(parts[1])
+    return float(out.stdout), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    startup = run("pass")[1]
+
+    for statement in STATEMENTS:
+        runs = [run(statement) for i in range(args.repeat)]
+        total = statistics.median(t for t, m in runs) * 1000
+        print("{0:<76} {1:>8.1f} ms".format(statement[:76], total))
+
+        modules = {k: v for k, v in runs[-1][1].items() if k not in startup}
+        slowest = sorted(modules.items(), key=lambda kv: -kv[1])
+        for name, us in slowest[: args.top]:
+            print("    {0:<72} {1:>8.1f} ms".format(name, us / 1000))
+
+
+if __name__ == "__main__":
+    main()
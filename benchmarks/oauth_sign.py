@@ -0,0 +1,57 @@
+"""Measures the cost of signing one request.
+
+Prepares the same kind of quote request over and over, signed once by
+requests_oauthlib.OAuth1 and once by ally.Auth.FastOAuth1, and prints the
+time per request of each.
+
+    python benchmarks/oauth_sign.py
+    python benchmarks/oauth_sign.py --requests 50000 --symbols 20
+"""
+
+import argparse
+import time
+
+from requests import Request
+from requests_oauthlib import OAuth1
+
+from ally.Auth import FastOAuth1
+
+KEYS = ("consumer-key", "consumer-secret", "oauth-token", "oauth-secret")
+URL = "https://devapi.invest.ally.com/v1/market/ext/quotes.json"
+
+
+def per_request(auth, requests, params):
+    """Seconds spent preparing and signing one request"""
+    req = Request("POST", URL, params=params, auth=auth)
+
+    start = time.perf_counter()
+    for i in range(requests):
+        req.prepare()
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--symbols", type=int, default=10)
+    args = parser.parse_args()
+
+    params = {
+        "symbols": ",".join("S{0:03d}".format(i) for i in range(args.symbols)),
+        "fids": "bid,ask,last,symbol",
+    }
+
+    # Neither signs anything, the floor both share
+    base = per_request(None, args.requests, params)
+    slow = per_request(
+        OAuth1(*KEYS, signature_type="auth_header"), args.requests, params
+    )
+    fast = per_request(FastOAuth1(*KEYS), args.requests, params)
+
+    print("{0:>14} {1:>12} {2:>12}".format("", "us/request", "signing us"))
+    for name, t in (("unsigned", base), ("OAuth1", slow), ("FastOAuth1", fast)):
+        print("{0:>14} {1:>12.1f} {2:>12.1f}".format(name, t * 1e6, (t - base) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
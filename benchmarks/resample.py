@@ -0,0 +1,97 @@
+"""Compares rolling 1 minute bars up to 30 minutes with pandas and numpy.
+
+Builds a long table of synthetic 1 minute timesales bars for many symbols,
+as timesales_many(..., columnar=True) returns them, then times the usual
+pandas groupby/resample (with a VWAP column) against ally.Quote.bars.
+
+    python benchmarks/resample.py
+    python benchmarks/resample.py --symbols 500 --days 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from ally.Quote.bars import resample
+
+
+def make_bars(symbols, days, rng):
+    """Session 1 minute bars, 9:30 to 16:00 New York time in August"""
+    minutes = np.arange(390) * np.timedelta64(60, "s")
+    opens = np.datetime64("2020-08-17T13:30:00") + np.arange(days) * np.timedelta64(
+        1, "D"
+    )
+    times = (opens[:, None] + minutes).ravel()
+
+    n = len(times) * symbols
+    last = 100 + rng.standard_normal(n).cumsum() * 0.01
+    return {
+        "symbol": np.repeat(
+            np.array(["S{0:04d}".format(i) for i in range(symbols)], dtype=object),
+            len(times),
+        ),
+        "datetime": np.tile(times, symbols),
+        "opn": last - 0.01,
+        "hi": last + 0.02,
+        "lo": last - 0.02,
+        "last": last,
+        "incr_vl": rng.integers(1, 1000, n),
+    }
+
+
+def with_pandas(cols):
+    """What users did before: groupby symbol, resample, then vwap"""
+    import pandas as pd
+
+    df = pd.DataFrame(cols).set_index("datetime")
+    df["datetime"] = df.index
+    df["pv"] = (df["hi"] + df["lo"] + df["last"]) / 3 * df["incr_vl"]
+    df.index = df.index.tz_localize("UTC").tz_convert("America/New_York")
+    bars = (
+        df.groupby("symbol")
+        .resample("30min", offset="30min")
+        .agg(
+            {
+                "opn": "first",
+                "hi": "max",
+                "lo": "min",
+                "last": "last",
+                "incr_vl": "sum",
+                "pv": "sum",
+            }
+        )
+    )
+    bars["vwap"] = bars["pv"] / bars["incr_vl"]
+    return bars.dropna()
+
+
+def best(f, cols, repeat):
+    """Fastest of several runs, in milliseconds"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        f(cols)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cols = make_bars(args.symbols, args.days, np.random.default_rng(0))
+    print("{0} bars".format(len(cols["datetime"])))
+
+    for name, f in (
+        ("pandas resample", with_pandas),
+        ("bars.resample", lambda c: resample(c, "30min")),
+    ):
+        print("{0:>16} {1:>10.1f} ms".format(name, best(f, cols, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
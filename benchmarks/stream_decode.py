@@ -0,0 +1,165 @@
+"""Replays a synthetic 256-symbol quote stream through the stream decoder.
+
+Prints message throughput and resident memory at a fixed interval, so that
+a long run (eg. --duration 14400 for four hours) shows whether either drifts.
+
+    python benchmarks/stream_decode.py --duration 60
+    python benchmarks/stream_decode.py --duration 10 --legacy
+    python benchmarks/stream_decode.py --duration 10 --metrics
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import time
+
+from ally.utils.json import JSONStreamDecoder, JSONStreamParser
+from ally.utils.metrics import StreamMetrics
+
+
+def rss_mb():
+    """Current resident set size, in megabytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Peak, rather than current, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def make_messages(n_symbols, n_messages, rng):
+    """Build a pool of encoded quote and trade messages"""
+    symbols = ["S{0:03d}".format(i) for i in range(n_symbols)]
+    out = []
+    for i in range(n_messages):
+        sym = symbols[i % n_symbols]
+        px = 100 + rng.random()
+        if i % 3:
+            msg = {
+                "quote": {
+                    "ask": "{0:.2f}".format(px + 0.01),
+                    "asksz": str(rng.randint(1, 50)),
+                    "bid": "{0:.2f}".format(px),
+                    "bidsz": str(rng.randint(1, 50)),
+                    "datetime": "2020-06-22T10:00:00-04:00",
+                    "exch": {},
+                    "qcond": "REGULAR",
+                    "symbol": sym,
+                    "timestamp": "1592834400",
+                }
+            }
+        else:
+            msg = {
+                "trade": {
+                    "cvol": str(rng.randint(1, 10**7)),
+                    "datetime": "2020-06-22T10:00:00-04:00",
+                    "exch": {},
+                    "last": "{0:.2f}".format(px),
+                    "symbol": sym,
+                    "timestamp": "1592834400",
+                    "vl": str(rng.randint(1, 500)),
+                    "vwap": "{0:.2f}".format(px),
+                }
+            }
+        out.append(json.dumps(msg, separators=(",", ":")).encode())
+    return out
+
+
+def chunked(blob, rng, max_chunk):
+    """Cut a blob at random points, like a socket would"""
+    i = 0
+    while i < len(blob):
+        n = rng.randint(1, max_chunk)
+        yield blob[i : i + n]
+        i += n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds")
+    parser.add_argument("--symbols", type=int, default=256)
+    parser.add_argument("--max-chunk", type=int, default=4096, help="bytes")
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="feed JSONStreamParser one byte at a time, as the old stream did",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="record into a StreamMetrics, as StreamEndpoint.request does",
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pool = make_messages(args.symbols, 20000, rng)
+    blob = b"\n".join(pool)
+    chunks = list(chunked(blob, rng, 1 if args.legacy else args.max_chunk))
+
+    if args.legacy:
+        p = JSONStreamParser()
+
+        def feed(chunk):
+            # Mirrors the old StreamEndpoint.request loop
+            it = p.stream(chunk.decode("utf-8"))
+            try:
+                return [next(it)]
+            except (StopIteration, RuntimeError):
+                return []
+
+    else:
+        feed = JSONStreamDecoder().feed
+
+    metrics = StreamMetrics()
+    if args.metrics:
+        decode = feed
+        clock = time.perf_counter
+
+        def feed(chunk):
+            start = clock()
+            rows = decode(chunk)
+            metrics.chunk(len(chunk), rows, clock() - start)
+            return rows
+
+    print(
+        "{0:>10} {1:>12} {2:>10} {3:>9}".format(
+            "elapsed", "msgs/sec", "MB/sec", "rss MB"
+        )
+    )
+
+    start = last = time.perf_counter()
+    msgs = nbytes = 0
+    for i, chunk in enumerate(itertools.cycle(chunks)):
+        msgs += len(feed(chunk))
+        nbytes += len(chunk)
+
+        # Don't let the clock dominate the profile
+        if i % 256:
+            continue
+
+        now = time.perf_counter()
+        if now - last >= args.interval:
+            dt = now - last
+            print(
+                "{0:>10.1f} {1:>12,.0f} {2:>10.2f} {3:>9.1f}".format(
+                    now - start, msgs / dt, nbytes / dt / 2**20, rss_mb()
+                ),
+                flush=True,
+            )
+            last = now
+            msgs = nbytes = 0
+
+        if now - start >= args.duration:
+            break
+
+    if args.metrics:
+        print(metrics.prometheus())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compares recording stream() messages to a tape against JSON lines.
+
+Builds decoded quote and trade messages, then times writing them with
+TickRecorder and replaying them with TickTape, against dumping and loading
+one JSON document per line, and compares file sizes.
+
+    python benchmarks/tape.py
+    python benchmarks/tape.py --messages 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from ally.Quote.tape import TickRecorder, TickTape
+
+from stream_decode import make_messages
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=256)
+    parser.add_argument("--messages", type=int, default=200000)
+    args = parser.parse_args()
+
+    messages = [
+        json.loads(m)
+        for m in make_messages(args.symbols, args.messages, random.Random(0))
+    ]
+    print("{0} messages, {1} symbols".format(len(messages), args.symbols))
+
+    with tempfile.TemporaryDirectory() as d:
+        tape, lines = os.path.join(d, "t.tape"), os.path.join(d, "t.jsonl")
+
+        def record():
+            with TickRecorder(tape) as rec:
+                for m in messages:
+                    rec.write(m)
+
+        def dump():
+            with open(lines, "w") as f:
+                for m in messages:
+                    f.write(json.dumps(m) + "\n")
+
+        def replay():
+            for m in TickTape(tape).replay():
+                pass
+
+        def load():
+            with open(lines) as f:
+                for line in f:
+                    json.loads(line)
+
+        for name, write, read, path in (
+            ("tape", record, replay, tape),
+            ("json lines", dump, load, lines),
+        ):
+            w, r = timed(write), timed(read)
+            print(
+                "{0:>10}  write {1:>7.0f} ms  replay {2:>7.0f} ms  "
+                "{3:>12,.0f} msg/s  {4:>6.1f} MB".format(
+                    name,
+                    w * 1000,
+                    r * 1000,
+                    len(messages) / r,
+                    os.path.getsize(path) / 1e6,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compares stream() dictionaries with typed ticks, by memory and GC.
+
+Decodes a stream of quote and trade messages, as stream() does, and keeps
+the last --window of them around, like a consumer with some history
+would. Measures, for plain dictionaries and for stream(typed=True) ticks:
+time, allocations per tick, memory held, and the garbage collector's
+pauses.
+
+    python benchmarks/ticks.py
+    python benchmarks/ticks.py --messages 500000 --window 200000
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from collections import deque
+
+from ally.Quote.ticks import ticks
+from ally.utils import JSONStreamDecoder
+
+from stream_decode import make_messages
+
+
+def chunks(blob, size=4096):
+    """stream()'s messages, decoded out of one blob as if from a socket"""
+    decoder = JSONStreamDecoder()
+    for i in range(0, len(blob), size):
+        yield from decoder.feed(blob[i : i + size])
+
+
+def run(messages, window):
+    """Consume messages, keeping the last window of them"""
+    kept = deque(maxlen=window)
+    for m in messages:
+        kept.append(m)
+    return kept
+
+
+def measure(name, make, window):
+    pauses = []
+
+    def on_gc(phase, info, start=[0.0]):
+        if phase == "start":
+            start[0] = time.perf_counter()
+        else:
+            pauses.append(time.perf_counter() - start[0])
+
+    # Timing, with the collector running as usual
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    start = time.perf_counter()
+    kept = run(make(), window)
+    elapsed = time.perf_counter() - start
+    gc.callbacks.remove(on_gc)
+    n = len(kept)
+    del kept
+
+    # Allocations, separately since tracing slows everything down
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = run(make(), window)
+    held = tracemalloc.get_traced_memory()[0]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(s.count for s in after.compare_to(before, "filename") if s.count > 0)
+
+    print(
+        "{0:>6}  {1:>7.0f} ms  {2:>5.1f} objects/kept msg  {3:>7.1f} MB held  "
+        "{4:>4} collections, {5:>6.1f} ms total, {6:>5.1f} ms worst".format(
+            name,
+            elapsed * 1000,
+            blocks / n,
+            held / 1e6,
+            len(pauses),
+            sum(pauses) * 1000,
+            max(pauses, default=0) * 1000,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=256)
+    parser.add_argument("--messages", type=int, default=300000)
+    parser.add_argument("--window", type=int, default=100000)
+    args = parser.parse_args()
+
+    blob = b"".join(make_messages(args.symbols, args.messages, random.Random(0)))
+    print("{0} messages, keeping the last {1}".format(args.messages, args.window))
+
+    measure("dicts", lambda: chunks(blob), args.window)
+    measure("ticks", lambda: ticks(chunks(blob)), args.window)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ setuptools.setup(
     url="https://github.com/alienbrett/PyAlly",
     packages=setuptools.find_packages(),
     install_requires=["pandas", "pytz", "requests", "requests-oauthlib"],
+    extras_require={"async": ["aiohttp"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",